@@ -157,6 +157,12 @@ structlog.configure(structlog_processors)
 cache = flask_caching.Cache(app, config=app.config.get('CACHE_CONFIG'))
 # (Setting up requests cache dynamically in controllers.py)
 
+#
+# Hash uploaded files as they arrive, spooling big ones to disk (see uploads.py)
+#
+from hxl_proxy import uploads
+app.request_class = uploads.UploadRequest
+
 #
 # Needed to register annotations (save until last)
 #
@@ -0,0 +1,420 @@
+"""Memory-bounded, vectorised count filter for the HXL Proxy.
+
+libhxl-python's hxl.filters.CountFilter keeps a deep copy of every
+Aggregator for every group, and updates them one row at a time. The
+VectorCountFilter class in this module reads rows in batches, assigns
+each row a group number, and accumulates counts, sums, and averages
+for a whole batch at once with NumPy. The min, max, and concat
+aggregators still work row by row, in Python.
+
+If there are more than max_groups groups, the partial aggregates are
+sorted by key and spilled to disk (see hxl_proxy.spill), then merged
+by key on output.
+
+Started October 2026
+License: Public Domain
+"""
+
+import copy, heapq, hxl, logging, operator
+import hxl.filters
+import numpy as np
+from hxl_proxy import spill
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+DEFAULT_MAX_GROUPS = 100000
+""" Default maximum number of groups to aggregate in memory """
+
+BATCH_SIZE = 10000
+""" Number of rows to read before updating the numeric aggregates """
+
+VECTOR_TYPES = ('count', 'sum', 'average',)
+""" Aggregator types that VectorCountFilter computes with NumPy """
+
+MAX_EXACT_INT = 2 ** 53
+""" Integers from here up may lose precision in a float sum """
+
+MAX_BATCH_INT = 2 ** 40
+""" Integers from here up are added as Python ints (a batch of smaller ones can't overflow int64) """
+
+MAX_INT_SUM = 2 ** 62
+""" Running int64 sums that could pass this move to Python ints """
+
+MAX_MEMO_SIZE = 100000
+""" Maximum number of parsed values to remember per aggregator """
+
+
+class VectorCountFilter(hxl.filters.CountFilter):
+    """Count filter with batched NumPy aggregation and a group limit.
+
+    Takes the same arguments as hxl.filters.CountFilter, and produces
+    the same rows, sorted by key, with these differences:
+
+    - averages are computed as sum / count, rather than with a running
+      average, so they may differ from libhxl's in the last decimal
+      place
+    - if the groups were spilled to disk, floating-point sums are added
+      run by run, so they may differ in the last decimal place too
+
+    Usage:
+        source = VectorCountFilter(hxl.data(url), '#org', 'sum(#affected)')
+
+    """
+
+    def __init__(self, source, patterns, aggregators=None, queries=[], max_groups=None):
+        """
+        Args:
+            source (hxl.Dataset): the HXL data source
+            patterns (list): TagPattern objects (or a string) for the groups
+            aggregators (list): Aggregator objects or specs (default: count rows)
+            queries (list): RowQuery objects or strings to select the rows to count
+            max_groups (int): maximum groups to hold in memory (default: DEFAULT_MAX_GROUPS)
+
+        """
+        super().__init__(source, patterns, aggregators, queries)
+        self.max_groups = max_groups if max_groups is not None else DEFAULT_MAX_GROUPS
+
+    def filter_rows(self):
+        """Return the aggregated rows, sorted by key.
+
+        The result is either a list, or a replayable _MergedGroups
+        object if the groups had to be spilled to disk.
+
+        """
+        aggregation = _Aggregation(self.aggregators)
+        runs = None
+
+        source_columns = self.source.columns
+        key_indices = [_find_indices(pattern, source_columns) for pattern in self.patterns]
+        value_indices = [
+            _find_indices(aggregator.pattern, source_columns) if aggregator.pattern else []
+            for aggregator in self.aggregators
+        ]
+
+        for row in self.source:
+            if not hxl.model.RowQuery.match_list(row, self.queries):
+                continue
+            values = row.values
+            key = tuple(
+                hxl.datatypes.normalise_space(_first_value(values, indices, ''))
+                for indices in key_indices
+            )
+            aggregation.add_row(key, row, [_first_value(values, indices) for indices in value_indices])
+            if len(aggregation.groups) > self.max_groups:
+                if runs is None:
+                    runs = _MergedGroups(self.aggregators)
+                runs.spill.write_run(aggregation.make_records())
+                aggregation = _Aggregation(self.aggregators, aggregation.memos)
+
+        if runs is None:
+            return [_make_row(record, self.aggregators) for record in aggregation.make_records()]
+
+        runs.spill.write_run(aggregation.make_records())
+        logger.info(
+            "Aggregated %d partial groups in %d runs on disk",
+            runs.spill.record_count, len(runs.spill.paths)
+        )
+        return runs
+
+    @property
+    def is_cached(self):
+        """Rows may be replayed from disk rather than memory"""
+        return False
+
+    @staticmethod
+    def _load(source, spec):
+        """Create a new count filter from a dict spec (as in hxl.filters.CountFilter)"""
+        return VectorCountFilter(
+            source=source,
+            patterns=hxl.filters.opt_arg(spec, 'patterns'),
+            aggregators=hxl.filters.opt_arg(spec, 'aggregators', None),
+            queries=hxl.filters.opt_arg(spec, 'queries', [])
+        )
+
+
+class _Aggregation:
+    """Partial aggregates for the groups seen since the last spill.
+
+    Each group has a number (its index in the NumPy arrays). For each
+    numeric aggregator, we keep a float sum, an exact integer sum (used
+    when all of the values were integers, as in libhxl), the number of
+    values, and whether any of them was a float.
+
+    """
+
+    def __init__(self, aggregators, memos=None):
+        self.aggregators = aggregators
+        self.groups = {}
+        self.py_aggregators = []
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.numeric = [
+            _NumericState() if aggregator.type in VECTOR_TYPES and aggregator.type != 'count' else None
+            for aggregator in aggregators
+        ]
+        self.memos = memos if memos is not None else [{} for aggregator in aggregators]
+        self.batch_groups = []
+
+    def add_row(self, key, row, values):
+        """Add a row to its group.
+        Args:
+            key (tuple): the normalised group key
+            row (hxl.model.Row): the row (for Python-only aggregators)
+            values (list): the raw value for each aggregator's pattern (or None)
+        """
+        group = self.groups.get(key)
+        if group is None:
+            group = len(self.groups)
+            self.groups[key] = group
+            self.py_aggregators.append([
+                None if aggregator.type in VECTOR_TYPES else copy.deepcopy(aggregator)
+                for aggregator in self.aggregators
+            ])
+        self.batch_groups.append(group)
+
+        for i, aggregator in enumerate(self.aggregators):
+            state = self.numeric[i]
+            if state is not None:
+                number = self._parse_number(i, aggregator, values[i])
+                if number is not None:
+                    state.append(group, number)
+            elif aggregator.type != 'count':
+                self.py_aggregators[group][i].evaluate_row(row)
+
+        if len(self.batch_groups) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Update the NumPy aggregates from the current batch."""
+        size = len(self.groups)
+        self.counts = _grow(self.counts, size)
+        if self.batch_groups:
+            self.counts += np.bincount(np.asarray(self.batch_groups, dtype=np.intp), minlength=size)
+        self.batch_groups = []
+        for state in self.numeric:
+            if state is not None:
+                state.flush(size)
+
+    def make_records(self):
+        """Flush, and return a (key, count, numeric, python) record per group, sorted by key."""
+        self.flush()
+        records = []
+        for key, group in self.groups.items():
+            records.append((
+                key,
+                int(self.counts[group]),
+                [state.get(group) if state is not None else None for state in self.numeric],
+                self.py_aggregators[group],
+            ))
+        records.sort(key=operator.itemgetter(0))
+        return records
+
+    def _parse_number(self, i, aggregator, value):
+        """Parse a value for sum or average, as Aggregator.evaluate_row() would.
+        Returns None if libhxl would skip the value. Results are memoised per aggregator.
+        """
+        if hxl.datatypes.is_empty(value):
+            return None
+        memo = self.memos[i]
+        if value in memo:
+            return memo[value]
+        if hxl.datatypes.typeof(value, aggregator.pattern) != 'number':
+            logger.warning("Cannot use %s as a numeric value for aggregation; skipping.", value)
+            number = None
+        else:
+            number = hxl.datatypes.normalise(value, aggregator.pattern)
+        if len(memo) >= MAX_MEMO_SIZE:
+            memo.clear()
+        memo[value] = number
+        return number
+
+
+class _NumericState:
+    """NumPy accumulators for one sum or average aggregator.
+
+    Integer sums are exact: large integers, and groups whose int64 sum
+    gets near the limit, are added up as Python ints instead (in
+    big_sums), since NumPy would silently wrap around.
+    """
+
+    def __init__(self):
+        self.float_sums = np.zeros(0, dtype=np.float64)
+        self.int_sums = np.zeros(0, dtype=np.int64)
+        self.big_sums = {}
+        self.totals = np.zeros(0, dtype=np.int64)
+        self.has_float = np.zeros(0, dtype=bool)
+        self.batch_groups = []
+        self.batch_values = []
+        self.batch_ints = []
+        self.batch_is_float = []
+
+    def append(self, group, number):
+        is_float = isinstance(number, float) or abs(number) >= MAX_EXACT_INT
+        self.batch_groups.append(group)
+        self.batch_values.append(float(number))
+        self.batch_is_float.append(is_float)
+        if is_float:
+            self.batch_ints.append(0)
+        elif abs(number) >= MAX_BATCH_INT:
+            self.big_sums[group] = self.big_sums.get(group, 0) + number
+            self.batch_ints.append(0)
+        else:
+            self.batch_ints.append(number)
+
+    def flush(self, size):
+        self.float_sums = _grow(self.float_sums, size)
+        self.int_sums = _grow(self.int_sums, size)
+        self.totals = _grow(self.totals, size)
+        self.has_float = _grow(self.has_float, size)
+        if not self.batch_groups:
+            return
+
+        groups = np.asarray(self.batch_groups, dtype=np.intp)
+        values = np.asarray(self.batch_values, dtype=np.float64)
+        is_float = np.asarray(self.batch_is_float, dtype=bool)
+
+        # bincount adds the weights in input order, so prepending the
+        # running totals gives the same sequential sum as libhxl
+        self.float_sums = np.bincount(
+            np.concatenate((np.arange(size, dtype=np.intp), groups)),
+            weights=np.concatenate((self.float_sums, values)),
+            minlength=size
+        )
+
+        # each value is below MAX_BATCH_INT, so a batch's sums fit in int64
+        batch_sums = np.zeros(size, dtype=np.int64)
+        np.add.at(batch_sums, groups, np.asarray(self.batch_ints, dtype=np.int64))
+        at_risk = np.abs(self.int_sums) > MAX_INT_SUM - np.abs(batch_sums)
+        for group in np.flatnonzero(at_risk):
+            group = int(group)
+            self.big_sums[group] = self.big_sums.get(group, 0) + int(self.int_sums[group]) + int(batch_sums[group])
+        self.int_sums = np.where(at_risk, 0, self.int_sums + np.where(at_risk, 0, batch_sums))
+
+        self.totals += np.bincount(groups, minlength=size)
+        self.has_float |= np.bincount(groups, weights=is_float, minlength=size) > 0
+
+        self.batch_groups = []
+        self.batch_values = []
+        self.batch_ints = []
+        self.batch_is_float = []
+
+    def get(self, group):
+        """Return (float_sum, int_sum, total, has_float) as Python values for a group."""
+        return (
+            float(self.float_sums[group]),
+            int(self.int_sums[group]) + self.big_sums.get(group, 0),
+            int(self.totals[group]),
+            bool(self.has_float[group]),
+        )
+
+
+class _MergedGroups:
+    """Replayable merge of partial aggregates spilled to temporary files.
+
+    The temporary files are removed when this object is garbage
+    collected (i.e. when the filter that owns it goes away).
+
+    """
+
+    def __init__(self, aggregators):
+        self.aggregators = aggregators
+        self.spill = spill.SpillDirectory('count')
+
+    def __iter__(self):
+        """Merge the runs by key again on every iteration."""
+        merged = heapq.merge(*self.spill.read_runs(), key=operator.itemgetter(0))
+        current = None
+        for record in merged:
+            if current is not None and current[0] == record[0]:
+                current = _combine_records(current, record)
+            else:
+                if current is not None:
+                    yield _make_row(current, self.aggregators)
+                current = record
+        if current is not None:
+            yield _make_row(current, self.aggregators)
+
+
+def _combine_records(a, b):
+    """Combine partial aggregates for the same key (a from earlier rows than b)."""
+    numeric = []
+    for state_a, state_b in zip(a[2], b[2]):
+        if state_a is None:
+            numeric.append(None)
+        else:
+            numeric.append((
+                state_a[0] + state_b[0],
+                state_a[1] + state_b[1],
+                state_a[2] + state_b[2],
+                state_a[3] or state_b[3],
+            ))
+    py_aggregators = []
+    for aggregator_a, aggregator_b in zip(a[3], b[3]):
+        if aggregator_a is not None:
+            _combine_aggregators(aggregator_a, aggregator_b)
+        py_aggregators.append(aggregator_a)
+    return (a[0], a[1] + b[1], numeric, py_aggregators)
+
+
+def _combine_aggregators(a, b):
+    """Fold Aggregator b (later rows) into Aggregator a (earlier rows)."""
+    def gt(x, y):
+        try:
+            return x > y
+        except TypeError:
+            return str(x) > str(y)
+
+    a.total += b.total
+    if a.type in ('min', 'max',):
+        if b.normalised is not None:
+            if a.normalised is None or (gt(a.normalised, b.normalised) if a.type == 'min' else gt(b.normalised, a.normalised)):
+                a.value = b.value
+                a.normalised = b.normalised
+    elif a.type == 'concat':
+        a.values |= b.values
+        if a.values:
+            a.value = "|".join(sorted(a.values))
+
+
+def _find_indices(pattern, columns):
+    """Return the indices of all the columns matching a pattern."""
+    return [index for index, column in enumerate(columns) if pattern.match(column)]
+
+
+def _first_value(values, indices, default=None):
+    """Return the first non-empty value at indices, like hxl.model.Row.get()"""
+    for index in indices:
+        if index >= len(values):
+            break
+        if values[index]:
+            return values[index]
+    return default
+
+
+def _grow(array, size):
+    """Pad a NumPy array with zeros to size."""
+    if len(array) < size:
+        array = np.concatenate((array, np.zeros(size - len(array), dtype=array.dtype)))
+    return array
+
+
+def _make_row(record, aggregators):
+    """Make the output values for an aggregated record."""
+    key, count, numeric, py_aggregators = record
+    values = list(key)
+    for aggregator, state, py_aggregator in zip(aggregators, numeric, py_aggregators):
+        if py_aggregator is not None:
+            value = py_aggregator.value
+        elif state is None:
+            value = count
+        else:
+            float_sum, int_sum, total, has_float = state
+            value = float_sum if has_float else int_sum
+            if total == 0:
+                value = None
+            elif aggregator.type == 'average':
+                value = value / total
+        values.append(value if value is not None else '')
+    return values
+
+# end
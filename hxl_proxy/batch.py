@@ -0,0 +1,132 @@
+"""Batch validation for the HXL Proxy.
+
+Quality-assurance jobs validate hundreds of datasets against the same
+schema. Instead of one /actions/validate request for each dataset
+(each fetching and compiling the schema again), the
+/actions/validate-batch controller compiles the schema once, then
+validates the datasets concurrently in a bounded thread pool, each
+against its own copy of the schema.
+
+The datasets can come from a list of URLs, or from the HXL-tagged
+resources of an HDX organisation (see get_organization_urls()).
+
+Started October 2026
+License: Public Domain
+"""
+
+import ckanapi, concurrent.futures, copy, hxl_proxy, logging, re, werkzeug
+from contextvars import copy_context
+from hxl_proxy import util, validate
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+DEFAULT_MAX_DATASETS = 500
+""" Default maximum number of datasets in one batch """
+
+DEFAULT_WORKERS = 4
+""" Default number of datasets to validate at the same time """
+
+HDX_HXL_QUERY = 'vocab_Topics:hxl'
+""" CKAN filter query for HDX datasets tagged as HXL """
+
+HDX_FORMATS = ('csv', 'json', 'xls', 'xlsx',)
+""" HDX resource formats that the proxy can validate """
+
+HDX_PAGE_SIZE = 100
+""" Number of HDX datasets to request at once """
+
+HDX_NAME_PATTERN = re.compile(r'^[a-z0-9_-]{2,100}$')
+""" CKAN's pattern for organisation names (checked before they go into a Solr query) """
+
+
+def get_max_datasets():
+    """@returns: the maximum number of datasets in one batch (app.config["BATCH_MAX_DATASETS"])"""
+    return int(hxl_proxy.app.config.get('BATCH_MAX_DATASETS', DEFAULT_MAX_DATASETS))
+
+
+def get_organization_urls(organization, max_count):
+    """Get the URLs of the HXL-tagged resources of an HDX organisation.
+    The CKAN API comes from app.config["HDX_BASE_URL"].
+    @param organization: the HDX organisation's name (e.g. "ocha-fts")
+    @param max_count: the maximum number of URLs to return
+    @returns: a list of resource URLs
+    @raises werkzeug.exceptions.BadRequest: if the organisation name isn't a valid CKAN name
+    @raises ckanapi.errors.CKANAPIError: if the CKAN API request fails
+    """
+    if not isinstance(organization, str) or not HDX_NAME_PATTERN.match(organization):
+        raise werkzeug.exceptions.BadRequest("Not a valid HDX organisation name: {}".format(organization))
+    base_url = hxl_proxy.app.config.get('HDX_BASE_URL', 'https://data.humdata.org').rstrip('/')
+    timeout = hxl_proxy.app.config.get('MAX_REQUEST_TIMEOUT', 30.0)
+    ckan = ckanapi.RemoteCKAN(base_url, user_agent='hxl-proxy')
+    urls = []
+    start = 0
+    while len(urls) < max_count:
+        result = ckan.action.package_search(
+            fq='organization:"{}" AND {}'.format(organization, HDX_HXL_QUERY),
+            rows=HDX_PAGE_SIZE,
+            start=start,
+            requests_kwargs={'timeout': timeout}
+        )
+        for package in result['results']:
+            for resource in package.get('resources', []):
+                if (resource.get('format') or '').lower() in HDX_FORMATS and resource.get('url'):
+                    urls.append(resource['url'])
+        start += HDX_PAGE_SIZE
+        if start >= result['count']:
+            break
+    return urls[:max_count]
+
+
+def iter_batch(urls, schema, input_options, max_issues=None, max_rule_issues=None, ordered=True):
+    """Validate datasets concurrently against the same schema.
+    The pool size comes from app.config["BATCH_WORKERS"].
+    @param urls: the dataset URLs
+    @param schema: the compiled hxl.validation.Schema (each dataset gets its own copy)
+    @param input_options: the hxl.input.InputOptions for reading the datasets
+    @param max_issues: the maximum number of issues to report for each dataset, or None for no cap
+    @param max_rule_issues: the maximum number of issues to report for each rule, or None for no cap
+    @param ordered: if True, generate the results in the same order as urls; otherwise, as they finish
+    @returns: a generator of results (see validate_url())
+    """
+    urls = list(urls)
+    max_workers = max(1, min(int(hxl_proxy.app.config.get('BATCH_WORKERS', DEFAULT_WORKERS)), len(urls)))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hxl-batch')
+    try:
+        # each task gets its own copy of the logging context
+        futures = [
+            executor.submit(
+                copy_context().run, validate_url,
+                index, url, schema, input_options, max_issues, max_rule_issues
+            )
+            for index, url in enumerate(urls)
+        ]
+        for future in (futures if ordered else concurrent.futures.as_completed(futures)):
+            yield future.result()
+    finally:
+        # the client may have gone away
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def validate_url(index, url, schema, input_options, max_issues=None, max_rule_issues=None):
+    """Validate one dataset in a batch (in a worker thread).
+    Errors opening or reading the dataset go into the result, so that they don't stop the batch.
+    @returns: a dict with the index and URL, and either a "report" or an "error"
+    """
+    result = {
+        'index': index,
+        'url': url,
+    }
+    try:
+        # not shared with the rest of the request, so that each dataset can leave memory when it's done
+        source = util.hxl_data(url, input_options, shared=False)
+        result['report'] = validate.validate_source(source, copy.deepcopy(schema), max_issues, max_rule_issues)
+    except Exception as e:
+        logger.warning("Can't validate %s in batch: %s", url, e)
+        result['error'] = {
+            'error': e.__class__.__name__,
+            'message': e.message if hasattr(e, 'message') else str(e),
+        }
+    return result
+
+# end
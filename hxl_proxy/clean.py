@@ -0,0 +1,106 @@
+"""Batched, memoising clean filter for the HXL Proxy.
+
+libhxl-python's hxl.filters.CleanDataFilter cleans one cell at a time,
+matching every cleaning pattern against the cell's column and
+re-parsing every date and number it sees. The MemoCleanDataFilter
+class in this module matches the patterns once per column, cleans
+rows in batches one column at a time, and remembers the cleaned
+version of each distinct value in a column (country names, dates, and
+admin names repeat heavily).
+
+Started October 2026
+License: Public Domain
+"""
+
+import hxl, logging
+import hxl.filters
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+BATCH_SIZE = 1000
+""" Number of rows to clean together """
+
+MAX_MEMO_SIZE = 10000
+""" Maximum number of distinct cleaned values to remember per column """
+
+
+class MemoCleanDataFilter(hxl.filters.CleanDataFilter):
+    """Clean data column by column, remembering cleaned values.
+
+    Takes the same arguments as hxl.filters.CleanDataFilter, and
+    produces exactly the same output. Since each distinct value is
+    cleaned only once per column, a warning about a value that can't
+    be parsed is logged only once too.
+
+    Usage:
+        source = MemoCleanDataFilter(hxl.data(url), whitespace='#adm1', date='#date')
+
+    """
+
+    def __iter__(self):
+        return self._generate_rows()
+
+    def _generate_rows(self):
+        """Generate the cleaned rows, reading the source in batches."""
+        columns = self.columns
+        cleaners = [self._make_cleaner(column) for column in columns]
+        row_number = 0
+        batch = []
+        for row in self.source:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                for values in self._clean_batch(batch, cleaners):
+                    yield hxl.model.Row(columns, values, row_number)
+                    row_number += 1
+                batch = []
+        for values in self._clean_batch(batch, cleaners):
+            yield hxl.model.Row(columns, values, row_number)
+            row_number += 1
+
+    def _clean_batch(self, rows, cleaners):
+        """Clean a batch of rows, one column at a time.
+        @returns: a list of value lists, one for each row
+        """
+        results = []
+        selected = []
+        for row in rows:
+            if hxl.model.RowQuery.match_list(row, self.queries):
+                # if there are no queries, or row matches at least one
+                values = list(row.values)
+                selected.append(values)
+            else:
+                # otherwise, leave as-is
+                values = row.values
+            results.append(values)
+
+        for i, cleaner in enumerate(cleaners):
+            for values in selected:
+                if i < len(values):
+                    values[i] = cleaner(values[i])
+
+        return results
+
+    def _make_cleaner(self, column):
+        """Make a function to clean values in a column.
+        Columns that no cleaning pattern matches still get their values converted to strings.
+        """
+        patterns = self.whitespace + self.upper + self.lower + self.date + self.number + self.latlon
+        if not self._match_patterns(patterns, column):
+            return str
+
+        memo = {}
+        clean_value = self._clean_value
+
+        def clean(value):
+            value = str(value)
+            result = memo.get(value)
+            if result is None:
+                result = clean_value(value, column)
+                if len(memo) < MAX_MEMO_SIZE:
+                    memo[value] = result
+            return result
+
+        return clean
+
+# end
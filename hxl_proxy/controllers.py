@@ -11,7 +11,7 @@ License: Public Domain
 import hxl_proxy
 from hxl.input import HXLIOException
 
-from hxl_proxy import app, cache, caching, exceptions, filters, pcodes, preview, recipes, util, validate
+from hxl_proxy import app, batch, cache, caching, exceptions, filters, heads, offload, pcodes, preview, profiling, recipes, schemas, stats, uploads, util, validate
 
 import datetime, flask, hxl, importlib, io, json, logging, requests, requests_cache, signal, werkzeug, csv, urllib
 
@@ -207,9 +207,10 @@ def data_tagger():
         header_row = int(header_row)
 
     # Set up a 25-row raw-data preview, using make_input from libhxl-python
+    # (from the source's cached raw head, if it's there; see heads.open_head())
     preview = []
     i = 0
-    for row in util.hxl_make_input(recipe.url, util.make_input_options(recipe.args)):
+    for row in heads.open_head(recipe.url, util.make_input_options(recipe.args)):
         # Stop if we get to 25 rows
         if i >= 25:
             break
@@ -247,6 +248,10 @@ def data_edit():
         logger.info("No URL supplied for /data/edit; redirecting to /data/source")
         return flask.redirect(util.data_url_for('data_source', recipe), 303)
 
+    # admins can ask for a per-stage profile instead
+    if util.profile_p():
+        return make_profile_response(recipe)
+
     # show only a short preview
     max_rows = recipe.args.get('max-rows')
     max_rows = min(int(max_rows), 25) if max_rows is not None else 25
@@ -259,7 +264,7 @@ def data_edit():
     # fix it.
     error = None
     try:
-        source = preview.PreviewFilter(filters.setup_filters(recipe), max_rows=max_rows)
+        source = preview.PreviewFilter(filters.setup_filters(recipe, row_limit=max_rows, use_head=True), max_rows=max_rows)
         source.columns
     except (
             requests.RequestException,
@@ -298,9 +303,12 @@ def data_edit():
 @util.structlogged
 def data_validate(format='html'):
     """ Flask controller: validate a HXL dataset and show the results
-    Output options include a web-based HTML dashboard or JSON.
-    Output for this page is never cached, but input may be.
-    @param format: the selected output format (json or html)
+    Output options include a web-based HTML dashboard, JSON, or
+    newline-delimited JSON (ndjson) with each issue as it's found.
+    The output isn't cached, but the validation report may be (see validate.get_recipe_report()).
+    &max_issues and &max_rule_issues cap the issues reported (see validate.get_issue_limits()).
+    &sample or &head validate only some of the rows, for a quick, partial report (see validate.get_row_limits()).
+    @param format: the selected output format (json, ndjson, or html)
 
     """
 
@@ -318,20 +326,52 @@ def data_validate(format='html'):
         return flask.redirect(util.data_url_for('data_source', recipe), 303)
 
     # Set up the HXL validation schema
-    schema_source = None
+    # (compiled schemas are cached across requests; see schemas.get_schema())
     if recipe.schema_url:
-        schema_source = util.hxl_data(recipe.schema_url, util.make_input_options(recipe.args))
         logup('Using HXL validation schema', {"schema": recipe.schema_url}, level="info")
         logger.info("Using HXL validation schema at %s", recipe.schema_url)
     else:
         logup('No HXL validation schema specified; using default schema', level="info")
         logger.info("No HXL validation schema specified; using default schema")
 
-    # Run the validation and get a JSON report from libhxl-python
-    error_report = hxl.validate(
-        filters.setup_filters(recipe),
-        schema_source
-    )
+    # Optional caps on the issues (validation stops early when they're reached)
+    (max_issues, max_rule_issues,) = validate.get_issue_limits(recipe.args)
+
+    # Optional subset of rows to validate (for quick feedback on a big dataset)
+    (sample, head,) = validate.get_row_limits(recipe.args)
+
+    def get_source():
+        # with a head, stream the source (the filter reads one row past it; see validate.RowLimitFilter)
+        row_limit = head + 1 if head is not None else None
+        return validate.limit_rows(filters.setup_filters(recipe, row_limit=row_limit), sample, head)
+
+    def get_schema():
+        return schemas.get_schema(url=recipe.schema_url, input_options=util.make_input_options(recipe.args))
+
+    # Identify the dataset, to recheck only changed rows (see validate.make_validator())
+    history_id = validate.make_history_id(recipe.url, None, recipe.args)
+
+    # Stream the issues as newline-delimited JSON as they're found
+    if format == 'ndjson':
+        validator = validate.make_validator(get_schema(), max_issues, max_rule_issues, history_id)
+        extras = validate.make_report_extras(recipe.url, None, recipe.schema_url, {})
+        # open the source before streaming, so that errors still get a proper error response
+        source = get_source()
+        source.columns
+        return flask.Response(
+            flask.stream_with_context(validator.iter_ndjson(source, extras)),
+            mimetype="application/x-ndjson"
+        )
+
+    # Run the validation and get a JSON report
+    # (the HTML severity and detail views and the JSON share a cached report; see validate.get_recipe_report())
+    error_report = validate.get_recipe_report(recipe, lambda: validate.validate_source(
+        get_source(),
+        get_schema(),
+        max_issues,
+        max_rule_issues,
+        history_id=history_id
+    ))
 
     # Render the validation results in JSON
     if format == 'json':
@@ -371,6 +411,47 @@ def data_validate(format='html'):
         )
 
 
+# has tests
+@app.route("/data/profile")
+@util.structlogged
+def data_profile():
+    """ Flask controller: profile each stage of a recipe's filter pipeline
+    Same as &profile=on for /data or /data/edit (admin users only).
+    """
+    flask.g.output_format = 'json'
+    recipe = recipes.Recipe()
+    if not recipe.url:
+        raise werkzeug.exceptions.BadRequest("No URL supplied for the recipe to profile")
+    return make_profile_response(recipe)
+
+
+def make_profile_response(recipe):
+    """ Run a recipe's pipeline to the end, and return a JSON profile of each stage
+    Reports wall time, CPU time, rows in and out, and peak memory for each stage,
+    with fetching (and opening) the source reported separately.
+    Honours &max-rows, like /data, but never uses the input or output cache.
+    @param recipe: the recipe to profile
+    """
+    flask.g.output_format = 'json'
+    if not util.is_admin():
+        raise werkzeug.exceptions.Forbidden("Only administrators can profile a recipe")
+
+    profiler = profiling.PipelineProfiler()
+    with profiler:
+        source = filters.setup_filters(recipe, profiler=profiler)
+        max_rows = recipe.args.get('max-rows')
+        if max_rows is not None:
+            source = preview.PreviewFilter(source, max_rows=int(max_rows))
+        for row in source:
+            pass
+
+    report = profiler.report()
+    report['url'] = recipe.url
+    logup('Profiled pipeline', {'total_ms': report['total_ms']}, level='info')
+    logger.info("Profiled pipeline for %s in %s ms", recipe.url, report['total_ms'])
+    return flask.Response(json.dumps(report, indent=4), mimetype='application/json')
+
+
 # has tests
 @app.route("/data/advanced")
 @util.structlogged
@@ -450,21 +531,29 @@ def data_view(format="html", stub=None, flavour=None):
             flask.flash('Please choose a data source first.')
             return flask.redirect(util.data_url_for('data_source', recipe), 303)
 
-        # Use input caching if requested
-        if util.skip_cache_p():
-            source = filters.setup_filters(recipe)
-        else:
-            with caching.input():
-                source = filters.setup_filters(recipe)
+        # admins can ask for a per-stage profile instead
+        if util.profile_p():
+            return make_profile_response(recipe)
 
         # Parameters controlling the output
         show_headers = (recipe.args.get('strip-headers') != 'on')
         max_rows = recipe.args.get('max-rows', None)
 
-        # Return a generator based on the format requested
+        # The most rows we'll read (HTML is capped below), so the input can stop early
+        if format == 'html':
+            row_limit = min(int(max_rows), 5000) if max_rows is not None else 5000
+        else:
+            row_limit = int(max_rows) if max_rows is not None else None
 
         # Render a web page
         if format == 'html':
+            # Use input caching if requested
+            if util.skip_cache_p():
+                source = filters.setup_filters(recipe, row_limit=row_limit)
+            else:
+                with caching.input():
+                    source = filters.setup_filters(recipe, row_limit=row_limit)
+
             # cap output at 5,000 rows for HTML
             max_rows = min(int(max_rows), 5000) if max_rows is not None else 5000
             return flask.render_template(
@@ -476,22 +565,19 @@ def data_view(format="html", stub=None, flavour=None):
 
         # Data formats from here on ...
 
-        # Limit the number of output rows *only* if requested
-        if max_rows is not None:
-            source = preview.PreviewFilter(source, max_rows=int(max_rows))
+        # Heavy recipes run in a worker process, so that they don't stall other requests
+        output_args = (
+            dict(recipe.args), format, flavour, show_headers, max_rows, row_limit, not util.skip_cache_p(),
+        )
+        if offload.should_offload(recipe.args):
+            output = offload.run_in_request_context(make_data_output, *output_args)
+        else:
+            output = make_data_output(*output_args)
 
-        # Render JSON output (list of lists or list of objects)
         if format == 'json':
-            response = flask.Response(
-                list(
-                    source.gen_json(show_headers=show_headers, use_objects=(flavour=='objects'))
-                ),
-                mimetype='application/json'
-            )
-
-        # Render CSV output
+            response = flask.Response(output, mimetype='application/json')
         else:
-            response = flask.Response(list(source.gen_csv(show_headers=show_headers)), mimetype='text/csv')
+            response = flask.Response(output, mimetype='text/csv')
 
         # Include a CORS header for cross-origin data access
         response.headers['Access-Control-Allow-Origin'] = '*'
@@ -518,6 +604,41 @@ def data_view(format="html", stub=None, flavour=None):
 
 
 
+def make_data_output(args, format, flavour, show_headers, max_rows, row_limit, use_input_cache):
+    """ Render a transformed dataset as JSON or CSV text
+    May run in an offload worker process (see offload.py), so it takes
+    only plain, picklable arguments.
+    @param args: the recipe arguments
+    @param format: the output format (json or csv)
+    @param flavour: the JSON flavour, if supplied (will be "objects")
+    @param show_headers: if True, include the text headers
+    @param max_rows: the maximum number of rows to output, or None for all
+    @param row_limit: the most rows that will be read (see filters.setup_filters())
+    @param use_input_cache: if True, cache the input
+    @returns: a list of output strings
+    """
+    recipe = recipes.Recipe(request_args=args)
+
+    # Use input caching if requested
+    if use_input_cache:
+        with caching.input():
+            source = filters.setup_filters(recipe, row_limit=row_limit)
+    else:
+        source = filters.setup_filters(recipe, row_limit=row_limit)
+
+    # Limit the number of output rows *only* if requested
+    if max_rows is not None:
+        source = preview.PreviewFilter(source, max_rows=int(max_rows))
+
+    # Render JSON output (list of lists or list of objects)
+    if format == 'json':
+        return list(source.gen_json(show_headers=show_headers, use_objects=(flavour=='objects')))
+
+    # Render CSV output
+    else:
+        return list(source.gen_csv(show_headers=show_headers))
+
+
 #########################################################################
 # Primary action POST controllers
 # These are URLs that are not bookmarkable.
@@ -571,6 +692,16 @@ def do_data_validate():
     schema_sheet_index - the 0-based index of the  tab in a schema Excel sheet
 
     include_dataset - if specified, include the original dataset in the JSON validation result
+                      (with "stream", validated and written in a single pass, and never cached)
+    stub - a name for the dataset, so that a later upload of the same dataset can skip
+           rechecking unchanged rows (defaults to the URL or upload file name)
+
+    max_issues - the maximum number of issues to report (validation stops early when it's reached)
+    max_rule_issues - the maximum number of issues to report for each rule
+    sample - if specified, validate only a random sample of this many rows (the report is marked as partial)
+    head - if specified, validate only this many rows from the start of the dataset (the report is marked as partial)
+    stream - if specified, return newline-delimited JSON with each issue as it's found, or with
+             "include_dataset", the JSON report with the dataset as it's validated (never cached)
     """
     flask.g.output_format = 'json' # for error reporting
 
@@ -579,8 +710,8 @@ def do_data_validate():
     content = flask.request.files.get('content')
     content_hash = None
     if content is not None:
-        # need a hash of the content for caching
-        content_hash = util.make_file_hash(content)
+        # need a hash of the content for caching (made as it arrived; see uploads.py)
+        content_hash = uploads.get_upload_hash(content)
     sheet_index = flask.request.form.get('sheet', None)
     if sheet_index is not None:
         try:
@@ -597,7 +728,7 @@ def do_data_validate():
     schema_content_hash = None
     if schema_content is not None:
         # need a hash of the schema content for caching
-        schema_content_hash = util.make_file_hash(schema_content)
+        schema_content_hash = uploads.get_upload_hash(schema_content)
     schema_sheet_index = flask.request.form.get('schema_sheet', None)
     if schema_sheet_index is not None:
         try:
@@ -610,6 +741,22 @@ def do_data_validate():
     # general POST parameters
     include_dataset = flask.request.form.get('include_dataset', False)
 
+    # stream the issues as they're found (or the report with the dataset), without caching
+    # (with the dataset, it goes straight to the response as it's validated, so it's never all in memory)
+    if flask.request.form.get('stream'):
+        # opens the source and schema first, so that errors still get a proper error response
+        output = validate.stream_validation(
+            url, content, sheet_index,
+            schema_url, schema_content, schema_content_hash,
+            bool(include_dataset), flask.request.form
+        )
+        response = flask.Response(
+            flask.stream_with_context(output),
+            mimetype='application/json' if include_dataset else 'application/x-ndjson'
+        )
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
+
     # run the validation and save a report
     # caching happens in the util.run_validation() function
     report = validate.run_validation(
@@ -635,6 +782,73 @@ def do_data_validate():
     return response
 
 
+# has tests
+@app.route("/actions/validate-batch", methods=['POST'])
+@util.structlogged
+def do_data_validate_batch():
+    """ Flask controller: validate many datasets against one HXL schema
+    The schema is compiled once, and the datasets are validated concurrently
+    (see batch.iter_batch()). Never cached.
+
+    Post parameters:
+
+    url - the URL of a dataset to validate (may repeat)
+    urls - the URLs of datasets to validate, one per line
+    hdx_organization - the name of an HDX organisation whose HXL-tagged resources to validate
+
+    schema_url - the URL of the HXL schema to use (optional; exclusive with "schema_content")
+    schema_content - a file attachment with the HXL schema to use (optional; exclusive with "schema_url")
+    schema_sheet - the 0-based index of the tab in a schema Excel sheet
+
+    max_issues - the maximum number of issues to report for each dataset
+    max_rule_issues - the maximum number of issues to report for each rule
+    stream - if specified, return newline-delimited JSON with each dataset's result as it finishes
+
+    Each result has the dataset's 0-based "index" and "url", and either a
+    "report" (as from /actions/validate) or an "error".
+    """
+    flask.g.output_format = 'json' # for error reporting
+    form = flask.request.form
+
+    # the datasets
+    urls = form.getlist('url')
+    urls += [line.strip() for line in form.get('urls', '').splitlines() if line.strip()]
+    max_datasets = batch.get_max_datasets()
+    if form.get('hdx_organization'):
+        urls += batch.get_organization_urls(form.get('hdx_organization'), max_datasets - len(urls) + 1)
+    if not urls:
+        raise werkzeug.exceptions.BadRequest("Require at least one dataset ('url', 'urls', or 'hdx_organization')")
+    if len(urls) > max_datasets:
+        raise werkzeug.exceptions.BadRequest("Too many datasets (maximum {})".format(max_datasets))
+
+    # the schema, compiled only once
+    schema_url = form.get('schema_url')
+    schema_content = flask.request.files.get('schema_content')
+    if schema_url is not None and schema_content is not None:
+        raise werkzeug.exceptions.BadRequest("Both 'schema_url' and 'schema_content' specified")
+    schema_content_hash = uploads.get_upload_hash(schema_content) if schema_content is not None else None
+    (schema, schema_args,) = validate.open_schema(schema_url, schema_content, schema_content_hash, form)
+
+    (max_issues, max_rule_issues,) = validate.get_issue_limits(form)
+    input_options = util.make_input_options(form)
+    logup('Validating batch', {'count': len(urls), 'schema': schema_url}, level='info')
+    logger.info("Validating a batch of %d datasets", len(urls))
+
+    if form.get('stream'):
+        def ndjson_generator():
+            for result in batch.iter_batch(urls, schema, input_options, max_issues, max_rule_issues, ordered=False):
+                yield json.dumps(result) + '\n'
+        response = flask.Response(flask.stream_with_context(ndjson_generator()), mimetype='application/x-ndjson')
+    else:
+        result = validate.make_report_extras(None, None, schema_url, schema_args)
+        result['results'] = list(batch.iter_batch(urls, schema, input_options, max_issues, max_rule_issues))
+        response = flask.Response(json.dumps(result, indent=4), mimetype='application/json')
+
+    # add the CORS header for cross-origin compatibility
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
 # needs tests
 # NOTE: This is an experiment that's probably not used anywhere right now
 # We may choose to remove it
@@ -944,12 +1158,18 @@ def data_preview (format="json"):
     if not url:
         return flask.redirect('/api/data-preview.html', 302)
 
-    # make input
+    # make input (for a limited preview, from the source's cached raw head; see heads.open_head())
+    def make_input():
+        if rows > 0:
+            return heads.open_head(url, util.make_input_options(flask.request.args))
+        else:
+            return util.hxl_make_input(url, util.make_input_options(flask.request.args))
+
     if util.skip_cache_p():
-        input = util.hxl_make_input(url, util.make_input_options(flask.request.args))
+        input = make_input()
     else:
         with caching.input():
-            input = util.hxl_make_input(url, util.make_input_options(flask.request.args))
+            input = make_input()
 
     # Generate result
     if format == 'json':
@@ -1122,6 +1342,45 @@ def make_hash():
     )
 
 
+# has tests
+@app.route('/api/stats')
+@cache.cached(key_prefix=util.make_cache_key, unless=util.skip_cache_p)
+@util.structlogged
+def data_stats():
+    """ Flask controller: summarise the columns of a transformed dataset
+    Reads the whole output of the recipe once, keeping only fixed-size
+    sketches for each column (see stats.py).
+    GET parameters:
+    url - the URL of the dataset (plus any other recipe parameters)
+    top - the number of most-frequent values to report per column (default 10, max 100)
+    """
+    flask.g.output_format = 'json' # for error reporting
+
+    recipe = recipes.Recipe()
+    if not recipe.url:
+        raise ValueError("Parameter 'url' is required")
+
+    try:
+        top_k = min(int(flask.request.args.get('top', stats.DEFAULT_TOP_K)), stats.MAX_TOP_K)
+    except ValueError:
+        raise ValueError("Parameter 'top' must be a number")
+
+    # Use input caching if requested
+    if util.skip_cache_p():
+        source = filters.setup_filters(recipe)
+    else:
+        with caching.input():
+            source = filters.setup_filters(recipe)
+
+    report = stats.profile_columns(source, top_k=max(top_k, 1))
+    report['url'] = recipe.url
+    report['date'] = datetime.datetime.utcnow().isoformat()
+
+    response = flask.Response(json.dumps(report, indent=4), mimetype="application/json")
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
 # has tests
 @app.route('/api/source-info')
 @util.structlogged
@@ -0,0 +1,129 @@
+"""Memory-bounded deduplication filter for the HXL Proxy.
+
+libhxl-python's hxl.filters.DeduplicationFilter remembers the full,
+normalised key of every distinct row it has seen. The
+DigestDeduplicationFilter class in this module remembers only a
+16-byte BLAKE2b digest of each key, and moves the digests to a
+temporary SQLite database on disk once there are more than
+max_digests of them.
+
+Started October 2026
+License: Public Domain
+"""
+
+import hashlib, hxl, logging, sqlite3
+import hxl.filters
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+DEFAULT_MAX_DIGESTS = 500000
+""" Default maximum number of key digests to hold in memory """
+
+DIGEST_SIZE = 16
+""" Size of a key digest, in bytes """
+
+
+class DigestDeduplicationFilter(hxl.filters.DeduplicationFilter):
+    """Remove duplicate rows, remembering only a digest of each key.
+
+    Takes the same arguments as hxl.filters.DeduplicationFilter, and
+    uses the same normalised keys (see hxl.model.Row.key). Unlike
+    libhxl's filter, it starts with an empty set of keys each time it
+    is iterated, so that the output can be replayed.
+
+    Usage:
+        source = DigestDeduplicationFilter(hxl.data(url), '#org,#sector')
+
+    """
+
+    def __init__(self, source, patterns=None, queries=[], max_digests=None):
+        """
+        Args:
+            source (hxl.Dataset): the HXL data source
+            patterns (list): TagPattern objects (or a string) for the key columns (default: all)
+            queries (list): RowQuery objects or strings to select the rows to deduplicate
+            max_digests (int): maximum digests to hold in memory (default: DEFAULT_MAX_DIGESTS)
+
+        """
+        super().__init__(source, patterns, queries)
+        self.max_digests = max_digests if max_digests is not None else DEFAULT_MAX_DIGESTS
+        self.seen_map = None
+        self._indices = None
+
+    def __iter__(self):
+        """Start with no keys seen on each iteration."""
+        self.seen_map = _DigestStore(self.max_digests)
+        self._indices = hxl.model.get_column_indices(self.patterns, self.columns) if self.patterns else []
+        return super().__iter__()
+
+    def filter_row(self, row):
+        """@returns: the row's values, or None if it's a duplicate"""
+        if hxl.model.RowQuery.match_list(row, self.queries):
+            if not row:
+                return None
+            if self.seen_map.add(self._make_digest(row)):
+                return list(row.values)
+            else:
+                return None
+        else:
+            return row.values
+
+    def _make_digest(self, row):
+        """Make a digest of the row's key, as hxl.model.Row.key() would build it."""
+        values = row.values
+        columns = row.columns
+        if self._indices:
+            key = tuple(
+                hxl.datatypes.normalise(values[i], columns[i])
+                for i in self._indices if i < len(values)
+            )
+        else:
+            # no matching columns: use the whole row
+            key = tuple(
+                hxl.datatypes.normalise(value, columns[i] if i < len(columns) else None)
+                for i, value in enumerate(values)
+            )
+        return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+
+class _DigestStore:
+    """Set of digests that moves to a temporary SQLite database when it gets too big."""
+
+    def __init__(self, max_digests):
+        self.max_digests = max_digests
+        self.digests = set()
+        self.db = None
+
+    def add(self, digest):
+        """Add a digest.
+        Returns:
+            bool: True if the digest is new, or False if it was already there
+        """
+        if self.db is not None:
+            cursor = self.db.execute('INSERT OR IGNORE INTO Digests VALUES (?)', (digest,))
+            return cursor.rowcount > 0
+        elif digest in self.digests:
+            return False
+        else:
+            self.digests.add(digest)
+            if len(self.digests) > self.max_digests:
+                self._spill()
+            return True
+
+    def _spill(self):
+        """Move the in-memory digests to a temporary database."""
+        # an empty filename means a private, temporary on-disk database
+        self.db = sqlite3.connect('', check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=OFF')
+        self.db.execute('PRAGMA synchronous=OFF')
+        self.db.execute('CREATE TABLE Digests (digest BLOB PRIMARY KEY) WITHOUT ROWID')
+        self.db.executemany('INSERT INTO Digests VALUES (?)', ((digest,) for digest in self.digests))
+        logger.info("Moved %d dedup digests to a temporary database", len(self.digests))
+        self.digests = None
+
+    def __del__(self):
+        if self.db is not None:
+            self.db.close()
+
+# end
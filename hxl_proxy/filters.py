@@ -7,8 +7,8 @@ module uses the numbers to group the parameters, then to construct the
 hxl.filter objects from them and build a pipeline.
 """
 
-import hxl, io
-from hxl_proxy import exceptions, util
+import hxl, hxl_proxy, io, re
+from hxl_proxy import aggregate, clean, dedup, exceptions, heads, inputs, jsonpath, parallel, profiling, queries, snapshot, sort, util
 import hxl.filters # why do we have to import this???
 from hxl.converters import Tagger
 
@@ -16,11 +16,26 @@ from hxl.converters import Tagger
 # Maximum number of filters to check
 MAX_FILTER_COUNT = 99
 
-def setup_filters(recipe, data_content=None):
+# Filters that read the whole dataset before returning any rows
+BLOCKING_FILTERS = ('count', 'implode', 'sort',)
+
+# Filters that look at only one row at a time
+ROW_LOCAL_FILTERS = ('add', 'clean', 'rename', 'replace', 'rows', 'select',)
+
+# Parameters holding row queries, and queries that need an aggregate over the whole dataset
+QUERY_ARG_PATTERN = re.compile(r'^[a-z-]+-(?:where(\d+)|query(\d+)-\d+)$')
+AGGREGATE_QUERY_PATTERN = re.compile(r'\bis\s+(?:not\s+)?(?:min|max)\s*$')
+
+def setup_filters(recipe, data_content=None, profiler=None, row_limit=None, use_head=False):
     """
     Open a stream to a data source URL, and create a filter pipeline based on the arguments.
     @param: recipe the GET-request recipe (uses only recipe.args).
     @param data_content: a dataset uploaded directly via a POST request.
+    @param profiler: a profiling.PipelineProfiler to measure each stage (default: none)
+    @param row_limit: the most rows the caller will read, if known. If every
+    stage streams, the source URL is streamed too, so that downloading and
+    parsing stop when the caller stops reading.
+    @param use_head: if True (and streaming), start from the source's cached raw head (see heads.open_head())
     @returns: a HXL DataSource representing the full pipeline.
     """
 
@@ -28,22 +43,57 @@ def setup_filters(recipe, data_content=None):
     if not data_content and (not recipe or not recipe.url):
         return None
 
+    if profiler is None:
+        profiler = profiling.NullProfiler()
+
     # Basic input source
 
     input_options = util.make_input_options(recipe.args)
 
-    if data_content:
-        source = util.hxl_data(io.BytesIO(data_content.encode('utf-8')), input_options)
-    else:
-        try:
-            source = util.hxl_data(recipe.args["url"], input_options)
-            source.columns
-        except hxl.input.HXLTagsNotFoundException:
-            source = util.hxl_data(make_tagged_input(recipe.args, input_options), input_options)
+    with profiler.measure_fetch():
+        if data_content:
+            source = util.hxl_data(io.BytesIO(data_content.encode('utf-8')), input_options)
+        elif input_options.scan_ckan_resources:
+            # libhxl may have to try several CKAN resources, so let it open the URL itself
+            try:
+                source = util.hxl_data(recipe.args["url"], input_options)
+                source.columns
+            except hxl.input.HXLTagsNotFoundException:
+                source = util.hxl_data(make_tagged_input(recipe.args, input_options), input_options)
+        else:
+            source = None
+            stream = (row_limit is not None and is_streaming_recipe(recipe.args))
+            if snapshot.is_snapshot_recipe(recipe.args):
+                # when streaming, use a snapshot only if it's already there
+                source = snapshot.open_snapshot(
+                    recipe.args["url"],
+                    input_options,
+                    lambda: util.hxl_data(recipe.args["url"], input_options),
+                    build=(not stream)
+                )
+            if source is None:
+                # download once, and replay the rows for the tagger if there are no hashtags
+                if use_head and stream:
+                    # interactive pages share the start of the source for a while
+                    input = inputs.RewindableInput(heads.open_head(recipe.args["url"], input_options, stream=True))
+                else:
+                    input = inputs.RewindableInput(util.hxl_make_input(recipe.args["url"], input_options, stream=stream))
+                try:
+                    source = util.hxl_data(input, input_options)
+                    source.columns
+                    # found the hashtags, so don't keep the raw rows
+                    input.commit()
+                except hxl.input.HXLTagsNotFoundException:
+                    input.rewind()
+                    source = util.hxl_data(make_tagged_input(recipe.args, input_options, input), input_options)
+
+    # reading the rows from here on counts as parsing
+    source = profiler.wrap(source, 'parse')
 
     # Do we have a JSON recipe? Load it first.
     if recipe.args.get('recipe'):
-        source = source.recipe(recipe.args.get('recipe'))
+        profiler.start_setup()
+        source = profiler.wrap(source.recipe(recipe.args.get('recipe')), 'recipe')
 
     # Intercept missing hashtags here
     try:
@@ -51,53 +101,129 @@ def setup_filters(recipe, data_content=None):
     except hxl.input.HXLTagsNotFoundException:
         raise exceptions.RedirectException(util.data_url_for('data_tagger', recipe), 303, 'No HXL hashtags found')
 
+    # Run row-local stages in worker processes, if configured (not while profiling each stage)
+    workers = 0
+    if isinstance(profiler, profiling.NullProfiler):
+        workers = int(hxl_proxy.app.config.get('PARALLEL_WORKERS', 0))
+    parallel_until = 0
+
     # Create the filter pipeline from the source
     for index in range(1, MAX_FILTER_COUNT):
+        if index <= parallel_until:
+            # already added to a parallel run
+            continue
         filter = recipe.args.get('filter%02d' % index)
-        if filter == 'add':
-            source = add_add_filter(source, recipe.args, index)
-        elif filter == 'append':
-            source = add_append_filter(source, recipe.args, index)
-        elif filter == 'append-list':
-            source = add_append_list_filter(source, recipe.args, index)
-        elif filter == 'clean':
-            source = add_clean_filter(source, recipe.args, index)
-        elif filter == 'count':
-            source = add_count_filter(source, recipe.args, index)
-        elif filter == 'column' or filter == 'cut':
-            source = add_column_filter(source, recipe.args, index)
-        elif filter == 'dedup':
-            source = add_dedup_filter(source, recipe.args, index)
-        elif filter == 'expand':
-            source = add_expand_filter(source, recipe.args, index)
-        elif filter == 'explode':
-            source = add_explode_filter(source, recipe.args, index)
-        elif filter == 'fill':
-            source = add_fill_filter(source, recipe.args, index)
-        elif filter == 'implode':
-            source = add_implode_filter(source, recipe.args, index)
-        elif filter == 'jsonpath':
-            source = add_jsonpath_filter(source, recipe.args, index)
-        elif filter == 'merge':
-            source = add_merge_filter(source, recipe.args, index)
-        elif filter == 'rename':
-            source = add_rename_filter(source, recipe.args, index)
-        elif filter == 'replace':
-            source = add_replace_filter(source, recipe.args, index)
-        elif filter == 'replace-map':
-            source = add_replace_map_filter(source, recipe.args, index)
-        elif filter == 'rows' or filter == 'select':
-            source = add_row_filter(source, recipe.args, index)
-        elif filter == 'sort':
-            source = add_sort_filter(source, recipe.args, index)
-        elif filter:
-            raise Exception("Unknown filter type '{}'".format(filter))
+        if filter and workers > 0:
+            run = find_row_local_run(recipe.args, index)
+            if run:
+                source = parallel.ParallelChunkFilter(
+                    source,
+                    recipe.args,
+                    run,
+                    workers=workers,
+                    chunk_size=int(hxl_proxy.app.config.get('PARALLEL_CHUNK_SIZE', parallel.DEFAULT_CHUNK_SIZE))
+                )
+                parallel_until = run[-1]
+                continue
+        if filter:
+            profiler.start_setup()
+            source = add_filter(source, recipe.args, index, row_limit=row_limit)
+            source = profiler.wrap(source, filter, index)
 
     return source
 
-def make_tagged_input(args, input_options):
-    """Create the raw input, optionally using the Tagger filter."""
-    input = util.hxl_make_input(args.get("url"), input_options)
+def is_streaming_recipe(args):
+    """Test whether every stage of a recipe streams its rows.
+    Sorting, counting, imploding, cleaning dates (which prescans the dates),
+    and "is min"/"is max" queries all read the whole dataset before returning
+    their first row, as may a JSON recipe.
+    """
+    if args.get('recipe'):
+        return False
+    for index in range(1, MAX_FILTER_COUNT):
+        filter = args.get('filter%02d' % index)
+        if filter in BLOCKING_FILTERS:
+            return False
+        if filter == 'clean' and args.get('clean-date-tags%02d' % index):
+            return False
+    for name, value in args.items():
+        if QUERY_ARG_PATTERN.match(name) and isinstance(value, str) and AGGREGATE_QUERY_PATTERN.search(value):
+            return False
+    return True
+
+def add_filter(source, args, index, row_limit=None):
+    """Add the filter at index in the recipe (if any) to the end of the pipeline.
+    @param row_limit: the most rows the caller will read, if known (see setup_filters())
+    """
+    filter = args.get('filter%02d' % index)
+    if filter == 'add':
+        source = add_add_filter(source, args, index)
+    elif filter == 'append':
+        source = add_append_filter(source, args, index)
+    elif filter == 'append-list':
+        source = add_append_list_filter(source, args, index)
+    elif filter == 'clean':
+        source = add_clean_filter(source, args, index)
+    elif filter == 'count':
+        source = add_count_filter(source, args, index)
+    elif filter == 'column' or filter == 'cut':
+        source = add_column_filter(source, args, index)
+    elif filter == 'dedup':
+        source = add_dedup_filter(source, args, index)
+    elif filter == 'expand':
+        source = add_expand_filter(source, args, index)
+    elif filter == 'explode':
+        source = add_explode_filter(source, args, index)
+    elif filter == 'fill':
+        source = add_fill_filter(source, args, index)
+    elif filter == 'implode':
+        source = add_implode_filter(source, args, index)
+    elif filter == 'jsonpath':
+        source = add_jsonpath_filter(source, args, index)
+    elif filter == 'merge':
+        source = add_merge_filter(source, args, index)
+    elif filter == 'rename':
+        source = add_rename_filter(source, args, index)
+    elif filter == 'replace':
+        source = add_replace_filter(source, args, index)
+    elif filter == 'replace-map':
+        source = add_replace_map_filter(source, args, index)
+    elif filter == 'rows' or filter == 'select':
+        source = add_row_filter(source, args, index)
+    elif filter == 'sort':
+        source = add_sort_filter(source, args, index, row_limit=row_limit)
+    elif filter:
+        raise Exception("Unknown filter type '{}'".format(filter))
+    return source
+
+def find_row_local_run(args, index):
+    """Find the run of row-local filters starting at index.
+    A filter is row-local if it looks at only one row at a time, so that
+    it can process chunks of rows independently (see parallel.py).
+    Cleaning dates (which prescans the dates) and "is min"/"is max"
+    queries are not row-local.
+    @returns: a list of the indices of the filters in the run (may be empty)
+    """
+    run = []
+    for later in range(index, MAX_FILTER_COUNT):
+        filter = args.get('filter%02d' % later)
+        if not filter:
+            continue
+        if filter not in ROW_LOCAL_FILTERS:
+            break
+        if filter == 'clean' and args.get('clean-date-tags%02d' % later):
+            break
+        if _has_aggregate_query(args, later):
+            break
+        run.append(later)
+    return run
+
+def make_tagged_input(args, input_options, input=None):
+    """Create the raw input, optionally using the Tagger filter.
+    @param input: an already-open raw input to tag (default: open args["url"])
+    """
+    if input is None:
+        input = util.hxl_make_input(args.get("url"), input_options)
 
     # Intercept tagging as a special data input
     specs = []
@@ -125,33 +251,43 @@ def add_add_filter(source, args, index):
     return source.add_columns(specs=values, before=before)
 
 def add_append_filter(source, args, index):
-    """Add the hxlappend filter to the end of the chain."""
+    """Add the hxlappend filter to the end of the chain.
+    The datasets to append are fetched concurrently (see util.hxl_data_list).
+    """
     exclude_columns = args.get('append-exclude-columns%02d' % index, False)
     append_sources = []
     for subindex in range(1, 100):
         append_source = args.get('append-dataset%02d-%02d' % (index, subindex))
         if append_source:
             append_sources.append(append_source)
-    row_query = args.get('append-where%02d' % index, None)
+    row_query = queries.parse_list(args.get('append-where%02d' % index, None))
     return source.append(
-        append_sources=append_sources,
+        append_sources=util.hxl_data_list(append_sources, _make_append_input_options(args)),
         add_columns=(not exclude_columns),
         queries=row_query
     )
 
 def add_append_list_filter(source, args, index):
-    """Add the hxlappend filter to the end of the chain with an external list."""
+    """Add the hxlappend filter to the end of the chain with an external list.
+    The datasets in the list are fetched concurrently (see util.hxl_data_list).
+    """
     exclude_columns = args.get('append-list-exclude-columns%02d' % index, False)
     source_list_url = args.get('append-list-url%02d' % index, None)
-    row_query = args.get('append-list-where%02d' % index, None)
-    return source.append_external_list(
-        source_list_url=source_list_url,
+    row_query = queries.parse_list(args.get('append-list-where%02d' % index, None))
+    input_options = _make_append_input_options(args)
+    append_sources = hxl.filters.AppendFilter.parse_external_source_list(
+        util.hxl_data(source_list_url, input_options)
+    )
+    return source.append(
+        append_sources=util.hxl_data_list(append_sources, input_options),
         add_columns=(not exclude_columns),
         queries=row_query
     )
 
 def add_clean_filter(source, args, index):
-    """Add the hxlclean filter to the end of the pipeline."""
+    """Add the hxlclean filter to the end of the pipeline.
+    Cleans in column batches, remembering repeated values (see clean.MemoCleanDataFilter).
+    """
     whitespace_tags = hxl.TagPattern.parse_list(args.get('clean-whitespace-tags%02d' % index, ''))
     upper_tags = hxl.TagPattern.parse_list(args.get('clean-toupper-tags%02d' % index, ''))
     lower_tags = hxl.TagPattern.parse_list(args.get('clean-tolower-tags%02d' % index, ''))
@@ -161,8 +297,9 @@ def add_clean_filter(source, args, index):
     number_format = args.get('clean-number-format%02d' % index, None);
     latlon_tags = hxl.TagPattern.parse_list(args.get('clean-latlon-tags%02d' % index, ''))
     purge_flag = args.get('clean-purge%02d' % index, False)
-    row_query = args.get('clean-where%02d' % index, None)
-    return source.clean_data(
+    row_query = queries.parse_list(args.get('clean-where%02d' % index, None))
+    return clean.MemoCleanDataFilter(
+        source,
         whitespace=whitespace_tags,
         upper=upper_tags,
         lower=lower_tags,
@@ -176,9 +313,11 @@ def add_clean_filter(source, args, index):
     )
 
 def add_count_filter(source, args, index):
-    """Add the hxlcount filter to the end of the pipeline."""
+    """Add the hxlcount filter to the end of the pipeline.
+    Uses batched, memory-bounded aggregation (see aggregate.VectorCountFilter).
+    """
     tags = hxl.TagPattern.parse_list(args.get('count-tags%02d' % index, ''))
-    row_query = args.get('count-where%02d' % index, None)
+    row_query = queries.parse_list(args.get('count-where%02d' % index, None))
 
     aggregators = []
     for n in range(1, 25):
@@ -218,7 +357,13 @@ def add_count_filter(source, args, index):
                 column = hxl.model.Column.parse("#meta+" + count_type, header=count_type.title())
             ))
 
-    return source.count(patterns=tags, aggregators=aggregators, queries=row_query)
+    return aggregate.VectorCountFilter(
+        source,
+        patterns=tags,
+        aggregators=aggregators,
+        queries=row_query,
+        max_groups=int(hxl_proxy.app.config.get('COUNT_MAX_GROUPS', aggregate.DEFAULT_MAX_GROUPS))
+    )
 
 def add_column_filter(source, args, index):
     """Add the hxlcut filter to the end of the pipeline."""
@@ -232,15 +377,23 @@ def add_column_filter(source, args, index):
     return source
 
 def add_dedup_filter(source, args, index):
+    """Add the hxldedup filter to the end of the pipeline.
+    Keeps only key digests, with bounded memory (see dedup.DigestDeduplicationFilter).
+    """
     tags = args.get('dedup-tags%02d' % index, [])
-    row_query = args.get('dedup-where%02d' % index, '')
-    return source.dedup(tags, queries=row_query)
+    row_query = queries.parse_list(args.get('dedup-where%02d' % index, ''))
+    return dedup.DigestDeduplicationFilter(
+        source,
+        patterns=tags,
+        queries=row_query,
+        max_digests=int(hxl_proxy.app.config.get('DEDUP_MAX_DIGESTS', dedup.DEFAULT_MAX_DIGESTS))
+    )
 
 def add_expand_filter(source, args, index):
     tags = args.get('expand-tags%02d' % index, [])
     separator = args.get('expand-separator%02d' % index, "|")
     correlate = (args.get('expand-correlate%02d' % index) == 'on')
-    row_query = args.get('expand-where%02d' % index, '')
+    row_query = queries.parse_list(args.get('expand-where%02d' % index, ''))
     return source.expand_lists(
         patterns = tags,
         separator=separator,
@@ -259,8 +412,8 @@ def add_fill_filter(source, args, index):
     if not patterns:
         # deprecated
         patterns = args.get('fill-pattern%02d' % index, None)
-    queries = args.get('fill-where%02d' % index, None)
-    return source.fill_data(patterns=patterns, queries=queries)
+    row_query = queries.parse_list(args.get('fill-where%02d' % index, None))
+    return source.fill_data(patterns=patterns, queries=row_query)
 
 def add_implode_filter(source, args, index):
     return source.implode(
@@ -271,9 +424,9 @@ def add_implode_filter(source, args, index):
 def add_jsonpath_filter(source, args, index):
     path = args.get('jsonpath-path%02d' % index)
     patterns = args.get('jsonpath-patterns%02d' % index, None)
-    queries = args.get('jsonpath-where%02d' % index, None)
+    row_query = queries.parse_list(args.get('jsonpath-where%02d' % index, None))
     use_json = (args.get('jsonpath-flatten%02d' % index) != 'on')
-    return source.jsonpath(path, patterns=patterns, queries=queries, use_json=use_json)
+    return jsonpath.CachedJSONPathFilter(source, path, patterns=patterns, queries=row_query, use_json=use_json)
 
 def add_merge_filter(source, args, index):
     """Add the hxlmerge filter to the end of the pipeline."""
@@ -300,33 +453,76 @@ def add_replace_filter(source, args, index):
     replacement = args.get('replace-value%02d' % index)
     tags = args.get('replace-tags%02d' % index)
     use_regex = args.get('replace-regex%02d' % index)
-    row_query = args.get('replace-where%02d' % index)
+    row_query = queries.parse_list(args.get('replace-where%02d' % index))
     return source.replace_data(original, replacement, tags, use_regex, queries=row_query)
 
 def add_replace_map_filter(source, args, index):
     """Add the hxlreplace filter to the end of the pipeline."""
     url = args.get('replace-map-url%02d' % index)
-    row_query = args.get('replace-map-where%02d' % index)
+    row_query = queries.parse_list(args.get('replace-map-where%02d' % index))
     return source.replace_data_map(util.hxl_data(url, util.make_input_options(args)), queries=row_query)
 
 def add_row_filter(source, args, index):
     """Add the hxlselect filter to the end of the pipeline."""
-    queries = []
+    query_specs = []
     for subindex in range(1, 6):
         query = args.get('select-query%02d-%02d' % (index, subindex))
         if query:
-            queries.append(query)
+            query_specs.append(query)
+    row_queries = queries.parse_list(query_specs)
     reverse = (args.get('select-reverse%02d' % index) == 'on')
-    if reverse:
-        return source.without_rows(queries)
+    # look through the profiler's wrapper, if any
+    unwrapped = source.source if isinstance(source, profiling.ProfiledDataset) else source
+    if isinstance(unwrapped, snapshot.SnapshotDataset):
+        # answer from the snapshot's column indexes
+        return snapshot.SnapshotRowFilter(unwrapped, row_queries, reverse)
+    elif reverse:
+        return source.without_rows(row_queries)
     else:
-        return source.with_rows(queries)
-
-def add_sort_filter(source, args, index):
-    """Add the hxlsort filter to the end of the pipeline."""
+        return source.with_rows(row_queries)
+
+def add_sort_filter(source, args, index, row_limit=None):
+    """Add the hxlsort filter to the end of the pipeline.
+    Uses a disk-spilling sort (see sort.ExternalSortFilter). If this is
+    the last filter and the caller will read at most row_limit rows,
+    keep only the rows needed.
+    @param row_limit: the most rows the caller will read (see setup_filters()), or None for all
+    """
     tags = hxl.TagPattern.parse_list(args.get('sort-tags%02d' % index, ''))
     reverse = (args.get('sort-reverse%02d' % index) == 'on')
-    return source.sort(tags, reverse)
+    limit = None
+    if row_limit is not None and _is_last_filter(args, index):
+        # one extra row, so that the preview can tell there are more
+        limit = row_limit + 1
+    return sort.ExternalSortFilter(
+        source,
+        tags=tags,
+        reverse=reverse,
+        memory_limit=int(hxl_proxy.app.config.get('SORT_MEMORY_LIMIT', sort.DEFAULT_MEMORY_LIMIT)),
+        limit=limit
+    )
+
+def _make_append_input_options(args):
+    """Input options for appended datasets.
+    Uses the main source's timeout, but not its sheet, selector, or credentials.
+    """
+    return util.make_input_options({'timeout': args.get('timeout')})
+
+def _is_last_filter(args, index):
+    """Test if no filters follow the one at index in the pipeline."""
+    for later in range(index + 1, MAX_FILTER_COUNT):
+        if args.get('filter%02d' % later):
+            return False
+    return True
+
+def _has_aggregate_query(args, index):
+    """Test if the filter at index has an "is min" or "is max" query."""
+    for name, value in args.items():
+        match = QUERY_ARG_PATTERN.match(name)
+        if match and int(match.group(1) or match.group(2)) == index:
+            if isinstance(value, str) and AGGREGATE_QUERY_PATTERN.search(value):
+                return True
+    return False
 
 def _parse_tagspec(s):
     if not s:
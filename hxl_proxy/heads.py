@@ -0,0 +1,239 @@
+"""Raw-head cache for the HXL Proxy's interactive pages.
+
+The tagging workflow reads the start of the same source again and
+again: /data/tagger shows the first raw rows, /data/edit shows the
+first rows of the filtered data after each change, and
+/api/data-preview shows the first raw rows to other tools. This module
+keeps the first rows of each source, as libhxl's raw input produces
+them (before looking for hashtags), in the output cache for a short
+time, so that those pages share them instead of downloading the
+source each time.
+
+Where the server supports HTTP Range requests, the head comes from a
+request for only the first bytes of a CSV-like source (see
+fetch_head()). A page that reads past the cached rows carries on
+seamlessly from the source itself (see HeadInput), after checking
+that the source still starts with the cached rows.
+
+The cache is off unless app.config["RAW_HEAD_TIMEOUT"] is greater than
+zero.
+
+Started October 2026
+License: Public Domain
+"""
+
+import hashlib, hxl, hxl_proxy, io, json, logging, re
+from hxl_proxy import util
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+DEFAULT_MAX_ROWS = 100
+""" Default number of raw rows to keep for each source """
+
+DEFAULT_MAX_BYTES = 256 * 1024
+""" Default number of bytes to ask for in a Range request """
+
+WHOLE_FILE_EXTS = hxl.input.XLSX_FILE_EXTS + hxl.input.XLS_FILE_EXTS + hxl.input.ZIP_FILE_EXTS + hxl.input.JSON_FILE_EXTS
+""" File extensions for formats that libhxl can't parse without the whole file """
+
+WHOLE_FILE_MIME_TYPES = hxl.input.XLSX_MIME_TYPES + hxl.input.XLS_MIME_TYPES + hxl.input.ZIP_MIME_TYPES + hxl.input.JSON_MIME_TYPES
+""" MIME types for formats that libhxl can't parse without the whole file """
+
+WHOLE_FILE_SIGS = hxl.input.XLSX_SIGS + hxl.input.XLS_SIGS + hxl.input.ZIP_SIGS + hxl.input.JSON_SIGS + [b'\xff\xfe', b'\xfe\xff']
+""" Starting bytes for formats (and UTF-16 text) that can't be cut at a line break """
+
+CONTENT_RANGE_PATTERN = re.compile(r'^\s*bytes\s+0-(\d+)/(\d+|\*)\s*$', re.IGNORECASE)
+""" Content-Range header for a response starting at the first byte """
+
+
+def is_enabled():
+    """Test whether the raw-head cache is on."""
+    return int(hxl_proxy.app.config.get('RAW_HEAD_TIMEOUT', 0)) > 0
+
+
+def open_head(url, input_options, stream=False):
+    """Open a raw input for a source, using its cached head if possible.
+    If the cache is off (or can't apply to the source), this is the same
+    as util.hxl_make_input(). &force fetches a new head.
+    @param url: the URL of the source
+    @param input_options: the hxl.input.InputOptions for reading the source
+    @param stream: if True, stream the source when reading past the head (see util.hxl_make_input())
+    @returns: a hxl.input.AbstractInput object (pre-HXL-processing)
+    @raises hxl_proxy.exceptions.DomainNotAllowedError: if the domain for the URL is not in the allow list
+    """
+    util.check_allowed_domain(url)
+    if not is_enabled() or not isinstance(url, str) or not re.match(r'^https?://', url, re.IGNORECASE) or \
+       (input_options is not None and input_options.scan_ckan_resources):
+        return util.hxl_make_input(url, input_options, stream=stream)
+
+    key = make_head_key(url, input_options)
+    head = None
+    if not util.skip_cache_p():
+        head = hxl_proxy.cache.get(key)
+    if head is None:
+        head = fetch_head(
+            url,
+            input_options,
+            int(hxl_proxy.app.config.get('RAW_HEAD_ROWS', DEFAULT_MAX_ROWS)),
+            int(hxl_proxy.app.config.get('RAW_HEAD_BYTES', DEFAULT_MAX_BYTES))
+        )
+        hxl_proxy.cache.set(key, head, timeout=int(hxl_proxy.app.config.get('RAW_HEAD_TIMEOUT', 0)))
+    else:
+        logger.debug("Using the cached head of %s", url)
+    return HeadInput(url, input_options, head['rows'], head['complete'], stream=stream, key=key)
+
+
+def make_head_key(url, input_options):
+    """Make the cache key for a source's head.
+    Includes the options that change the raw rows (sheet, selector,
+    encoding, and merged-cell expansion), and the HTTP headers, so that
+    a head fetched with an authorization token goes only to requests
+    with the same token.
+    """
+    properties = [url]
+    if input_options is not None:
+        properties += [
+            input_options.sheet_index,
+            input_options.selector,
+            input_options.encoding,
+            input_options.expand_merged,
+            input_options.http_headers,
+        ]
+    key = json.dumps(properties, sort_keys=True, default=str)
+    return 'raw-head:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def fetch_head(url, input_options, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES):
+    """Read the first raw rows of a source.
+    @param url: the HTTP(S) URL of the source
+    @param input_options: the hxl.input.InputOptions for reading the source
+    @param max_rows: the maximum number of rows to keep
+    @param max_bytes: the number of bytes to ask for in a Range request
+    @returns: a dict with the "rows" (lists of values) and "complete" (True if they're the whole source)
+    """
+    (input, truncated,) = _open_range(url, input_options, max_bytes)
+    rows = []
+    complete = True
+    with input:
+        for row in input:
+            if len(rows) >= max_rows:
+                complete = False
+                break
+            rows.append(list(row))
+    if truncated:
+        if complete and rows:
+            # the last row may have been cut off
+            rows.pop()
+        complete = False
+    return {
+        'rows': rows,
+        'complete': complete,
+    }
+
+
+def _open_range(url, input_options, max_bytes):
+    """Open the start of a source, with a Range request if it might be CSV
+    @returns: a (input, truncated) tuple, where truncated is True if the input stops before the end of the source
+    """
+    if util.get_file_ext(url) in WHOLE_FILE_EXTS:
+        return (util.hxl_make_input(url, input_options, stream=True), False,)
+
+    response = util.request_url(url, input_options, {'Range': 'bytes=0-{}'.format(max_bytes - 1)})
+    (mime_type, file_ext, encoding, content_length,) = util.describe_response(url, response)
+    if response.status_code != 206:
+        # no Range support, so read the start of the whole response
+        opened = (hxl.input.RequestResponseIOWrapper(response), mime_type, file_ext, encoding, content_length, None,)
+        return (util.make_input_from_opened(url, opened, input_options), False,)
+
+    try:
+        content = b''
+        for chunk in response.iter_content(0x10000):
+            content += chunk
+            if len(content) >= max_bytes:
+                break
+    finally:
+        response.close()
+    content = content[:max_bytes]
+
+    truncated = not _is_whole_file(response.headers.get('content-range'), len(content))
+    if truncated:
+        if mime_type in WHOLE_FILE_MIME_TYPES or any(content.startswith(sig) for sig in WHOLE_FILE_SIGS):
+            # can't parse part of a workbook or JSON
+            logger.debug("Can't use a partial download of %s; streaming it instead", url)
+            return (util.hxl_make_input(url, input_options, stream=True), False,)
+        # don't split a line (or a UTF-8 character)
+        content = content[:content.rfind(b'\n') + 1]
+
+    opened = (io.BytesIO(content), mime_type, file_ext, encoding, len(content), None,)
+    return (util.make_input_from_opened(url, opened, input_options), truncated,)
+
+
+def _is_whole_file(content_range, size):
+    """Test whether a Content-Range header shows that a response has the whole file"""
+    result = CONTENT_RANGE_PATTERN.match(content_range or '')
+    if not result or result.group(2) == '*':
+        return False
+    return int(result.group(2)) <= size
+
+
+class HeadInput(hxl.input.AbstractInput):
+    """Raw input that replays a source's cached head, then reads the rest from the source.
+
+    If the head isn't the whole source, and a caller reads past it,
+    the input opens the source, skips the rows already replayed, and
+    carries on from there, so callers see the same rows as they would
+    from util.hxl_make_input(). If the rows it skips aren't the same as
+    the cached ones (because the source changed since the head was
+    cached), it drops the cached head and raises an exception, rather
+    than join two versions of the source.
+
+    Usage:
+        head = fetch_head(url, input_options)
+        input = HeadInput(url, input_options, head['rows'], head['complete'])
+
+    """
+
+    def __init__(self, url, input_options, rows, complete, stream=False, key=None):
+        """
+        @param url: the URL of the source
+        @param input_options: the hxl.input.InputOptions for reading the source
+        @param rows: the cached raw rows
+        @param complete: True if the rows are the whole source
+        @param stream: if True, stream the source when reading past the head
+        @param key: the head's cache key, to drop it if the source has changed (see make_head_key())
+        """
+        super().__init__(input_options, url)
+        self.rows = rows
+        self.complete = complete
+        self.stream = stream
+        self.key = key
+
+    def __iter__(self):
+        for row in self.rows:
+            yield list(row)
+        if not self.complete:
+            logger.debug("Reading past the cached head of %s", self.url_or_filename)
+            input = util.hxl_make_input(self.url_or_filename, self.input_options, stream=self.stream)
+            index = -1
+            for index, row in enumerate(input):
+                if index >= len(self.rows):
+                    yield row
+                elif list(row) != list(self.rows[index]):
+                    self._source_changed()
+            if index + 1 < len(self.rows):
+                self._source_changed()
+
+    def _source_changed(self):
+        """Drop the cached head, and report that the source changed while reading it
+        @raises hxl.input.HXLIOException: always
+        """
+        logger.warning("%s changed since its head was cached", self.url_or_filename)
+        if self.key is not None:
+            hxl_proxy.cache.delete(self.key)
+        raise hxl.input.HXLIOException(
+            "The source changed while it was being read; please try again",
+            self.url_or_filename
+        )
+
+# end
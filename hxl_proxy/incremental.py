@@ -0,0 +1,224 @@
+"""Incremental re-validation for the HXL Proxy.
+
+Partners often upload the same dataset again with only a few rows
+changed. The IncrementalValidator class in this module remembers, for
+each (dataset, schema) pair, a hash of every row's content and the
+issues that the schema's row-local rules found in it. On the next run,
+it replays the remembered issues for unchanged rows instead of testing
+them again.
+
+Rules are row-local when all their tests look at one row at a time
+(see ROW_LOCAL_TESTS): required values, datatypes, ranges, whitespace,
+regular expressions, and allowed-value lists. Dataset-wide rules
+(uniqueness, outliers, consistent datatypes, correlations, and
+spelling) still run over every row, as do all rules for new or changed
+rows, so the report is the same as a full run's.
+
+The history goes in the output cache, and is reused only if the
+dataset has exactly the same columns and the schema compiles to
+exactly the same rules. Incremental validation is off unless
+app.config["INCREMENTAL_VALIDATION_MAX_ROWS"] is greater than zero.
+
+Started October 2026
+License: Public Domain
+"""
+
+import hashlib, hxl, hxl_proxy, json, logging, re
+import hxl.validation
+from hxl_proxy import validate
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+ROW_LOCAL_TESTS = (
+    hxl.validation.RequiredTest,
+    hxl.validation.DatatypeTest,
+    hxl.validation.RangeTest,
+    hxl.validation.WhitespaceTest,
+    hxl.validation.RegexTest,
+    hxl.validation.EnumerationTest,
+)
+""" libhxl rule tests whose results depend only on the row (and the columns) """
+
+DEFAULT_TIMEOUT = 30 * 86400
+""" Default number of seconds to keep the history for a dataset """
+
+FINGERPRINT_EXCLUDES = ('callback', 'saved_indices', 'suggested_value_cache', 'test_rows',)
+""" Schema attributes that hold state for a validation run, rather than the rules """
+
+
+def is_enabled():
+    """Test whether incremental validation is on."""
+    return int(hxl_proxy.app.config.get('INCREMENTAL_VALIDATION_MAX_ROWS', 0)) > 0
+
+
+class IncrementalValidator(validate.StreamingValidator):
+    """Validator that rechecks only new or changed rows with row-local rules.
+
+    Produces exactly the same issues, in the same order, as
+    validate.StreamingValidator. It doesn't support caps on the issues
+    (a capped run can't give a complete history).
+
+    Usage:
+        validator = IncrementalValidator(schemas.get_schema(url=schema_url), 'url:' + url)
+        report = validator.report(source)
+
+    """
+
+    def __init__(self, schema, history_id):
+        """
+        @param schema: the hxl.validation.Schema to use (before any validation run)
+        @param history_id: the identity of the dataset (e.g. its URL or stub)
+        """
+        # fingerprint the rules before the validator starts changing the schema
+        self.history_key = 'validation-history:' + hashlib.sha256(
+            json.dumps([history_id, make_schema_fingerprint(schema)], sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        super().__init__(schema)
+        self.local_rules = set(
+            index for index, rule in enumerate(schema.rules) if is_row_local_rule(rule)
+        )
+        self.rule_indices = {id(rule): index for index, rule in enumerate(schema.rules)}
+        self.rows_checked = 0
+        self.rows_reused = 0
+        self._previous = {}
+        self._history = {}
+        self._capture = None
+        self._column_indices = None
+        self._columns_key = None
+
+    def _run(self, source, read_all=False):
+        self._load_history(source.columns)
+        yield from super()._run(source, read_all)
+        self._save_history()
+
+    def _validate_row(self, row):
+        """Validate one row, replaying the row-local rules' issues if the row hasn't changed"""
+        status = True
+        digest = make_row_digest(row)
+        entry = self._previous.get(digest)
+        if entry is None:
+            # new or changed row: run every rule, and remember the row-local issues
+            local_status = True
+            self._capture = []
+            for index, rule in enumerate(self.schema.rules):
+                if not rule.validate_row(row):
+                    status = False
+                    if index in self.local_rules:
+                        local_status = False
+            entry = (local_status, tuple(self._capture),)
+            self._capture = None
+            self.rows_checked += 1
+        else:
+            # unchanged row: run only the dataset-wide rules
+            (local_status, issues,) = entry
+            for index, rule in enumerate(self.schema.rules):
+                if index in self.local_rules:
+                    for issue in issues:
+                        if issue[0] == index:
+                            self._add_issue(self._thaw_issue(issue, row))
+                elif not rule.validate_row(row):
+                    status = False
+            if not local_status:
+                status = False
+            self.rows_reused += 1
+        if self._history is not None:
+            self._history[digest] = entry
+            if len(self._history) > int(hxl_proxy.app.config.get('INCREMENTAL_VALIDATION_MAX_ROWS', 0)):
+                # too big to remember
+                self._history = None
+        return status
+
+    def _add_issue(self, issue):
+        if self._capture is not None and not issue.is_external:
+            index = self.rule_indices.get(id(issue.rule))
+            if index in self.local_rules:
+                self._capture.append(self._freeze_issue(index, issue))
+        super()._add_issue(issue)
+
+    def _freeze_issue(self, rule_index, issue):
+        """Make a picklable tuple from a row-local issue"""
+        column_index = None
+        if issue.column is not None and issue.row is not None:
+            column_index = self._get_column_indices(issue.row.columns).get(id(issue.column))
+        return (rule_index, issue.message, column_index, issue.value, issue.suggested_value, issue.scope,)
+
+    def _thaw_issue(self, frozen, row):
+        """Make an issue for a row from a tuple made by _freeze_issue()"""
+        (rule_index, message, column_index, value, suggested_value, scope,) = frozen
+        return hxl.validation.HXLValidationException(
+            message,
+            rule=self.schema.rules[rule_index],
+            value=value,
+            row=row,
+            column=row.columns[column_index] if column_index is not None else None,
+            suggested_value=suggested_value,
+            scope=scope
+        )
+
+    def _get_column_indices(self, columns):
+        """Map the column objects to their positions"""
+        if self._column_indices is None:
+            self._column_indices = {id(column): index for index, column in enumerate(columns)}
+        return self._column_indices
+
+    def _load_history(self, columns):
+        """Load the history for this dataset and schema, if it has the same columns"""
+        self._columns_key = json.dumps([[column.header, column.display_tag] for column in columns])
+        history = hxl_proxy.cache.get(self.history_key)
+        if history is not None and history.get('columns') == self._columns_key:
+            self._previous = history['rows']
+            logger.debug("Using the validation history for %d rows", len(self._previous))
+
+    def _save_history(self):
+        """Save the history for the next run (unless there were too many rows)"""
+        logger.info("Validated %d changed rows and reused %d unchanged ones", self.rows_checked, self.rows_reused)
+        if self._history is not None:
+            hxl_proxy.cache.set(
+                self.history_key,
+                {'columns': self._columns_key, 'rows': self._history},
+                timeout=int(hxl_proxy.app.config.get('INCREMENTAL_VALIDATION_TIMEOUT', DEFAULT_TIMEOUT))
+            )
+
+
+def is_row_local_rule(rule):
+    """Test whether all of a rule's tests look at only one row at a time."""
+    return all(type(test) in ROW_LOCAL_TESTS for test in rule.tests)
+
+
+def make_row_digest(row):
+    """Hash a row's values."""
+    return hashlib.blake2b(
+        json.dumps(row.values, ensure_ascii=False, default=str).encode('utf-8'),
+        digest_size=16
+    ).digest()
+
+
+def make_schema_fingerprint(schema):
+    """Make a canonical, JSON-ready form of a compiled schema's rules.
+    Stable across processes (sets are sorted), so it can go into a shared cache key.
+    """
+    return _canonical(schema.rules)
+
+
+def _canonical(value):
+    """Canonical form of a value inside a schema (see make_schema_fingerprint())"""
+    if value is None or isinstance(value, (str, int, float, bool,)):
+        return value
+    elif isinstance(value, (list, tuple,)):
+        return [_canonical(item) for item in value]
+    elif isinstance(value, (set, frozenset,)):
+        return sorted(json.dumps(_canonical(item), sort_keys=True) for item in value)
+    elif isinstance(value, dict):
+        return {str(name): _canonical(item) for name, item in value.items()}
+    elif isinstance(value, re.Pattern):
+        return ['re', value.pattern, value.flags]
+    elif hasattr(value, '__dict__'):
+        return [type(value).__name__, {
+            name: _canonical(item) for name, item in vars(value).items()
+            if name not in FINGERPRINT_EXCLUDES and not callable(item)
+        }]
+    else:
+        return repr(value)
+
+# end
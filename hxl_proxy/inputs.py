@@ -0,0 +1,201 @@
+"""Raw-input wrappers for the HXL Proxy.
+
+These classes sit between libhxl-python's hxl.input.make_input() and
+the HXL parser (or just after it), so that the proxy can control how
+often (and how much of) a remote source it reads.
+
+Started October 2026
+License: Public Domain
+"""
+
+import collections, hxl, itertools, logging, threading
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+
+class RewindableInput(hxl.input.AbstractInput):
+    """Raw input that can go back to its first row once.
+
+    Rows are buffered as they are read, until rewind() or commit() is
+    called. After rewind(), the next iterator replays the buffered rows
+    and then carries on with the underlying input, without buffering
+    any more. After commit(), the buffer is dropped. setup_filters()
+    uses this to look for hashtags and then, if there aren't any, to
+    hand the same rows to the Tagger, so that the source is downloaded
+    and parsed only once. If there are hashtags, it commits, so that
+    only the rows before the hashtag row were ever buffered.
+
+    Usage:
+        input = RewindableInput(hxl.make_input(url))
+        try:
+            hxl.data(input).columns
+            input.commit()
+        except hxl.input.HXLTagsNotFoundException:
+            input.rewind()
+            tagged = Tagger(input, specs)
+
+    """
+
+    def __init__(self, input):
+        """
+        @param input: the raw hxl.input.AbstractInput to wrap
+        """
+        super().__init__(
+            getattr(input, 'input_options', None),
+            getattr(input, 'url_or_filename', None)
+        )
+        self.input = input
+        self.format = getattr(input, 'format', None)
+        self._iter = iter(input)
+        self._buffer = []
+        self._replay = collections.deque()
+
+    def rewind(self):
+        """Replay the rows read so far, then stop buffering."""
+        if self._buffer is None:
+            raise hxl.HXLException("RewindableInput can be rewound only once")
+        self._replay = collections.deque(self._buffer)
+        self._buffer = None
+
+    def commit(self):
+        """Stop buffering, and drop the rows buffered so far (there'll be no rewind)."""
+        self._buffer = None
+
+    def __iter__(self):
+        return RewindableInput._Iterator(self)
+
+    def __enter__(self):
+        self.input.__enter__()
+        return self
+
+    def __exit__(self, value, type, traceback):
+        self.input.__exit__(value, type, traceback)
+
+    class _Iterator:
+        """Internal iterator: replay first, then read (and maybe buffer) new rows"""
+
+        def __init__(self, outer):
+            self.outer = outer
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            if self.outer._replay:
+                return self.outer._replay.popleft()
+            row = next(self.outer._iter)
+            if self.outer._buffer is not None:
+                self.outer._buffer.append(row)
+            return row
+
+
+class SharedDataset:
+    """Parse a dataset once, for several users in the same request.
+
+    util.hxl_data() keeps one of these for each distinct URL and set
+    of input options in a request, and gives each caller a view (see
+    view()). If there's only one view when the first one starts
+    reading rows, it reads straight from the parser, without keeping
+    anything. Otherwise, up to max_rows parsed rows are kept, and each
+    view gets its own copies of them, so that a filter that changes a
+    row can't affect the other views. A view that reads past the kept
+    rows, or starts reading after an unshared read has begun, parses
+    the dataset again (the download itself is still shared; see
+    util.fetch_url()). With max_rows=0, every view parses the dataset
+    itself.
+
+    Usage:
+        shared = SharedDataset(lambda: hxl.data(url), max_rows=10000)
+        merge_source = shared.view()
+        map_source = shared.view()
+
+    """
+
+    def __init__(self, make_source, max_rows=0):
+        """
+        @param make_source: function returning a new hxl.model.Dataset for the source
+        @param max_rows: the maximum number of parsed rows to keep for the views to share
+        """
+        self.make_source = make_source
+        self.max_rows = max_rows
+        self.view_count = 0
+        self._source = None
+        self._iter = None
+        self._rows = None
+        self._exhausted = False
+        self._streamed = False
+        self._lock = threading.Lock()
+
+    def view(self):
+        """Make a new view of the dataset.
+        @returns: a hxl.model.Dataset
+        """
+        self.view_count += 1
+        return SharedDataset._View(self)
+
+    @property
+    def columns(self):
+        # views in other threads (e.g. in util.hxl_data_list) may be here at the same time
+        with self._lock:
+            if self._source is None:
+                self._source = self.make_source()
+            return self._source.columns
+
+    def iter_rows(self):
+        """Iterate over the rows for one view."""
+        with self._lock:
+            if self._streamed:
+                # someone is already reading the parser without keeping the rows
+                return iter(self.make_source())
+            if self._rows is None:
+                source = self._source if self._source is not None else self.make_source()
+                self._source = source
+                if self.view_count < 2 or self.max_rows <= 0:
+                    # nothing to share (or no room to keep the rows), so read the parser directly
+                    self._streamed = True
+                    return iter(source)
+                self._iter = iter(source)
+                self._rows = []
+        return self._replay()
+
+    def _replay(self):
+        """Replay copies of the kept rows, parsing more as needed."""
+        index = 0
+        while True:
+            with self._lock:
+                if index < len(self._rows):
+                    row = self._rows[index]
+                elif self._exhausted:
+                    return
+                elif len(self._rows) >= self.max_rows:
+                    row = None
+                else:
+                    try:
+                        row = next(self._iter)
+                    except StopIteration:
+                        self._exhausted = True
+                        return
+                    self._rows.append(row)
+            if row is None:
+                # past the kept rows, so carry on from a new parse
+                yield from itertools.islice(self.make_source(), index, None)
+                return
+            yield hxl.model.Row(row.columns, list(row.values), row.row_number, row.source_row_number)
+            index += 1
+
+    class _View(hxl.model.Dataset):
+        """One caller's view of a SharedDataset."""
+
+        def __init__(self, shared):
+            super().__init__()
+            self.shared = shared
+
+        @property
+        def columns(self):
+            return self.shared.columns
+
+        def __iter__(self):
+            return self.shared.iter_rows()
+
+# end
@@ -0,0 +1,106 @@
+"""Cached JSONPath extraction for the HXL Proxy.
+
+libhxl-python's hxl.filters.JSONPathFilter parses its JSONPath
+expression each time a filter is built, then decodes the JSON and
+evaluates the path again for every cell it touches. The
+CachedJSONPathFilter class in this module parses each distinct
+expression only once per process (see parse_path()), and remembers
+the extracted value for each distinct cell value in a column (JSON
+columns from KoBo exports and similar repeat heavily).
+
+Started October 2026
+License: Public Domain
+"""
+
+import functools, hxl, json, jsonpath_ng.ext, logging
+import hxl.filters
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+MAX_MEMO_SIZE = 10000
+""" Maximum number of distinct cell values to remember per column """
+
+
+@functools.lru_cache(maxsize=256)
+def parse_path(path):
+    """Parse a JSONPath expression only once.
+    Parsed expressions have no state, so they are safe to share between filters.
+    @param path: the JSONPath expression as a string
+    @returns: a jsonpath_ng expression
+    """
+    return jsonpath_ng.ext.parse(path)
+
+
+class CachedJSONPathFilter(hxl.filters.JSONPathFilter):
+    """Extract values from JSON in cells, with a cached path and per-column memo.
+
+    Takes the same arguments as hxl.filters.JSONPathFilter, and
+    produces exactly the same output.
+
+    Usage:
+        source = CachedJSONPathFilter(hxl.data(url), '$.name', patterns='#x_json')
+
+    """
+
+    def __init__(self, source, path, patterns=None, queries=[], use_json=True):
+        # skip JSONPathFilter.__init__, which would parse the path again
+        hxl.filters.AbstractStreamingFilter.__init__(self, source)
+        self.path = parse_path(path)
+        self.patterns = hxl.model.TagPattern.parse_list(patterns)
+        self.queries = self._setup_queries(queries)
+        self.use_json = use_json
+        self._indices = None
+        self._memos = None
+
+    def filter_row(self, row):
+        if self._indices is None:
+            self._indices = self._get_indices(self.patterns)
+            self._memos = [{} for i in self._indices]
+
+        values = list(row.values)
+
+        if hxl.model.RowQuery.match_list(row, self.queries):
+            for i, memo in zip(self._indices, self._memos):
+                if i >= len(values):
+                    continue
+                value = values[i]
+                try:
+                    result = memo.get(value)
+                except TypeError:
+                    # not hashable, so not JSON text either
+                    result = None
+                if result is None:
+                    result = self._extract(value)
+                    if len(memo) < MAX_MEMO_SIZE:
+                        try:
+                            memo[value] = result
+                        except TypeError:
+                            pass
+                if result is not _INVALID:
+                    values[i] = result
+
+        return values
+
+    def _extract(self, value):
+        """Extract the path's value(s) from a JSON string.
+        @returns: the flattened result, or _INVALID if the value isn't valid JSON
+        """
+        try:
+            expr = json.loads(value)
+            results = [match.value for match in self.path.find(expr)]
+            if len(results) == 0:
+                return ''
+            elif len(results) == 1:
+                return hxl.datatypes.flatten(results[0], self.use_json)
+            else:
+                return hxl.datatypes.flatten(results, self.use_json)
+        except (ValueError, TypeError,):
+            logger.warning("Skipping invalid JSON expression '%s'", value)
+            return _INVALID
+
+
+_INVALID = object()
+""" Marker for a cell value that isn't valid JSON """
+
+# end
@@ -0,0 +1,146 @@
+"""Process-pool offload for CPU-heavy requests in the HXL Proxy.
+
+Each HXL Proxy process serves requests in several threads. A request
+that spends most of its time in Python code (parsing an Excel
+workbook, or cleaning, sorting, or counting a large dataset) holds the
+GIL, and stalls the other threads' requests, even if they need only a
+cached response. The controllers can use this module to run heavy
+requests in a separate, bounded pool of worker processes instead.
+
+Offloading is off unless app.config["OFFLOAD_WORKERS"] is greater than
+zero. A request that waits longer than app.config["OFFLOAD_TIMEOUT"]
+seconds for its worker gets a 504 Gateway Timeout.
+
+Started October 2026
+License: Public Domain
+"""
+
+import atexit, concurrent.futures, flask, hxl_proxy, logging, re, threading, werkzeug
+from hxl_proxy import filters, parallel
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+HEAVY_FILTERS = ('clean', 'count', 'dedup', 'expand', 'implode', 'jsonpath', 'merge', 'sort',)
+""" Filters that do enough work per row to be worth offloading """
+
+DEFAULT_TIMEOUT = 120
+""" Default number of seconds to wait for an offloaded request """
+
+EXCEL_URL_PATTERN = re.compile(r'\.xlsx?(?:$|[?#])', re.IGNORECASE)
+""" Source URLs that (probably) point to an Excel workbook """
+
+_executor = None
+""" Shared process pool (see get_executor()) """
+
+_executor_lock = threading.Lock()
+""" Lock for creating the shared process pool """
+
+
+def is_heavy_recipe(args):
+    """Guess whether a recipe will be CPU-heavy, from its arguments alone.
+    Excel sources, JSON recipes, and filters in HEAVY_FILTERS count as
+    heavy, unless the source isn't Excel and the output is row-limited
+    with only streaming filters (so that only a few rows will be read).
+    @param args: the recipe arguments
+    @returns: True if the recipe is likely to be CPU-heavy
+    """
+    is_excel = bool(EXCEL_URL_PATTERN.search(args.get('url') or ''))
+    if not is_excel and args.get('max-rows') and filters.is_streaming_recipe(args):
+        return False
+    if is_excel or args.get('recipe'):
+        return True
+    for index in range(1, filters.MAX_FILTER_COUNT):
+        if args.get('filter%02d' % index) in HEAVY_FILTERS:
+            return True
+    return False
+
+
+def should_offload(args):
+    """Test whether offloading is on, and the recipe is heavy enough to offload."""
+    return int(hxl_proxy.app.config.get('OFFLOAD_WORKERS', 0)) > 0 and is_heavy_recipe(args)
+
+
+def get_executor():
+    """Get the shared process pool, creating it if needed.
+    The size comes from app.config["OFFLOAD_WORKERS"].
+    @returns: a concurrent.futures.ProcessPoolExecutor
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = int(hxl_proxy.app.config.get('OFFLOAD_WORKERS', 0))
+            logger.info("Starting a pool of %d offload worker processes", max_workers)
+            _executor = parallel.make_process_pool(max_workers, initializer=_init_worker)
+        return _executor
+
+
+def reset_executor():
+    """Discard the shared process pool (e.g. after a worker died)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+# stop the workers cleanly when the main process exits
+atexit.register(reset_executor)
+
+
+def run_in_request_context(function, *args):
+    """Run a function in an offload worker, inside a copy of the current request context.
+    The worker sees the same path, GET parameters, and output format (flask.g.output_format),
+    so that URLs and redirects work as they do in the request thread. The function
+    and its arguments must be picklable (e.g. a module-level function with plain data).
+    @param function: the function to call
+    @param args: the positional arguments for the function
+    @returns: the function's return value (exceptions are re-raised; see parallel.call_in_worker())
+    @raises werkzeug.exceptions.GatewayTimeout: if the worker doesn't finish within app.config["OFFLOAD_TIMEOUT"] seconds
+    """
+    request = flask.request
+    context = {
+        'path': request.path,
+        'base_url': request.host_url,
+        'query_string': request.query_string.decode('utf-8'),
+        'output_format': flask.g.get('output_format', 'html'),
+    }
+    timeout = float(hxl_proxy.app.config.get('OFFLOAD_TIMEOUT', DEFAULT_TIMEOUT))
+    future = get_executor().submit(_call, context, function, args)
+    try:
+        # waiting doesn't hold the GIL, so the other request threads keep going
+        return parallel.get_result(future.result(timeout=timeout))
+    except concurrent.futures.TimeoutError:
+        # drop it if it hasn't started yet
+        future.cancel()
+        logger.error("Offloaded request for %s timed out after %s seconds", context['path'], timeout)
+        raise werkzeug.exceptions.GatewayTimeout("Timed out processing the request")
+    except concurrent.futures.process.BrokenProcessPool:
+        reset_executor()
+        raise
+
+
+def _init_worker():
+    """Set up a worker process."""
+    # don't start another process pool from inside this one
+    hxl_proxy.app.config['PARALLEL_WORKERS'] = 0
+
+
+def _call(context, function, args):
+    """Call a function in a copy of the request context (in a worker process).
+    @returns: a (succeeded, value) tuple for parallel.get_result()
+    """
+    return parallel.call_in_worker(_call_in_context, context, function, args)
+
+
+def _call_in_context(context, function, args):
+    """Set up the copy of the request context, and call the function"""
+    with hxl_proxy.app.test_request_context(
+            context['path'],
+            base_url=context['base_url'],
+            query_string=context['query_string']
+    ):
+        flask.g.output_format = context['output_format']
+        return function(*args)
+
+# end
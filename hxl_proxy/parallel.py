@@ -0,0 +1,250 @@
+"""Chunk-parallel execution of row-local filters for the HXL Proxy.
+
+Stages such as clean, replace, add, select, and rename look at one row
+at a time, so a run of them can process different parts of a dataset
+at the same time. The ParallelChunkFilter class in this module reads
+the rows from upstream in chunks, sends each chunk through the stages
+in a shared process pool, and yields the results in the original
+order.
+
+filters.setup_filters() uses it for runs of row-local stages when
+app.config["PARALLEL_WORKERS"] is greater than zero.
+
+Started October 2026
+License: Public Domain
+"""
+
+import collections, concurrent.futures, hxl, importlib, logging, multiprocessing, pickle, threading
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+DEFAULT_CHUNK_SIZE = 10000
+""" Default number of rows to send to a worker process at once """
+
+_executor = None
+""" Shared process pool (see get_executor()) """
+
+_executor_lock = threading.Lock()
+""" Lock for creating the shared process pool """
+
+
+def get_executor(max_workers):
+    """Get the shared process pool, creating it if needed.
+    The pool is created only once per process, with the size from the first call.
+    @param max_workers: the number of worker processes
+    @returns: a concurrent.futures.ProcessPoolExecutor
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            logger.info("Starting a pool of %d worker processes", max_workers)
+            _executor = make_process_pool(max_workers)
+        return _executor
+
+
+def reset_executor():
+    """Discard the shared process pool (e.g. after a worker died)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def make_process_pool(max_workers, initializer=None):
+    """Make a process pool that's safe to start from a multithreaded process.
+    Forking copies locks that other request threads may be holding, so
+    the workers come from a forkserver instead (or are spawned, where
+    there's no forkserver).
+    @param max_workers: the number of worker processes
+    @param initializer: a function to call in each new worker, or None
+    @returns: a concurrent.futures.ProcessPoolExecutor
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('forkserver')
+    else:
+        mp_context = multiprocessing.get_context('spawn')
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=mp_context,
+        initializer=initializer
+    )
+
+
+def call_in_worker(function, *args):
+    """Call a function (in a worker process), catching any exception for get_result().
+    Some exceptions can't be unpickled in the parent process (e.g. libhxl's
+    HXLAuthorizationException and HXLHTMLException, which need a url argument),
+    and would break the whole pool, so those go back as a plain
+    (module, class name, message, url) tuple.
+    @returns: a (succeeded, value) tuple
+    """
+    try:
+        return (True, function(*args),)
+    except Exception as e:
+        try:
+            pickle.loads(pickle.dumps(e))
+            return (False, e,)
+        except Exception:
+            return (False, (type(e).__module__, type(e).__qualname__, getattr(e, 'message', str(e)), getattr(e, 'url', None),),)
+
+
+def get_result(result):
+    """Get the return value from call_in_worker(), or raise its exception again (in the parent process)."""
+    (succeeded, value,) = result
+    if succeeded:
+        return value
+    elif isinstance(value, BaseException):
+        raise value
+    else:
+        raise _rebuild_exception(*value)
+
+
+def _rebuild_exception(module_name, class_name, message, url):
+    """Make an exception again from the tuple made by call_in_worker()"""
+    try:
+        exception_class = getattr(importlib.import_module(module_name), class_name)
+    except (ImportError, AttributeError):
+        exception_class = None
+    if isinstance(exception_class, type) and issubclass(exception_class, hxl.input.HXLIOException):
+        try:
+            return exception_class(message, url)
+        except Exception:
+            return hxl.input.HXLIOException(message, url)
+    return hxl.HXLException('{}: {}'.format(class_name, message))
+
+
+class ChunkSource(hxl.model.Dataset):
+    """Dataset holding a list of row values with known columns."""
+
+    def __init__(self, columns, rows):
+        super().__init__()
+        self._columns = columns
+        self.rows = rows
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def __iter__(self):
+        columns = self._columns
+        return (hxl.model.Row(columns, values, row_number) for row_number, values in enumerate(self.rows))
+
+
+class ParallelChunkFilter(hxl.model.Dataset):
+    """Run row-local stages of a recipe over chunks of rows in worker processes.
+
+    Datasets smaller than one chunk are processed in the calling
+    process, so small requests don't pay to send rows to the pool. At
+    most two chunks per worker are in flight at once, so reading
+    upstream stops soon after the caller stops reading.
+
+    Usage:
+        source = ParallelChunkFilter(source, recipe.args, [1, 2], workers=4)
+
+    """
+
+    def __init__(self, source, args, indices, workers, chunk_size=None):
+        """
+        @param source: the upstream hxl.model.Dataset
+        @param args: the recipe arguments
+        @param indices: the recipe indices of the (row-local) filters to run
+        @param workers: the number of worker processes
+        @param chunk_size: the number of rows per chunk (default: DEFAULT_CHUNK_SIZE)
+        """
+        super().__init__()
+        self.source = source
+        self.args = dict(args)
+        self.indices = list(indices)
+        self.workers = workers
+        self.chunk_size = chunk_size if chunk_size else DEFAULT_CHUNK_SIZE
+        self._columns = None
+
+    @property
+    def columns(self):
+        # build the stages over an empty dataset to see what columns they produce
+        if self._columns is None:
+            self._columns = _build_stages(self.args, self.indices, ChunkSource(self.source.columns, [])).columns
+        return self._columns
+
+    def __iter__(self):
+        return self._generate_rows()
+
+    def _generate_rows(self):
+        """Generate the output rows, in their original order."""
+        columns = self.columns
+        input_columns = self.source.columns
+        chunks = self._read_chunks()
+        row_number = 0
+
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            return
+        if len(first_chunk) < self.chunk_size:
+            # the whole dataset fits in one chunk: not worth using the pool
+            for values in run_chunk(self.args, self.indices, input_columns, first_chunk):
+                yield hxl.model.Row(columns, values, row_number)
+                row_number += 1
+            return
+
+        executor = get_executor(self.workers)
+        pending = collections.deque()
+        pending.append(self._submit(executor, input_columns, first_chunk))
+        try:
+            while pending:
+                while len(pending) < self.workers * 2:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    pending.append(self._submit(executor, input_columns, chunk))
+                try:
+                    results = get_result(pending.popleft().result())
+                except concurrent.futures.process.BrokenProcessPool:
+                    reset_executor()
+                    raise
+                for values in results:
+                    yield hxl.model.Row(columns, values, row_number)
+                    row_number += 1
+        finally:
+            # the caller may have stopped reading early
+            for future in pending:
+                future.cancel()
+
+    def _submit(self, executor, input_columns, chunk):
+        """Send one chunk to the pool."""
+        return executor.submit(call_in_worker, run_chunk, self.args, self.indices, input_columns, chunk)
+
+    def _read_chunks(self):
+        """Read the upstream rows as lists of value lists."""
+        chunk = []
+        for row in self.source:
+            chunk.append(row.values)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def run_chunk(args, indices, columns, rows):
+    """Run a chunk of rows through the filters (in a worker process).
+    @param args: the recipe arguments
+    @param indices: the recipe indices of the filters to run
+    @param columns: the input columns
+    @param rows: a list of value lists
+    @returns: a list of value lists
+    """
+    source = _build_stages(args, indices, ChunkSource(columns, rows))
+    return [row.values for row in source]
+
+
+def _build_stages(args, indices, source):
+    """Add the filters at indices to source."""
+    # imported here, because filters imports this module
+    from hxl_proxy import filters
+    for index in indices:
+        source = filters.add_filter(source, args, index)
+    return source
+
+# end
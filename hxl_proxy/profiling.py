@@ -0,0 +1,269 @@
+"""Per-stage profiling for HXL Proxy filter pipelines.
+
+filters.setup_filters() can take a PipelineProfiler. If it does, it
+times fetching and opening the source, then wraps each stage of the
+pipeline (the parser, a JSON recipe, and each filter) in a
+ProfiledDataset. The wrappers record the time spent in each stage
+(excluding the upstream stages it pulls rows from), the rows that pass
+through it, and the peak memory allocated while it's working.
+
+Memory tracing (tracemalloc) is process-wide, so only one profile at a
+time traces memory. If another profile is running, or something else
+was already tracing, the profile reports peak memory as unavailable
+(null) rather than reset or stop someone else's tracing.
+
+Only admin users can request a profile (see controllers.py), since
+profiling runs the whole pipeline and traces memory allocations.
+
+Started October 2026
+License: Public Domain
+"""
+
+import contextlib, hxl, logging, threading, time, tracemalloc
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+_tracing_lock = threading.Lock()
+""" Held by the profiler that's tracing memory, if any """
+
+
+class Stage:
+    """Measurements for one stage of a pipeline."""
+
+    def __init__(self, name, index=None):
+        self.name = name
+        self.index = index
+        self.class_name = None
+        self.setup_wall = 0.0
+        self.setup_cpu = 0.0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_memory = 0
+        self.rows_out = 0
+
+    def as_dict(self, rows_in=None, traced=True):
+        """Return the measurements as a JSON-ready dict (times in milliseconds, memory in bytes)
+        @param rows_in: the number of rows from the upstream stage, if any
+        @param traced: if False, memory wasn't traced, so report it as None
+        """
+        return {
+            'name': self.name,
+            'index': self.index,
+            'class': self.class_name,
+            'setup_ms': round(self.setup_wall * 1000, 3),
+            'setup_cpu_ms': round(self.setup_cpu * 1000, 3),
+            'wall_ms': round(self.wall * 1000, 3),
+            'cpu_ms': round(self.cpu * 1000, 3),
+            'rows_in': rows_in,
+            'rows_out': self.rows_out,
+            'peak_memory_bytes': self.peak_memory if traced else None,
+        }
+
+
+class _Frame:
+    """An active measurement (stages can call each other, so these nest)."""
+
+    __slots__ = ('stage', 'wall', 'cpu', 'child_wall', 'child_cpu', 'memory', 'peak',)
+
+    def __init__(self, stage, memory):
+        self.stage = stage
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+        self.memory = memory
+        self.peak = memory
+
+
+class PipelineProfiler:
+    """Collect per-stage measurements for a filter pipeline.
+
+    Wall time uses time.perf_counter() and CPU time uses
+    time.thread_time(), so the figures are for the request's own
+    thread. Each stage's time excludes the time spent in the stages it
+    reads from. Peak memory is the highest traced allocation above the
+    level when the stage started working, including anything its
+    upstream stages allocated in the meantime. It's None if the profiler
+    couldn't trace memory (see the module docstring).
+
+    Usage:
+        profiler = PipelineProfiler()
+        with profiler:
+            source = filters.setup_filters(recipe, profiler=profiler)
+            for row in source:
+                pass
+        report = profiler.report()
+
+    """
+
+    def __init__(self):
+        self.fetch = Stage('fetch')
+        self.stages = []
+        self._stack = []
+        self._setup_frame = None
+        self.traced = False
+        self._start_wall = None
+        self._total_wall = None
+
+    def __enter__(self):
+        if _tracing_lock.acquire(blocking=False):
+            if tracemalloc.is_tracing():
+                # somebody else's tracing; don't disturb it
+                _tracing_lock.release()
+            else:
+                tracemalloc.start()
+                self.traced = True
+        if not self.traced:
+            logger.info("Memory tracing is already in use, so the profile won't include memory")
+        self._start_wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._total_wall = time.perf_counter() - self._start_wall
+        if self.traced:
+            tracemalloc.stop()
+            _tracing_lock.release()
+
+    @contextlib.contextmanager
+    def measure_fetch(self):
+        """Measure fetching and opening the source (until the columns are known)."""
+        frame = self._enter(self.fetch)
+        try:
+            yield
+        finally:
+            self._exit(frame)
+
+    def start_setup(self):
+        """Start timing the construction of the next stage (finished by wrap())"""
+        self._setup_frame = self._enter(Stage(None))
+
+    def wrap(self, source, name, index=None):
+        """Wrap the latest stage of a pipeline so that it's measured.
+        @param source: the hxl.model.Dataset for the stage
+        @param name: the stage's name (e.g. the filter type)
+        @param index: the filter's index in the recipe, if any
+        @returns: a ProfiledDataset
+        """
+        stage = Stage(name, index)
+        stage.class_name = source.__class__.__name__
+        if self._setup_frame is not None:
+            self._exit(self._setup_frame)
+            stage.setup_wall = self._setup_frame.stage.wall
+            stage.setup_cpu = self._setup_frame.stage.cpu
+            stage.peak_memory = self._setup_frame.stage.peak_memory
+            self._setup_frame = None
+        self.stages.append(stage)
+        return ProfiledDataset(source, stage, self)
+
+    def report(self):
+        """Return the measurements as a JSON-ready dict."""
+        stages = []
+        rows_in = None
+        for stage in self.stages:
+            stages.append(stage.as_dict(rows_in, self.traced))
+            rows_in = stage.rows_out
+        return {
+            'total_ms': round(self._total_wall * 1000, 3) if self._total_wall is not None else None,
+            'fetch': {
+                'wall_ms': round(self.fetch.wall * 1000, 3),
+                'cpu_ms': round(self.fetch.cpu * 1000, 3),
+                'peak_memory_bytes': self.fetch.peak_memory if self.traced else None,
+            },
+            'stages': stages,
+        }
+
+    def _enter(self, stage):
+        """Start a (possibly-nested) measurement."""
+        memory = 0
+        if self.traced:
+            memory, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # save the outer stage's peak before resetting it
+                outer = self._stack[-1]
+                outer.peak = max(outer.peak, peak)
+            tracemalloc.reset_peak()
+        frame = _Frame(stage, memory)
+        self._stack.append(frame)
+        return frame
+
+    def _exit(self, frame):
+        """Finish a measurement, and charge it to the stage and its caller."""
+        wall = time.perf_counter() - frame.wall
+        cpu = time.thread_time() - frame.cpu
+        if self.traced:
+            frame.peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+        stage = frame.stage
+        stage.wall += wall - frame.child_wall
+        stage.cpu += cpu - frame.child_cpu
+        stage.peak_memory = max(stage.peak_memory, frame.peak - frame.memory)
+        self._stack.remove(frame)
+        if self._stack:
+            outer = self._stack[-1]
+            outer.child_wall += wall
+            outer.child_cpu += cpu
+            outer.peak = max(outer.peak, frame.peak)
+
+
+class NullProfiler:
+    """Profiler that doesn't measure anything (the default for setup_filters)."""
+
+    def measure_fetch(self):
+        return contextlib.nullcontext()
+
+    def start_setup(self):
+        pass
+
+    def wrap(self, source, name, index=None):
+        return source
+
+
+class ProfiledDataset(hxl.model.Dataset):
+    """Pass-through dataset that measures one stage of a pipeline."""
+
+    def __init__(self, source, stage, profiler):
+        super().__init__()
+        self.source = source
+        self.stage = stage
+        self.profiler = profiler
+
+    @property
+    def columns(self):
+        # reading the columns may read rows upstream
+        frame = self.profiler._enter(self.stage)
+        try:
+            return self.source.columns
+        finally:
+            self.profiler._exit(frame)
+
+    @property
+    def is_cached(self):
+        return self.source.is_cached
+
+    def __iter__(self):
+        return ProfiledDataset._Iterator(self)
+
+    class _Iterator:
+
+        def __init__(self, outer):
+            self.outer = outer
+            frame = outer.profiler._enter(outer.stage)
+            try:
+                self.iterator = iter(outer.source)
+            finally:
+                outer.profiler._exit(frame)
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            outer = self.outer
+            frame = outer.profiler._enter(outer.stage)
+            try:
+                row = next(self.iterator)
+            finally:
+                outer.profiler._exit(frame)
+            outer.stage.rows_out += 1
+            return row
+
+# end
@@ -0,0 +1,147 @@
+"""Compiled row queries for the HXL Proxy.
+
+Most filters take row queries (e.g. "clean-where", "select-query"),
+which libhxl-python's hxl.model.RowQuery matches against the tag
+patterns of every row's columns, and whose values it normalises again
+for every row. The CompiledRowQuery class in this module binds the
+matching column indices once for each list of columns it sees, and
+remembers whether each distinct cell value matched.
+
+Query strings are parsed once and the results cached (see
+parse_list()), so the same recipe doesn't re-parse its queries each
+time a pipeline is built.
+
+Started October 2026
+License: Public Domain
+"""
+
+import functools, hxl, logging
+import hxl.formulas.eval
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+MAX_MEMO_SIZE = 10000
+""" Maximum number of distinct cell values to remember per query """
+
+
+class CompiledRowQuery(hxl.model.RowQuery):
+    """Row query bound to column indices.
+
+    Behaves like hxl.model.RowQuery, but:
+
+    - finds the matching column indices only when it sees a new list
+      of columns (filters share one list for all of their rows)
+    - normalises the query value only once (unless it's a formula)
+    - remembers the result for each distinct cell value (unless the
+      value is a formula)
+
+    Usage:
+        queries = parse_list('#sector=WASH')
+        hxl.data(url).with_rows(queries)
+
+    """
+
+    def __init__(self, pattern, op, value, is_aggregate=False):
+        super().__init__(pattern, op, value, is_aggregate)
+        self._bound_columns = None
+        self._bound_indices = None
+        self._value_ready = False
+        self._memo = {}
+
+    def calc_aggregate(self, dataset):
+        """Calculate the aggregate value, then forget any prepared value."""
+        super().calc_aggregate(dataset)
+        self._value_ready = False
+        self._memo = {}
+
+    def match_row(self, row):
+        """Check if a key-value pair appears in a HXL row"""
+
+        # fail if we need an aggregate and haven't calculated it
+        if self.needs_aggregate:
+            raise hxl.HXLException("must call calc_aggregate before matching an 'is min' or 'is max' condition")
+
+        columns = row.columns
+        if columns is not self._bound_columns:
+            self._bind(columns)
+        values = row.values
+
+        # formulas depend on the whole row, so there's nothing to remember
+        if self.formula:
+            self._prepare_value(hxl.formulas.eval.eval(row, self.formula))
+            for i in self._bound_indices:
+                if i < len(values) and self.match_value(values[i], self.op):
+                    return True
+            return False
+
+        for i in self._bound_indices:
+            if i < len(values) and self.match_cell(values[i]):
+                return True
+        return False
+
+    def match_cell(self, value):
+        """Check if a single cell value matches (not for formula or aggregate queries)"""
+        if not self._value_ready:
+            self._prepare_value(self.value)
+            self._value_ready = True
+
+        result = self._memo.get(value)
+        if result is None:
+            result = bool(self.match_value(value, self.op))
+            if len(self._memo) < MAX_MEMO_SIZE:
+                self._memo[value] = result
+        return result
+
+    def bind_indices(self, columns):
+        """Return the indices of the columns that match the query's pattern."""
+        if columns is not self._bound_columns:
+            self._bind(columns)
+        return self._bound_indices
+
+    def _bind(self, columns):
+        """Find the indices of the columns that match the query's pattern."""
+        self._bound_columns = columns
+        self._bound_indices = [i for i, column in enumerate(columns) if self.pattern.match(column)]
+
+    def _prepare_value(self, value):
+        """Normalise the query value as a date, number, and string (as RowQuery.match_row() does)."""
+        if self.pattern.tag == '#date':
+            try:
+                self.date_value = hxl.datatypes.normalise_date(value)
+            except ValueError:
+                self.date_value = None
+
+        try:
+            self.number_value = hxl.datatypes.normalise_number(value)
+        except ValueError:
+            self.number_value = None
+
+        self.string_value = hxl.datatypes.normalise_string(value)
+
+
+def parse_list(specs):
+    """Parse a single query spec or a list of specs into compiled queries.
+    Already-parsed queries are passed through unchanged.
+    @param specs: a query string, RowQuery, or list of them (may be None)
+    @returns: a list of RowQuery objects
+    """
+    if not specs:
+        return []
+    if isinstance(specs, (str, hxl.model.RowQuery,)):
+        specs = [specs]
+    return [
+        spec if isinstance(spec, hxl.model.RowQuery) else CompiledRowQuery(*_parse_spec(spec))
+        for spec in specs
+    ]
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_spec(spec):
+    """Parse a query string only once.
+    Returns the constructor arguments, since queries themselves have state.
+    """
+    query = hxl.model.RowQuery.parse(spec)
+    return (query.pattern, query.op, query.value, query.is_aggregate,)
+
+# end
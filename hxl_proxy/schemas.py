@@ -0,0 +1,142 @@
+"""Compiled validation schemas for the HXL Proxy.
+
+Most validation requests use one of a handful of schemas, but
+hxl.validate() downloads, parses, and compiles the schema again every
+time (including any allowed-value lists that the schema loads from
+other URLs). This module keeps compiled schemas in memory, keyed by
+the schema URL, the input options, and the HTTP validators (ETag and
+Last-Modified) the server sends for it, or by the hash of an uploaded
+schema. A cheap HEAD request checks whether a schema from a URL is
+still current.
+
+A compiled schema keeps state while it validates a dataset, so each
+request gets its own copy of the cached one (see get_schema()).
+
+The cache is off unless app.config["SCHEMA_CACHE_SIZE"] is greater
+than zero.
+
+Started October 2026
+License: Public Domain
+"""
+
+import collections, copy, hxl, hxl_proxy, logging, threading, time
+from hxl_proxy import snapshot, util
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+DEFAULT_TIMEOUT = 3600
+""" Default number of seconds to keep a compiled schema (allowed-value lists may change) """
+
+
+class SchemaCache:
+    """Least-recently-used cache of compiled schemas, with a limit on their number and age."""
+
+    def __init__(self):
+        self.schemas = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, timeout):
+        """@returns: the compiled schema for key, or None if it's missing or too old"""
+        with self.lock:
+            entry = self.schemas.get(key)
+            if entry is None:
+                return None
+            (created, schema,) = entry
+            if time.time() - created > timeout:
+                del self.schemas[key]
+                return None
+            self.schemas.move_to_end(key)
+            return schema
+
+    def put(self, key, schema, max_size):
+        """Add a compiled schema, discarding the least-recently-used ones to stay within max_size."""
+        with self.lock:
+            self.schemas.pop(key, None)
+            while self.schemas and len(self.schemas) >= max_size:
+                self.schemas.popitem(last=False)
+            self.schemas[key] = (time.time(), schema,)
+
+    def clear(self):
+        """Discard all the compiled schemas."""
+        with self.lock:
+            self.schemas.clear()
+
+
+store = SchemaCache()
+""" Compiled schemas for this process """
+
+
+def get_schema(url=None, content=None, content_hash=None, input_options=None):
+    """Get a compiled validation schema, from the cache if possible.
+    Use at most one of url or content; with neither, get libhxl's built-in default schema.
+    A schema from a URL is cached only if the server sends validators for it, and
+    an uploaded schema only if it has a content hash.
+    @param url: the URL of the schema
+    @param content: an uploaded schema (file-like object)
+    @param content_hash: the hash of the uploaded schema (see uploads.get_upload_hash())
+    @param input_options: the hxl.input.InputOptions for reading the schema
+    @returns: a hxl.validation.Schema for this request only (it's safe to pass to hxl.validate())
+    @raises hxl.input.HXLIOException: if security settings forbid the URL
+    @raises hxl_proxy.exceptions.DomainNotAllowedError: if the domain for the URL is not in the allow list
+    """
+    if url:
+        def make_source():
+            return util.hxl_data(url, input_options)
+    elif content is not None:
+        def make_source():
+            # TODO: stop using libhxl's make_input directly
+            return util.hxl_data(hxl.input.make_input(content, input_options))
+    else:
+        make_source = None
+
+    max_size = int(hxl_proxy.app.config.get('SCHEMA_CACHE_SIZE', 0))
+    if max_size <= 0:
+        return compile_schema(make_source)
+
+    key = _make_key(url, content, content_hash, input_options)
+    if key is None:
+        return compile_schema(make_source)
+
+    timeout = int(hxl_proxy.app.config.get('SCHEMA_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    schema = store.get(key, timeout)
+    if schema is None:
+        schema = compile_schema(make_source)
+        store.put(key, schema, max_size)
+    else:
+        logger.debug("Using compiled schema for %s", url or content_hash or 'the default schema')
+
+    # the cached schema stays pristine; validation runs on a copy
+    return copy.deepcopy(schema)
+
+
+def compile_schema(make_source=None):
+    """Compile a validation schema.
+    @param make_source: function returning a hxl.model.Dataset for the schema, or None for the default schema
+    @returns: a hxl.validation.Schema
+    """
+    if make_source is None:
+        return hxl.schema()
+    return hxl.schema(make_source())
+
+
+def _make_key(url, content, content_hash, input_options):
+    """Cache key for a schema
+    @returns: a hashable key, or None if the schema can't be cached
+    """
+    options_key = util._make_options_key(input_options, True)
+    if url:
+        util.check_allowed_domain(url)
+        util.check_url_security(url, input_options)
+        validators = snapshot.get_validators(url, input_options)
+        if validators is None:
+            return None
+        return ('url', url, options_key, validators,)
+    elif content is not None:
+        if not content_hash:
+            return None
+        return ('content', content_hash, options_key,)
+    else:
+        return ('default',)
+
+# end
@@ -0,0 +1,272 @@
+"""In-memory snapshots of parsed sources for the HXL Proxy.
+
+Dashboards often send dozens of requests for the same source that
+differ only in their select, sort, count, and cut stages. Instead of
+downloading and parsing the source for every one of them, the proxy
+can keep a parsed snapshot of it in memory, keyed by the URL, the
+input options, and the HTTP validators (ETag and Last-Modified) the
+server sends for it. A cheap HEAD request checks whether the snapshot
+is still current, and &force makes a new one.
+
+The filters still run over the snapshot, so the output is exactly the
+same as libhxl's. Select stages straight after the snapshot use
+per-column indexes, testing each distinct value once instead of each
+row (see SnapshotRowFilter).
+
+Snapshots are off unless app.config["SNAPSHOT_MAX_ROWS"] is greater
+than zero.
+
+Started October 2026
+License: Public Domain
+"""
+
+import collections, copy, flask, hxl, hxl_proxy, logging, re, requests, threading
+import hxl.filters
+from hxl_proxy import queries, util
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+SNAPSHOT_FILTERS = ('column', 'count', 'cut', 'rows', 'select', 'sort',)
+""" Filters that recipes can use with a snapshot """
+
+FILTER_ARG_PATTERN = re.compile(r'^filter\d+$')
+""" Parameters naming a recipe's filters """
+
+
+class Snapshot:
+    """The parsed rows of a source, with lazily-built column indexes."""
+
+    def __init__(self, columns, rows):
+        """
+        @param columns: the source's hxl.model.Column objects
+        @param rows: a list of value tuples
+        """
+        self.columns = columns
+        self.rows = rows
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def dataset(self):
+        """Make a new (replayable) dataset over the snapshot."""
+        return SnapshotDataset(self)
+
+    def get_index(self, column_index):
+        """Get the index for a column, building it if needed.
+        @returns: a dict of each distinct value in the column to a list of row positions
+        """
+        with self._lock:
+            index = self._indexes.get(column_index)
+            if index is None:
+                index = collections.defaultdict(list)
+                for position, values in enumerate(self.rows):
+                    if column_index < len(values):
+                        index[values[column_index]].append(position)
+                index = dict(index)
+                self._indexes[column_index] = index
+            return index
+
+
+class SnapshotDataset(hxl.model.Dataset):
+    """A dataset reading from a Snapshot."""
+
+    def __init__(self, snapshot):
+        super().__init__()
+        self.snapshot = snapshot
+        # filters may change their columns, so each dataset gets its own copy
+        self._columns = copy.deepcopy(snapshot.columns)
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def is_cached(self):
+        return True
+
+    def __iter__(self):
+        columns = self._columns
+        return (
+            hxl.model.Row(columns, list(values), row_number)
+            for row_number, values in enumerate(self.snapshot.rows)
+        )
+
+    def iter_positions(self, positions):
+        """Iterate over the rows at some positions, numbering them from 0."""
+        columns = self._columns
+        rows = self.snapshot.rows
+        return (
+            hxl.model.Row(columns, list(rows[position]), row_number)
+            for row_number, position in enumerate(positions)
+        )
+
+
+class SnapshotRowFilter(hxl.filters.RowFilter):
+    """Select rows from a snapshot using its column indexes.
+
+    Takes the same arguments as hxl.filters.RowFilter (without a
+    mask), and produces exactly the same output. Each query is tested
+    once against each distinct value in the columns it matches. Queries
+    with a formula, or that need an aggregate, are tested row by row as
+    usual.
+
+    Usage:
+        source = SnapshotRowFilter(snapshot.dataset(), queries.parse_list('#sector=WASH'))
+
+    """
+
+    def __init__(self, source, queries=[], reverse=False):
+        super().__init__(source, queries, reverse)
+
+    def __iter__(self):
+        if not isinstance(self.source, SnapshotDataset) or not self._can_use_indexes():
+            return super().__iter__()
+        return self.source.iter_positions(self._find_positions())
+
+    def _can_use_indexes(self):
+        """Check that every query can be tested one value at a time."""
+        for query in self.queries:
+            if not isinstance(query, queries.CompiledRowQuery) or query.formula or query.is_aggregate:
+                return False
+        return True
+
+    def _find_positions(self):
+        """Find the positions of the selected rows, in their original order."""
+        snapshot = self.source.snapshot
+        if not self.queries:
+            # no queries = pass
+            return range(len(snapshot.rows))
+        matched = set()
+        columns = self.source.columns
+        for query in self.queries:
+            for column_index in query.bind_indices(columns):
+                for value, positions in snapshot.get_index(column_index).items():
+                    if query.match_cell(value):
+                        matched.update(positions)
+        if self.reverse:
+            return [position for position in range(len(snapshot.rows)) if position not in matched]
+        else:
+            return sorted(matched)
+
+
+class SnapshotStore:
+    """Least-recently-used store of snapshots, with a limit on the total rows."""
+
+    def __init__(self):
+        self.snapshots = collections.OrderedDict()
+        self.row_count = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """@returns: the snapshot for key, or None"""
+        with self.lock:
+            snapshot = self.snapshots.get(key)
+            if snapshot is not None:
+                self.snapshots.move_to_end(key)
+            return snapshot
+
+    def put(self, key, snapshot, max_rows):
+        """Add a snapshot, discarding the least-recently-used ones to stay within max_rows."""
+        if len(snapshot.rows) > max_rows:
+            logger.info("Source too big to keep a snapshot (%d rows)", len(snapshot.rows))
+            return
+        with self.lock:
+            old = self.snapshots.pop(key, None)
+            if old is not None:
+                self.row_count -= len(old.rows)
+            while self.snapshots and self.row_count + len(snapshot.rows) > max_rows:
+                (old_key, old,) = self.snapshots.popitem(last=False)
+                self.row_count -= len(old.rows)
+            self.snapshots[key] = snapshot
+            self.row_count += len(snapshot.rows)
+
+    def clear(self):
+        """Discard all the snapshots."""
+        with self.lock:
+            self.snapshots.clear()
+            self.row_count = 0
+
+
+store = SnapshotStore()
+""" Snapshots for this process """
+
+
+def is_snapshot_recipe(args):
+    """Test whether a recipe can use a snapshot of its source.
+    The recipe must have a source URL and only the filters in SNAPSHOT_FILTERS,
+    without a JSON recipe or tagging, and snapshots must be turned on.
+    """
+    if int(hxl_proxy.app.config.get('SNAPSHOT_MAX_ROWS', 0)) <= 0:
+        return False
+    if not args.get('url') or args.get('recipe'):
+        return False
+    for name in args:
+        if name.startswith('tagger-') or (FILTER_ARG_PATTERN.match(name) and args[name] and args[name] not in SNAPSHOT_FILTERS):
+            return False
+    return True
+
+
+def open_snapshot(url, input_options, make_source, build=True):
+    """Open a snapshot of a source, if the server sends validators for it.
+    @param url: the source URL
+    @param input_options: the hxl.input.InputOptions for the source
+    @param make_source: function returning a new hxl.model.Dataset for the source
+    @param build: if False, use only an existing snapshot (never with &force)
+    @returns: a SnapshotDataset, or None if there's no usable snapshot
+    @raises hxl.input.HXLIOException: if security settings forbid the URL
+    @raises hxl_proxy.exceptions.DomainNotAllowedError: if the domain for the URL is not in the allow list
+    """
+    util.check_allowed_domain(url)
+    util.check_url_security(url, input_options)
+    validators = get_validators(url, input_options)
+    if validators is None:
+        return None
+    key = (url, _make_options_key(input_options), validators,)
+    snapshot = None
+    if not (flask.has_request_context() and util.skip_cache_p()):
+        snapshot = store.get(key)
+    if snapshot is None:
+        if not build:
+            return None
+        source = make_source()
+        try:
+            columns = source.columns
+        except hxl.input.HXLTagsNotFoundException:
+            # let the caller send the user to the tagger
+            return None
+        snapshot = Snapshot(columns, [tuple(row.values) for row in source])
+        store.put(key, snapshot, int(hxl_proxy.app.config.get('SNAPSHOT_MAX_ROWS', 0)))
+    else:
+        logger.debug("Using snapshot of %s", url)
+    return snapshot.dataset()
+
+
+def get_validators(url, input_options):
+    """Get the HTTP validators for a URL with a HEAD request.
+    @returns: an (etag, last_modified) tuple, or None if the server sends neither (or the request fails)
+    """
+    try:
+        response = requests.head(
+            hxl.input.munge_url(url, input_options),
+            allow_redirects=True,
+            verify=input_options.verify_ssl,
+            timeout=input_options.timeout,
+            headers=input_options.http_headers
+        )
+    except (requests.exceptions.RequestException, hxl.HXLException,) as e:
+        logger.debug("Can't get validators for %s: %s", url, e)
+        return None
+    if not response.ok:
+        return None
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if not etag and not last_modified:
+        return None
+    return (etag, last_modified,)
+
+
+def _make_options_key(input_options):
+    """Key for the input options that affect parsing (and access)"""
+    return repr(sorted((name, repr(value)) for name, value in vars(input_options).items()))
+
+# end
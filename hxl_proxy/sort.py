@@ -0,0 +1,168 @@
+"""Disk-spilling sort filter for the HXL Proxy.
+
+libhxl-python's hxl.filters.SortFilter sorts the whole dataset in
+memory, recomputing the sort key for each comparison. The
+ExternalSortFilter class in this module computes each row's key only
+once, sorts runs of rows that fit in a memory budget, spills the
+sorted runs to temporary files, and merges them back on output. When
+the caller needs only the first few rows (e.g. max-rows), it keeps a
+bounded heap instead of sorting everything.
+
+Started October 2026
+License: Public Domain
+"""
+
+import hxl, heapq, logging, sys
+import hxl.filters
+from hxl_proxy import spill
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+""" Default approximate memory budget for in-memory runs (bytes) """
+
+
+class ExternalSortFilter(hxl.filters.SortFilter):
+    """Sort a HXL dataset within a memory budget.
+
+    Produces the same order as hxl.filters.SortFilter, including its
+    stability for rows with equal keys, but holds at most about
+    memory_limit bytes of rows in memory at once. If the sorted rows
+    don't fit, they're saved in sorted runs in a temporary directory,
+    and merged again each time the filter is iterated.
+
+    If limit is set, only the first limit rows of the sorted output
+    are kept, using a bounded heap.
+
+    Usage:
+        source = ExternalSortFilter(hxl.data(url), tags='#org', limit=100)
+
+    """
+
+    def __init__(self, source, tags=[], reverse=False, memory_limit=None, limit=None):
+        """
+        Args:
+            source (hxl.Dataset): the HXL data source
+            tags (list): TagPattern objects (or a string) for the sort keys
+            reverse (bool): if True, reverse the sort order
+            memory_limit (int): approximate bytes of rows to hold in memory (default: DEFAULT_MEMORY_LIMIT)
+            limit (int): if not None, keep only the first limit sorted rows
+
+        """
+        super().__init__(source, tags, reverse)
+        self.memory_limit = memory_limit if memory_limit is not None else DEFAULT_MEMORY_LIMIT
+        self.limit = limit
+
+    def filter_rows(self):
+        """Return the sorted row values.
+
+        The result is either a list, or a replayable _MergedRuns
+        object if the rows had to be spilled to disk.
+
+        """
+        entries = self._make_entries()
+        if self.limit is not None:
+            return self._top_rows(entries)
+        else:
+            return self._sort_rows(entries)
+
+    def _make_entries(self):
+        """Generate a (key, seq, values) tuple for each input row.
+
+        The key is computed only once per row, and the sequence number
+        keeps the sort stable (negated for a reverse sort, so that
+        equal rows still come out in their original order).
+
+        """
+        indices = self._make_indices()
+        columns = self.columns
+        if indices:
+            key_columns = [(index, columns[index].tag) for index in indices]
+        else:
+            key_columns = None
+        make_sort_value = hxl.filters.SortFilter._make_sort_value
+        sign = -1 if self.reverse else 1
+
+        for seq, row in enumerate(self.source):
+            values = row.values
+            if key_columns is not None:
+                key = tuple(
+                    make_sort_value(tag, values[index] if index < len(values) else None)
+                    for index, tag in key_columns
+                )
+            else:
+                # sort everything, left to right
+                key = tuple(
+                    make_sort_value(column.tag, value) for column, value in zip(columns, values)
+                )
+            yield (key, sign * seq, values)
+
+    def _top_rows(self, entries):
+        """Keep only the first self.limit rows, with a bounded heap."""
+        if self.reverse:
+            top = heapq.nlargest(self.limit, entries)
+        else:
+            top = heapq.nsmallest(self.limit, entries)
+        return [entry[2] for entry in top]
+
+    def _sort_rows(self, entries):
+        """Sort the rows in memory, or spill sorted runs to disk and merge."""
+        runs = None
+        run = []
+        run_size = 0
+
+        for entry in entries:
+            run.append(entry)
+            run_size += _estimate_size(entry[2])
+            if run_size >= self.memory_limit:
+                if runs is None:
+                    runs = _MergedRuns(self.reverse)
+                runs.add_run(run)
+                run = []
+                run_size = 0
+
+        if runs is None:
+            # everything fitted in memory
+            run.sort(reverse=self.reverse)
+            return [entry[2] for entry in run]
+
+        if run:
+            runs.add_run(run)
+        logger.info("Sorted %d rows in %d runs on disk", runs.spill.record_count, len(runs.spill.paths))
+        return runs
+
+    @property
+    def is_cached(self):
+        """Rows may be replayed from disk rather than memory"""
+        return False
+
+
+class _MergedRuns:
+    """Replayable merge of sorted runs spilled to temporary files.
+
+    The temporary files are removed when this object is garbage
+    collected (i.e. when the filter that owns it goes away).
+
+    """
+
+    def __init__(self, reverse):
+        self.reverse = reverse
+        self.spill = spill.SpillDirectory('sort')
+
+    def add_run(self, run):
+        """Sort a run, and save it to a new temporary file."""
+        run.sort(reverse=self.reverse)
+        self.spill.write_run(run)
+
+    def __iter__(self):
+        """Merge the runs again on every iteration."""
+        merged = heapq.merge(*self.spill.read_runs(), reverse=self.reverse)
+        return (entry[2] for entry in merged)
+
+
+def _estimate_size(values):
+    """Rough estimate of the memory used by one row and its sort key"""
+    return sys.getsizeof(values) + sum(len(value) if isinstance(value, str) else 8 for value in values) * 3 + 200
+
+# end
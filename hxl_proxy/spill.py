@@ -0,0 +1,78 @@
+"""Temporary on-disk runs for memory-bounded filters.
+
+Filters that would otherwise hold a whole dataset in memory (sort,
+count) write sorted runs of records here, then read them back in
+order to merge them.
+
+Started October 2026
+License: Public Domain
+"""
+
+import logging, os, pickle, tempfile
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+BATCH_SIZE = 1000
+""" Number of records pickled together in a run file """
+
+
+class SpillDirectory:
+    """Temporary directory of run files.
+
+    The directory and its files are removed when this object is
+    garbage collected, or when cleanup() is called.
+
+    Usage:
+        spill = SpillDirectory('sort')
+        spill.write_run(sorted(records))
+        for records in heapq.merge(*spill.read_runs()):
+            ...
+
+    """
+
+    def __init__(self, prefix='spill'):
+        """
+        Args:
+            prefix (str): a prefix for the directory name (for debugging)
+        """
+        self.tempdir = tempfile.TemporaryDirectory(prefix='hxl-proxy-{}-'.format(prefix))
+        self.paths = []
+        self.record_count = 0
+
+    def write_run(self, records):
+        """Save a list of records as a new run file.
+        Args:
+            records (list): the (already-sorted) picklable records
+        """
+        path = os.path.join(self.tempdir.name, 'run-{:06d}'.format(len(self.paths)))
+        with open(path, 'wb') as output:
+            for start in range(0, len(records), BATCH_SIZE):
+                pickle.dump(records[start:start+BATCH_SIZE], output, pickle.HIGHEST_PROTOCOL)
+        self.paths.append(path)
+        self.record_count += len(records)
+        logger.debug("Spilled %d records to %s", len(records), path)
+
+    def read_runs(self):
+        """Open every run for reading.
+        Returns:
+            list: one generator of records for each run, in the order written
+        """
+        return [_read_run(path) for path in self.paths]
+
+    def cleanup(self):
+        """Remove the directory and its run files now."""
+        self.tempdir.cleanup()
+
+
+def _read_run(path):
+    """Generate the records in a run file, in order."""
+    with open(path, 'rb') as input:
+        while True:
+            try:
+                batch = pickle.load(input)
+            except EOFError:
+                return
+            yield from batch
+
+# end
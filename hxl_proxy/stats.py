@@ -0,0 +1,204 @@
+"""Streaming column statistics for the HXL Proxy.
+
+The /api/stats controller runs a recipe and summarises each output
+column in a single pass, using fixed-size sketches so that memory
+doesn't grow with the size of the dataset:
+
+- approximate distinct counts (HyperLogLog)
+- approximate most-frequent values (Space-Saving)
+- numeric count, minimum, maximum, and mean
+- empty-value count and ratio
+
+Started October 2026
+License: Public Domain
+"""
+
+import hashlib, hxl, logging, math
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+DEFAULT_TOP_K = 10
+""" Default number of most-frequent values to report per column """
+
+MAX_TOP_K = 100
+""" Maximum number of most-frequent values to report per column """
+
+HLL_PRECISION = 12
+""" HyperLogLog precision (2**12 registers, for about 1.6% standard error) """
+
+
+class HyperLogLog:
+    """Approximate distinct counter with a fixed number of registers."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value):
+        """Add a string value."""
+        hash = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        register = hash >> (64 - self.precision)
+        rest = hash & ((1 << (64 - self.precision)) - 1)
+        # position of the first 1 bit in the remaining bits
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def estimate(self):
+        """@returns: the approximate number of distinct values added"""
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        raw = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * size and zeros:
+            # small-range correction (linear counting)
+            return int(round(size * math.log(size / zeros)))
+        return int(round(raw))
+
+
+class SpaceSaving:
+    """Approximate most-frequent values, with a fixed number of counters.
+
+    Any value that occurs more than n/capacity times is guaranteed to
+    be kept. A value's count may be too high by up to its error.
+
+    The counters are grouped into buckets by count (the
+    "stream-summary" structure), so finding the least-frequent value to
+    replace takes constant time, however many counters there are.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # count -> dict of values with that count (in the order they arrived)
+        self.buckets = {}
+        self.min_count = 0
+
+    def add(self, value):
+        """Add a value."""
+        counts = self.counts
+        if value in counts:
+            count = counts[value]
+            self._move(value, count, count + 1)
+        elif len(counts) < self.capacity:
+            self.errors[value] = 0
+            self._move(value, None, 1)
+            self.min_count = 1
+        else:
+            # replace the least-frequent value
+            count = self.min_count
+            smallest = next(iter(self.buckets[count]))
+            self._move(smallest, count, None)
+            del self.errors[smallest]
+            self.errors[value] = count
+            self._move(value, None, count + 1)
+            if self.min_count not in self.buckets:
+                self.min_count = count + 1
+
+    def _move(self, value, old_count, new_count):
+        """Move a value from one count bucket to another (None for none)"""
+        buckets = self.buckets
+        if old_count is not None:
+            bucket = buckets[old_count]
+            del bucket[value]
+            if not bucket:
+                del buckets[old_count]
+                if old_count == self.min_count and new_count is not None:
+                    self.min_count = new_count
+        if new_count is None:
+            del self.counts[value]
+        else:
+            self.counts[value] = new_count
+            buckets.setdefault(new_count, {})[value] = True
+
+    def top(self, k):
+        """@returns: a list of (value, count, error) tuples, most frequent first"""
+        items = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(value, count, self.errors[value],) for value, count in items]
+
+
+class ColumnStats:
+    """Statistics for one column."""
+
+    def __init__(self, column, top_k):
+        self.column = column
+        self.top_k = top_k
+        self.empty_count = 0
+        self.distinct = HyperLogLog()
+        # extra counters make the reported top values more reliable
+        self.frequent = SpaceSaving(top_k * 10)
+        self.number_count = 0
+        self.number_min = None
+        self.number_max = None
+        self.number_sum = 0.0
+
+    def add(self, value):
+        """Add a cell value."""
+        value = hxl.datatypes.normalise_space(value)
+        if not value:
+            self.empty_count += 1
+            return
+        self.distinct.add(value)
+        self.frequent.add(value)
+        try:
+            number = hxl.datatypes.normalise_number(value)
+        except ValueError:
+            return
+        if not math.isfinite(number):
+            # not valid in JSON
+            return
+        self.number_count += 1
+        self.number_sum += number
+        if self.number_min is None or number < self.number_min:
+            self.number_min = number
+        if self.number_max is None or number > self.number_max:
+            self.number_max = number
+
+    def as_dict(self, row_count):
+        """Return the statistics as a JSON-ready dict."""
+        numbers = None
+        if self.number_count:
+            numbers = {
+                'count': self.number_count,
+                'min': self.number_min,
+                'max': self.number_max,
+                'mean': self.number_sum / self.number_count,
+            }
+        return {
+            'header': self.column.header,
+            'hashtag': self.column.display_tag,
+            'distinct_approx': self.distinct.estimate(),
+            'top': [
+                {'value': value, 'count': count, 'error': error}
+                for value, count, error in self.frequent.top(self.top_k)
+            ],
+            'numbers': numbers,
+            'empty_count': self.empty_count,
+            'empty_ratio': (self.empty_count / row_count) if row_count else None,
+        }
+
+
+def profile_columns(source, top_k=DEFAULT_TOP_K):
+    """Summarise each column of a dataset in a single pass.
+    Missing values at the end of short rows count as empty.
+    @param source: a hxl.model.Dataset
+    @param top_k: the number of most-frequent values to report per column
+    @returns: a JSON-ready dict
+    """
+    columns = source.columns
+    stats = [ColumnStats(column, top_k) for column in columns]
+    row_count = 0
+    for row in source:
+        row_count += 1
+        values = row.values
+        for i, column_stats in enumerate(stats):
+            column_stats.add(values[i] if i < len(values) else '')
+    return {
+        'row_count': row_count,
+        'columns': [column_stats.as_dict(row_count) for column_stats in stats],
+    }
+
+# end
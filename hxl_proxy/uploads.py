@@ -0,0 +1,93 @@
+"""Upload handling for the HXL Proxy.
+
+/actions/validate needs a hash of each uploaded file for its cache
+keys. Instead of reading the whole upload again after Werkzeug has
+saved it (see util.make_file_hash()), the proxy's request class saves
+each uploaded file to a HashingSpooledFile, which hashes the bytes as
+they arrive from the client, and moves them from memory to a temporary
+file on disk once there are more than app.config["UPLOAD_SPOOL_SIZE"]
+of them. The hash is ready (see get_upload_hash()) before anything
+parses the upload.
+
+Started October 2026
+License: Public Domain
+"""
+
+import flask, hashlib, hxl_proxy, logging, tempfile
+from hxl_proxy import util
+
+logger = logging.getLogger(__name__)
+""" Python logger for this module """
+
+DEFAULT_SPOOL_SIZE = 500 * 1024
+""" Default maximum number of bytes of an upload to keep in memory (the same as Werkzeug's) """
+
+
+class HashingSpooledFile(tempfile.SpooledTemporaryFile):
+    """Spooled temporary file that hashes the bytes written to it.
+
+    The hash is the same MD5 hash as util.make_file_hash() returns for
+    the same bytes. It's valid only while the file has been written
+    from start to end in order; after any other write (e.g. after a
+    seek), content_hash is None.
+
+    Usage:
+        output = HashingSpooledFile(max_size=1024 * 1024)
+        output.write(data)
+        output.seek(0)
+        content_hash = output.content_hash
+
+    """
+
+    def __init__(self, max_size=DEFAULT_SPOOL_SIZE):
+        """
+        @param max_size: the maximum number of bytes to keep in memory before moving to disk
+        """
+        super().__init__(max_size=max_size, mode='w+b')
+        self._hash = hashlib.md5()
+        self._hashed_size = 0
+
+    @property
+    def content_hash(self):
+        """ The MD5 hash of the file's contents, or None if it's no longer valid """
+        if self._hash is None:
+            return None
+        return self._hash.hexdigest()
+
+    def write(self, s):
+        if self._hash is not None:
+            if self.tell() == self._hashed_size:
+                self._hash.update(s)
+                self._hashed_size += len(s)
+            else:
+                # not a simple append, so we can't keep the hash up to date
+                self._hash = None
+        return super().write(s)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+
+class UploadRequest(flask.Request):
+    """Flask request class that saves uploaded files to HashingSpooledFile objects"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        max_size = int(hxl_proxy.app.config.get('UPLOAD_SPOOL_SIZE', DEFAULT_SPOOL_SIZE))
+        return HashingSpooledFile(max_size=max_size)
+
+
+def get_upload_hash(upload):
+    """Get the hash of an uploaded file, for cache keys.
+    Uses the hash made while the upload arrived, if there is one;
+    otherwise, reads the upload to make it (see util.make_file_hash()).
+    @param upload: a werkzeug.datastructures.FileStorage object (or any random-access bytes stream)
+    @returns: an MD5 hash
+    """
+    content_hash = getattr(getattr(upload, 'stream', upload), 'content_hash', None)
+    if content_hash is None:
+        logger.debug("No hash for upload; reading it again")
+        content_hash = util.make_file_hash(upload)
+    return content_hash
+
+# end
@@ -7,8 +7,10 @@ License: Public Domain
 from ast import Try
 import hxl_proxy
 
-import flask, hashlib, hxl, json, logging, pickle, random, re, requests, time, urllib
-from hxl_proxy import caching, exceptions
+import concurrent.futures, copy, flask, hashlib, hxl, io, json, logging, pickle, random, re, requests, threading, time, urllib
+from hxl_proxy import caching, exceptions, inputs
+
+from contextvars import copy_context
 
 from urllib.parse import urlparse
 
@@ -84,24 +86,58 @@ def skip_cache_p ():
         bool: True if we don't want to cache
 
     """
-    return True if flask.request.args.get('force') else False
+    return True if (flask.request.args.get('force') or profile_p()) else False
+
+
+def profile_p ():
+    """ Determine whether the request asks for a pipeline profile.
+
+    The HTTP &profile=on parameter requests a profile instead of
+    the usual output (admin users only). Profiling always skips the
+    cache, so that fetching is measured too.
+
+    Returns:
+        bool: True if the request asks for a profile
+
+    """
+    return flask.request.args.get('profile') == 'on'
+
+
+def is_admin ():
+    """ Determine whether the current user is an administrator.
+
+    Returns:
+        bool: True if the user is logged in as an administrator (the session's is_admin flag)
+
+    """
+    return bool(flask.session.get('is_admin'))
+
 
 
-
 ########################################################################
 # Input wrappers and options
 ########################################################################
 
-def hxl_data (raw_source, input_options=None):
+def hxl_data (raw_source, input_options=None, shared=True):
     """ Wrapper for hxl.data() to implement a domain-based allow list.
 
     If the raw_source is a string (i.e. URL), check that the base
     domain is in the allow list. If the allow list is empty, assume
     testing and allow any domain.
 
+    Inside a request, each distinct HTTP(S) URL and set of input
+    options is fetched only once (see fetch_url()), no matter how many
+    times a recipe refers to it (e.g. as a merge source and a
+    replacement map), and the first app.config["SHARED_DATASET_ROWS"]
+    parsed rows are shared too (see inputs.SharedDataset). The shared
+    download stays in memory until the end of the request, so a caller
+    that opens many one-off sources in the same request (e.g. batch
+    validation) should use shared=False.
+
     Args:
         raw_source: a HXL data provider, file object, array, or string (representing a URL)
         input_options (hxl.input.InputOptions): input options for reading a dataset
+        shared (bool): if False, don't share the download and parsing with the rest of the request
 
     Returns:
         hxl.model.Dataset: a HXL dataset object
@@ -112,19 +148,39 @@ def hxl_data (raw_source, input_options=None):
     """
     # don't catch exceptions here; see controllers.py for general exception handling
     check_allowed_domain(raw_source)
-    return hxl.data(raw_source, input_options)
-
-
-def hxl_make_input (raw_source, input_options=None):
+    memo = _get_fetch_memo(raw_source, input_options) if shared else None
+    if memo is None:
+        return hxl.data(raw_source, input_options)
+
+    key = ('data', raw_source, _make_options_key(input_options, full=True),)
+    with _fetch_memo_lock:
+        shared = memo.get(key)
+        if shared is None:
+            shared = inputs.SharedDataset(
+                lambda: hxl.data(hxl_make_input(raw_source, input_options), input_options),
+                max_rows=int(hxl_proxy.app.config.get('SHARED_DATASET_ROWS', 0))
+            )
+            memo[key] = shared
+    return shared.view()
+
+
+def hxl_make_input (raw_source, input_options=None, stream=False):
     """ Wrapper for hxl.make_input() to implement a domain-based allow list.
 
     If the raw_source is a string (i.e. URL), check that the base
     domain is in the allow list. If the allow list is empty, assume
     testing and allow any domain.
 
+    libhxl downloads a remote URL completely before parsing it. If
+    stream is True, an HTTP(S) URL is read incrementally instead (see
+    open_url_stream()), so that a caller that needs only the first
+    few rows can stop early. Otherwise, inside a request, the download
+    is shared with any other use of the same URL (see fetch_url()).
+
     Args:
         raw_source: a HXL data provider, file object, array, or string (representing a URL)
         input_options(hxl.input.InputOptions): input options for reading a dataset
+        stream(bool): if True, stream an HTTP(S) URL rather than downloading it first
 
     Returns:
         hxl.input.AbstractInput: a row-by-row input object (pre-HXL-processing)
@@ -135,9 +191,346 @@ def hxl_make_input (raw_source, input_options=None):
     """
     # don't catch exceptions here; see controllers.py for general exception handling
     check_allowed_domain(raw_source)
+    if isinstance(raw_source, str) and re.match(r'^https?://', raw_source, re.IGNORECASE):
+        memo = _get_fetch_memo(raw_source, input_options)
+        if stream and not (memo is not None and _make_fetch_key(raw_source, input_options) in memo):
+            return make_input_from_opened(raw_source, open_url_stream(raw_source, input_options), input_options)
+        elif memo is not None:
+            return make_input_from_opened(raw_source, fetch_url(raw_source, input_options), input_options)
     return hxl.make_input(raw_source, input_options)
 
 
+def fetch_url (url, input_options):
+    """ Download a remote URL only once per request.
+
+    Wraps hxl.input.open_url_or_file() (which already reads the whole
+    response into memory), keeping the content in flask.g for the rest
+    of the request, so that later uses of the same URL with the same
+    HTTP options get a new stream over the same bytes. Failures are
+    not remembered. Outside a request, just opens the URL.
+
+    Args:
+        url(str): the HTTP(S) URL to open
+        input_options(hxl.input.InputOptions): input options for reading a dataset
+
+    Returns:
+        tuple: (input, mime_type, file_ext, encoding, content_length, fileno)
+
+    """
+    memo = _get_fetch_memo(url, input_options)
+    if memo is None:
+        return hxl.input.open_url_or_file(url, input_options)
+
+    key = _make_fetch_key(url, input_options)
+    with _fetch_memo_lock:
+        entry = memo.get(key)
+        if entry is None:
+            entry = memo[key] = _FetchEntry()
+
+    # other threads (e.g. in hxl_data_list) wait for the same URL, not for each other
+    with entry.lock:
+        if entry.result is None:
+            (input, mime_type, file_ext, encoding, content_length, fileno,) = hxl.input.open_url_or_file(url, input_options)
+            try:
+                content = input.read()
+            finally:
+                input.close()
+            entry.result = (content, mime_type, file_ext, encoding, content_length,)
+        else:
+            logger.debug("Reusing the download of %s for this request", url)
+        (content, mime_type, file_ext, encoding, content_length,) = entry.result
+    return (io.BytesIO(content), mime_type, file_ext, encoding, content_length, None,)
+
+
+class _FetchEntry:
+    """ A download shared within a request (see fetch_url()) """
+
+    def __init__ (self):
+        self.lock = threading.Lock()
+        self.result = None
+
+
+_fetch_memo_lock = threading.Lock()
+""" Lock for adding entries to a request's fetch memo """
+
+
+def _get_fetch_memo (raw_source, input_options):
+    """ Get the request-scoped fetch memo, if raw_source can use it.
+    Only HTTP(S) URLs can, and not when looking for CKAN resources (libhxl
+    has to open several URLs itself then).
+    @returns: a dict in flask.g, or None if there's no request (or no memo for this source)
+    """
+    if not isinstance(raw_source, str) or not re.match(r'^https?://', raw_source, re.IGNORECASE):
+        return None
+    if input_options is not None and input_options.scan_ckan_resources:
+        return None
+    if not flask.has_app_context():
+        return None
+    with _fetch_memo_lock:
+        if 'fetch_memo' not in flask.g:
+            flask.g.fetch_memo = {}
+        return flask.g.fetch_memo
+
+
+def _make_fetch_key (url, input_options):
+    """ Memo key for downloading a URL """
+    return ('fetch', url, _make_options_key(input_options, full=False),)
+
+
+def _make_options_key (input_options, full):
+    """ Hashable key for a set of input options
+    @param full: if True, include all the options; otherwise, only the ones that affect downloading
+    """
+    if input_options is None:
+        return None
+    if full:
+        options = vars(input_options)
+    else:
+        options = {
+            'allow_local': input_options.allow_local,
+            'verify_ssl': input_options.verify_ssl,
+            'http_headers': input_options.http_headers,
+        }
+    return json.dumps(options, sort_keys=True, default=str)
+
+
+def make_input_from_opened (url, opened, input_options):
+    """ Make a raw input from an already-opened URL (see open_url_stream() and fetch_url())
+
+    Applies the same checks as hxl.make_input() does for a URL, using
+    the MIME type and file extension from the response (which libhxl
+    doesn't see when it gets only a stream).
+
+    Raises:
+        hxl.input.HXLHTMLException: if the response is HTML
+        hxl.input.HXLIOException: if the response isn't a type of data that libhxl can read
+
+    """
+    (input, mime_type, file_ext, encoding, content_length, fileno,) = opened
+    if not hasattr(input, 'peek'):
+        # buffer, so that we can look at the first bytes without losing them
+        input = io.BufferedReader(hxl.input.io_wrapper.RawIOWrapper(input))
+    sig = input.peek(4)[:4]
+
+    def match_sigs(sigs):
+        return any(sig.startswith(s) for s in sigs)
+
+    if mime_type in hxl.input.HTML5_MIME_TYPES or match_sigs(hxl.input.HTML5_SIGS):
+        raise hxl.input.HXLHTMLException(
+            "Received HTML markup.\nCheck that the resource (e.g. a Google Sheet) is publicly readable.",
+            url=url
+        )
+    if encoding and input_options is not None and not input_options.encoding:
+        input_options = copy.copy(input_options)
+        input_options.encoding = encoding
+    if mime_type in hxl.input.JSON_MIME_TYPES or file_ext in hxl.input.JSON_FILE_EXTS:
+        # libhxl would otherwise have to recognise JSON from its first bytes
+        return hxl.input.JSONInput(input, input_options, url)
+    if not match_sigs(hxl.input.XLS_SIGS + hxl.input.XLSX_SIGS + hxl.input.JSON_SIGS) and not (
+            (not file_ext or file_ext in hxl.input.CSV_FILE_EXTS) and
+            (not mime_type or mime_type in hxl.input.CSV_MIME_TYPES)
+    ):
+        # libhxl would otherwise try to read it as CSV
+        raise hxl.input.HXLIOException(
+            'Cannot process as data (extension: {}, MIME type: {})'.format(
+                file_ext if file_ext else '<not provided>',
+                mime_type if mime_type else '<not provided>',
+            ),
+            url
+        )
+    result = hxl.make_input(input, input_options)
+    result.url_or_filename = url
+    return result
+
+
+def open_url_stream (url, input_options):
+    """ Open a remote HTTP(S) URL for reading incrementally.
+
+    A streaming version of hxl.input.open_url_or_file(), with the
+    same security checks and return value. Note that Excel workbooks
+    are still read completely before parsing, and that requests_cache
+    (see caching.input) may read the whole response to cache it.
+
+    Args:
+        url(str): the HTTP(S) URL to open
+        input_options(hxl.input.InputOptions): input options for reading a dataset
+
+    Returns:
+        tuple: (input, mime_type, file_ext, encoding, content_length, fileno)
+
+    Raises:
+        hxl.input.HXLIOException: if security settings forbid the URL
+        hxl.input.HXLAuthorizationException: if the server refuses access
+        requests.exceptions.HTTPError: for other HTTP errors
+
+    """
+    response = request_url(url, input_options)
+    (mime_type, file_ext, encoding, content_length,) = describe_response(url, response)
+    return (hxl.input.RequestResponseIOWrapper(response), mime_type, file_ext, encoding, content_length, None,)
+
+
+def request_url (url, input_options, http_headers=None):
+    """ Send a streaming GET request for a remote HTTP(S) URL (see open_url_stream()).
+
+    Args:
+        url(str): the HTTP(S) URL to open
+        input_options(hxl.input.InputOptions): input options for reading a dataset
+        http_headers(dict): extra HTTP headers for the request (e.g. "Range")
+
+    Returns:
+        requests.Response: the response, with the body not yet read
+
+    Raises:
+        hxl.input.HXLIOException: if security settings forbid the URL
+        hxl.input.HXLAuthorizationException: if the server refuses access
+        requests.exceptions.HTTPError: for other HTTP errors
+
+    """
+    if input_options is None:
+        input_options = hxl.input.InputOptions(allow_local=False, verify_ssl=True)
+
+    check_url_security(url, input_options)
+
+    headers = input_options.http_headers
+    if http_headers:
+        headers = dict(headers or {}, **http_headers)
+
+    response = requests.get(
+        hxl.input.munge_url(url, input_options),
+        stream=True,
+        verify=input_options.verify_ssl,
+        timeout=input_options.timeout,
+        headers=headers
+    )
+    if response.status_code == 403: # CKAN sends "403 Forbidden" for a private file
+        response.close()
+        raise hxl.input.HXLAuthorizationException("Access not authorized", url=url)
+    response.raise_for_status()
+    return response
+
+
+def describe_response (url, response):
+    """ Get the details libhxl needs to parse a response (see open_url_stream()).
+
+    Returns:
+        tuple: (mime_type, file_ext, encoding, content_length)
+
+    """
+    file_ext = get_file_ext(url)
+
+    mime_type = None
+    encoding = None
+    content_type = response.headers.get('content-type')
+    if content_type:
+        result = re.match(r'^(\S+)\s*;\s*charset=(\S+)$', content_type)
+        if result:
+            mime_type = result.group(1).lower()
+            encoding = result.group(2).lower()
+        else:
+            mime_type = content_type.lower()
+
+    try:
+        content_length = int(response.headers.get('content-length'))
+    except (TypeError, ValueError):
+        content_length = None
+
+    return (mime_type, file_ext, encoding, content_length,)
+
+
+def get_file_ext (url):
+    """ Get the lower-case file extension from a URL's path, or None if there isn't one """
+    result = re.search(r'\.([A-Za-z0-9]{1,5})$', urlparse(url).path)
+    if result:
+        return result.group(1).lower()
+    return None
+
+
+def check_url_security (url, input_options):
+    """ Apply libhxl's security checks before the proxy opens a URL itself.
+
+    Unless input_options.allow_local is set, refuse IP addresses and
+    local hostnames, as hxl.input.open_url_or_file() does.
+
+    Raises:
+        hxl.input.HXLIOException: if security settings forbid the URL
+
+    """
+    hostname = urlparse(url).hostname or ''
+    if not input_options.allow_local:
+        if re.match(r'^[0-9.]+$', hostname):
+            raise hxl.input.HXLIOException("Security settings forbid accessing host via IP address {}".format(hostname))
+        if hostname == 'localhost' or hostname.endswith('.localdomain'):
+            raise hxl.input.HXLIOException("Security settings forbid accessing {}".format(hostname))
+
+
+def hxl_data_list (raw_sources, input_options=None):
+    """ Open several HXL datasets concurrently, preserving their order.
+
+    Each source is opened with hxl_data() in a bounded thread pool,
+    and its hashtag row is read straight away, so that the HTTP
+    round trips (and any Excel workbook parsing) overlap instead of
+    happening one after another. Rows are still read later, in the
+    original order, by whatever consumes the datasets.
+
+    The pool size comes from app.config["FETCH_MAX_WORKERS"]
+    (default 8). All the sources together may take up to the
+    input_options timeout (or app.config["MAX_REQUEST_TIMEOUT"]) to
+    become ready; any still waiting after that are cancelled.
+
+    Args:
+        raw_sources (list): HXL data providers, usually URL strings
+        input_options (hxl.input.InputOptions): input options for reading each dataset
+
+    Returns:
+        list: hxl.model.Dataset objects, in the same order as raw_sources
+
+    Raises:
+        TimeoutError: if the sources aren't all ready within the timeout
+        hxl_proxy.exceptions.DomainNotAllowedError: if the domain for a URL is not in the allow list
+
+    """
+    raw_sources = list(raw_sources)
+    if len(raw_sources) < 2:
+        return [_open_hxl_data(raw_source, input_options) for raw_source in raw_sources]
+
+    max_workers = min(int(hxl_proxy.app.config.get('FETCH_MAX_WORKERS', 8)), len(raw_sources))
+    if input_options is not None and input_options.timeout:
+        timeout = input_options.timeout
+    else:
+        timeout = hxl_proxy.app.config.get('MAX_REQUEST_TIMEOUT', 30.0)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hxl-fetch')
+    try:
+        # each task gets its own copy of the logging context
+        futures = [
+            executor.submit(copy_context().run, _open_hxl_data, raw_source, input_options)
+            for raw_source in raw_sources
+        ]
+        # one timeout for the whole list, not for each source
+        deadline = time.monotonic() + timeout
+        sources = []
+        for raw_source, future in zip(raw_sources, futures):
+            try:
+                sources.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+            except concurrent.futures.TimeoutError:
+                for pending in futures:
+                    pending.cancel()
+                logup("Timed out opening source", {'raw_source': str(raw_source)}, "error")
+                logger.error("Timed out opening source %s", raw_source)
+                raise TimeoutError("Timed out opening {}".format(raw_source))
+        return sources
+    finally:
+        # don't wait for stragglers after a failure
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _open_hxl_data (raw_source, input_options):
+    """ Open a dataset and read its hashtag row (worker for hxl_data_list()) """
+    source = hxl_data(raw_source, input_options)
+    source.columns
+    return source
+
+
 def check_allowed_domain (raw_source):
     """ Raise an exception if raw_source is a URL and its base domain is not in the allow list.
 
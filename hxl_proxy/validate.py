@@ -5,24 +5,156 @@ License: Public Domain
 
 import hxl_proxy
 
-from hxl_proxy import util
+from hxl_proxy import schemas, snapshot, util
 
-import hxl, logging, werkzeug
+import datetime, hashlib, hxl, itertools, json, logging, random, re, shutil, tempfile, werkzeug
 
 
 logger = logging.getLogger(__name__)
 """ Python logger for this module """
 
 
-@hxl_proxy.cache.memoize(unless=util.skip_cache_p)
+VALIDATION_OPTION_NAMES = (
+    'authorization_token',
+    'encoding',
+    'expand-merged', 'expand_merged',
+    'head',
+    'http-headers', 'http_headers',
+    'max_issues',
+    'max_rule_issues',
+    'sample',
+    'scan-ckan-resources', 'scan_ckan_resources',
+    'schema_sheet',
+    'schema-encoding', 'schema_encoding',
+    'schema-expand-merged', 'schema_expand_merged',
+    'schema-selector', 'schema_selector',
+    'selector',
+    'sheet',
+)
+""" Request parameters that can change a validation report (or who may see it) """
+
+REPORT_KEY_EXCLUDES = ('details', 'force', 'severity',)
+""" Request parameters that only change how /data/validate shows a report """
+
+URL_PATTERN = re.compile(r'^https?://', re.IGNORECASE)
+""" Recipe parameter values that are (probably) upstream URLs """
+
+UPLOAD_MEMORY_SIZE = 8 * 1024 * 1024
+""" Maximum size of an upload to copy in memory for streaming (bigger ones go to disk) """
+
+
 def run_validation(url, content, content_hash, sheet_index, selector, schema_url, schema_content, schema_content_hash, schema_sheet_index, include_dataset, args={}):
     """ Do the actual validation run, using the arguments provided.
     Separated from the controller so that we can cache the result easiler.
-    The *_hash arguments exist only to assist with caching.
+    The result is cached on the URLs, the content hashes (see
+    uploads.get_upload_hash()), and the options that can change the report
+    (see make_validation_options()), not on the upload objects or the
+    whole request form, so that repeat validations of the same file
+    hit the cache.
     @returns: a validation report, suitable for returning as JSON.
     """
+    check_validation_args(url, content, schema_url, schema_content)
+    return _run_validation(
+        url, content, content_hash, sheet_index, selector,
+        schema_url, schema_content, schema_content_hash, schema_sheet_index,
+        bool(include_dataset), make_validation_options(args), args
+    )
+
+
+def stream_validation(url, content, sheet_index, schema_url, schema_content, schema_content_hash, include_dataset=False, args={}):
+    """ Validate without caching, generating the output as it goes.
+    Takes the same arguments as run_validation() (where they apply).
+    With include_dataset, generate a JSON report with the dataset, in a single pass
+    (see StreamingValidator.iter_json()); otherwise, generate newline-delimited JSON
+    with each issue as it's found (see StreamingValidator.iter_ndjson()).
+    The source and schema are opened (and the hashtags read) before this returns,
+    so that errors happen before any output.
+    @returns: a generator of strings
+    """
+    check_validation_args(url, content, schema_url, schema_content)
+    history_id = make_history_id(url, content, args)
+    if content is not None:
+        # the request closes its uploads before the response finishes streaming
+        content = _copy_upload(content)
+    (source, schema, schema_args,) = open_validation(url, content, schema_url, schema_content, schema_content_hash, args)
+    source.columns
+    (max_issues, max_rule_issues,) = get_issue_limits(args)
+    validator = make_validator(schema, max_issues, max_rule_issues, history_id)
+    extras = make_report_extras(url, sheet_index, schema_url, schema_args)
+    if include_dataset:
+        return validator.iter_json(source, extras, include_dataset=True)
+    else:
+        return validator.iter_ndjson(source, extras)
+
+
+def _copy_upload(content):
+    """ Copy an upload to a temporary file that outlives the request (in memory if it's small) """
+    copy = tempfile.SpooledTemporaryFile(max_size=UPLOAD_MEMORY_SIZE)
+    content.seek(0)
+    shutil.copyfileobj(content, copy)
+    copy.seek(0)
+    return copy
+
+
+def get_recipe_report(recipe, make_report):
+    """ Get the validation report for a recipe from the cache, or make and cache it
+    Clicking through the /data/validate dashboard (changing &severity, or
+    opening a &details page) and getting the JSON then share one report.
+    The report is cached on the recipe (without the parameters in
+    REPORT_KEY_EXCLUDES) and the HTTP validators (ETag and Last-Modified)
+    of every upstream URL in it, including the schema, so that it changes
+    when any of them does. URLs without validators can be stale for up to
+    app.config["VALIDATION_REPORT_TIMEOUT"] seconds (0, the default, for
+    no caching). &force makes a new report.
+    @param recipe: the recipes.Recipe to validate
+    @param make_report: function returning a new validation report
+    @returns: a validation report, suitable for returning as JSON
+    """
+    timeout = int(hxl_proxy.app.config.get('VALIDATION_REPORT_TIMEOUT', 0))
+    if timeout <= 0:
+        return make_report()
+    key = make_report_key(recipe.args)
+    if key is None:
+        return make_report()
+    if not util.skip_cache_p():
+        report = hxl_proxy.cache.get(key)
+        if report is not None:
+            logger.debug("Using cached validation report for %s", recipe.url)
+            return report
+    report = make_report()
+    hxl_proxy.cache.set(key, report, timeout=timeout)
+    return report
 
-    # test for opening error conditions
+
+def make_report_key(args):
+    """ Make the cache key for a recipe's validation report (see get_recipe_report())
+    @param args: the recipe parameters
+    @returns: a string, or None if the recipe can't use the cache (e.g. because security settings forbid a URL)
+    """
+    input_options = util.make_input_options(args)
+    properties = {}
+    validators = {}
+    for name in sorted(args.keys()):
+        if name in REPORT_KEY_EXCLUDES:
+            continue
+        value = args.get(name)
+        properties[name] = value
+        if isinstance(value, str) and URL_PATTERN.match(value) and value not in validators:
+            try:
+                util.check_allowed_domain(value)
+                util.check_url_security(value, input_options)
+            except Exception:
+                # let the validation itself report the problem
+                return None
+            validators[value] = snapshot.get_validators(value, input_options)
+    key = json.dumps([properties, sorted(validators.items())], sort_keys=True, default=str)
+    return 'validation-report:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def check_validation_args(url, content, schema_url, schema_content):
+    """ Check for opening error conditions
+    @raises werkzeug.exceptions.BadRequest: if the data or schema source is missing or ambiguous
+    """
     if (url is not None and content is not None):
         raise werkzeug.exceptions.BadRequest("Both 'url' and 'content' specified")
     if (url is None and content is None):
@@ -30,18 +162,73 @@ def run_validation(url, content, content_hash, sheet_index, selector, schema_url
     if (schema_url is not None and schema_content is not None):
         raise werkzeug.exceptions.BadRequest("Both 'schema_url' and 'schema_content' specified")
 
+
+def make_validation_options(args):
+    """ Make a canonical, hashable form of the options that can change a validation report.
+    @param args: the request parameters (e.g. flask.request.form)
+    @returns: a sorted tuple of (name, value) pairs
+    """
+    options = []
+    for name in VALIDATION_OPTION_NAMES:
+        value = args.get(name)
+        if value is not None:
+            options.append((name, value if isinstance(value, str) else json.dumps(value, sort_keys=True),))
+    return tuple(options)
+
+
+@hxl_proxy.cache.memoize(unless=util.skip_cache_p, args_to_ignore=['content', 'schema_content', 'args'])
+def _run_validation(url, content, content_hash, sheet_index, selector, schema_url, schema_content, schema_content_hash, schema_sheet_index, include_dataset, options, args):
+    """ Validation run, memoized on everything except the upload objects and raw args (see run_validation())
+    @param options: the canonical options from make_validation_options() (for the cache key)
+    @param args: the original request parameters
+    """
+
+    (source, schema, schema_args,) = open_validation(url, content, schema_url, schema_content, schema_content_hash, args)
+
+    # Validate the dataset (collecting its rows in the same pass, if requested)
+    (max_issues, max_rule_issues,) = get_issue_limits(args)
+    report = validate_source(
+        source, schema, max_issues, max_rule_issues, include_dataset,
+        history_id=make_history_id(url, content, args)
+    )
+
+    # add the URLs if supplied
+    report.update(make_report_extras(url, sheet_index, schema_url, schema_args))
+
+    return report
+
+
+def open_validation(url, content, schema_url, schema_content, schema_content_hash, args):
+    """ Open the data and get the compiled schema for a validation run
+    @returns: a (source, schema, schema_args) tuple
+    """
+
+    (sample, head,) = get_row_limits(args)
+
     # set up the main data
     if content:
         # TODO: stop using libhxl's make_input directly
         source = util.hxl_data(hxl.input.make_input(content, util.make_input_options(args)))
+    elif head is not None:
+        # stream the source, so that downloading stops after the head
+        input_options = util.make_input_options(args)
+        source = util.hxl_data(util.hxl_make_input(url, input_options, stream=True), input_options)
     else:
         source = util.hxl_data(url, util.make_input_options(args))
 
-    # cache if we're including the dataset in the results (we have to run over it twice)
-    if include_dataset:
-        source = source.cache()
+    # validate only some rows, if requested
+    source = limit_rows(source, sample, head)
+
+    (schema, schema_args,) = open_schema(schema_url, schema_content, schema_content_hash, args)
 
-    # set up the schema (if present)
+    return (source, schema, schema_args,)
+
+
+def open_schema(schema_url, schema_content, schema_content_hash, args):
+    """ Get the compiled schema for a validation run
+    The schema_* request parameters (e.g. schema_sheet) apply to the schema.
+    @returns: a (schema, schema_args) tuple
+    """
     schema_args = dict(args)
     schema_args['sheet'] = args.get('schema_sheet', args.get('schema_sheet', None))
     schema_args['selector'] = args.get('schema-selector', args.get('schema_selector', None))
@@ -49,34 +236,472 @@ def run_validation(url, content, content_hash, sheet_index, selector, schema_url
     schema_args['encoding'] = args.get('schema-encoding', args.get('schema_encoding', None))
     schema_args['expand_merged'] = args.get('schema-expand-merged', args.get('schema_expand_merged', None))
 
-    if schema_content:
-        schema_source = util.hxl_data(hxl.input.make_input(schema_content, util.make_input_options(schema_args)))
-    elif schema_url:
-        schema_source = util.hxl_data(schema_url, util.make_input_options(schema_args))
-    else:
-        schema_source = None
+    # compiled schemas are cached across requests (see schemas.get_schema())
+    schema = schemas.get_schema(
+        url=schema_url,
+        content=schema_content if schema_content else None,
+        content_hash=schema_content_hash,
+        input_options=util.make_input_options(schema_args)
+    )
 
-    # Validate the dataset
-    report = hxl.validate(source, schema_source)
+    return (schema, schema_args,)
 
-    # add the URLs if supplied
+
+def make_report_extras(url, sheet_index, schema_url, schema_args):
+    """ Make the report properties that say where the data and schema came from """
+    extras = {}
     if url:
-        report['data_url'] = url
+        extras['data_url'] = url
     if sheet_index is not None:
-        report['data_sheet_index'] = sheet_index
+        extras['data_sheet_index'] = sheet_index
     if schema_url:
-        report['schema_url'] = schema_url
+        extras['schema_url'] = schema_url
     if schema_args.get('sheet') is not None:
-        report['schema_sheet_index'] = schema_args.get('sheet')
+        extras['schema_sheet_index'] = schema_args.get('sheet')
+    return extras
 
-    # include the original dataset if requested
-    if include_dataset:
-        content = []
-        content.append([util.no_none(column.header) for column in source.columns])
-        content.append([util.no_none(column.display_tag) for column in source.columns])
+
+def get_issue_limits(args):
+    """ Get the caps on validation issues from the request parameters
+    &max_issues caps the issues for the whole report, and &max_rule_issues caps
+    the issues for each rule.
+    @param args: the request parameters
+    @returns: a (max_issues, max_rule_issues) tuple, with None for no cap
+    @raises werkzeug.exceptions.BadRequest: if a cap isn't a positive integer
+    """
+    return (_get_positive_int(args, 'max_issues'), _get_positive_int(args, 'max_rule_issues'),)
+
+
+def get_row_limits(args):
+    """ Get the subset of rows to validate from the request parameters
+    &head validates only the first rows of the dataset, and &sample a random
+    sample of its rows (see RowLimitFilter). Either way, the report is
+    marked as partial.
+    @param args: the request parameters
+    @returns: a (sample, head) tuple, with None for all rows
+    @raises werkzeug.exceptions.BadRequest: if a limit isn't a positive integer, or both are present
+    """
+    sample = _get_positive_int(args, 'sample')
+    head = _get_positive_int(args, 'head')
+    if sample is not None and head is not None:
+        raise werkzeug.exceptions.BadRequest("Can't use &sample with &head")
+    return (sample, head,)
+
+
+def _get_positive_int(args, name):
+    """ Get an optional positive integer from the request parameters
+    @returns: the integer, or None if the parameter is missing or empty
+    @raises werkzeug.exceptions.BadRequest: if the value isn't a positive integer
+    """
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError,):
+        raise werkzeug.exceptions.BadRequest("&{} must be a positive integer".format(name))
+    if value < 1:
+        raise werkzeug.exceptions.BadRequest("&{} must be a positive integer".format(name))
+    return value
+
+
+def limit_rows(source, sample=None, head=None):
+    """ Limit the rows to validate (see get_row_limits())
+    @param source: the hxl.model.Dataset to validate
+    @param sample: the number of rows in a random sample, or None
+    @param head: the number of rows at the start of the dataset, or None
+    @returns: a RowLimitFilter, or the original source if there are no limits
+    """
+    if sample is None and head is None:
+        return source
+    return RowLimitFilter(source, sample=sample, head=head)
+
+
+class RowLimitFilter(hxl.filters.AbstractBaseFilter):
+    """ Filter that passes through only a subset of a dataset's rows, for a quick, partial validation
+
+    With a head size, the filter passes through the first rows and
+    stops reading (after looking one row further, to tell whether there
+    were any more). With a sample size, it reads the whole dataset,
+    keeping a random sample of rows (reservoir sampling, so only the
+    sample is ever in memory), then passes them through in their
+    original order, with their original row numbers. The random
+    generator has a fixed seed, so the same dataset gives the same
+    sample each time (e.g. while tuning a schema).
+
+    A validator can use describe() to add the details to its report.
+
+    """
+
+    def __init__(self, source, sample=None, head=None):
+        """
+        @param source: the hxl.model.Dataset to filter
+        @param sample: the number of rows in the random sample, or None
+        @param head: the number of rows to take from the start, or None
+        """
+        super().__init__(source)
+        self.sample = sample
+        self.head = head
+        self.rows_read = 0
+        self.rows_kept = 0
+        self.is_complete = False
+
+    @property
+    def is_cached(self):
+        # the rows come from a new pass through the source each time
+        return False
+
+    def __iter__(self):
+        self.rows_read = 0
+        self.rows_kept = 0
+        self.is_complete = False
+        if self.sample is not None:
+            rows = self._make_sample()
+        else:
+            # read one extra row, so that a dataset with exactly head rows counts as complete
+            rows = itertools.islice(self._count(self.source), self.head + 1)
+        for row in rows:
+            if self.sample is None and self.rows_kept >= self.head:
+                return
+            self.rows_kept += 1
+            yield row
+        self.is_complete = True
+
+    def describe(self):
+        """ Describe the subset of rows, for a validation report
+        "rows_read" is the total number of rows in the dataset, if the filter read it all.
+        @returns: a dict with the "mode" ("sample" or "head"), "size", "rows_validated", and "rows_read" properties
+        """
+        return {
+            'mode': 'sample' if self.sample is not None else 'head',
+            'size': self.sample if self.sample is not None else self.head,
+            'rows_validated': self.rows_kept,
+            'rows_read': self.rows_read if self.is_complete else None,
+        }
+
+    def _count(self, rows):
+        """ Count the rows read from the source """
+        for row in rows:
+            self.rows_read += 1
+            yield row
+
+    def _make_sample(self):
+        """ Read the whole source, and return a random sample of its rows in their original order """
+        generator = random.Random(self.sample)
+        reservoir = []
+        for index, row in enumerate(self._count(self.source)):
+            if index < self.sample:
+                reservoir.append((index, row,))
+            else:
+                slot = generator.randint(0, index)
+                if slot < self.sample:
+                    reservoir[slot] = (index, row,)
+        return [row for (index, row,) in sorted(reservoir, key=lambda item: item[0])]
+
+
+def validate_source(source, schema, max_issues=None, max_rule_issues=None, include_dataset=False, history_id=None):
+    """ Validate a dataset, like hxl.validate(), with optional caps on the issues
+    @param source: the hxl.model.Dataset to validate
+    @param schema: the hxl.validation.Schema to use (see schemas.get_schema())
+    @param max_issues: the maximum number of issues to report, or None for no cap
+    @param max_rule_issues: the maximum number of issues to report for each rule, or None for no cap
+    @param include_dataset: if True, include the dataset in the report (read in the same pass)
+    @param history_id: the identity of the dataset (e.g. its URL), for incremental validation (see make_validator())
+    @returns: a validation report, suitable for returning as JSON
+    """
+    return make_validator(schema, max_issues, max_rule_issues, history_id).report(source, include_dataset)
+
+
+def make_validator(schema, max_issues=None, max_rule_issues=None, history_id=None):
+    """ Make a validator for a schema
+    If there's a history_id and no caps on the issues, and incremental validation
+    is on, the validator rechecks only the rows that changed since the last run
+    for the same dataset and schema (see incremental.IncrementalValidator).
+    @param schema: the hxl.validation.Schema to use (see schemas.get_schema())
+    @param max_issues: the maximum number of issues to report, or None for no cap
+    @param max_rule_issues: the maximum number of issues to report for each rule, or None for no cap
+    @param history_id: the identity of the dataset (e.g. its URL or stub), or None
+    @returns: a StreamingValidator
+    """
+    if history_id and max_issues is None and max_rule_issues is None:
+        # imported here, because incremental imports this module
+        from hxl_proxy import incremental
+        if incremental.is_enabled():
+            return incremental.IncrementalValidator(schema, history_id)
+    return StreamingValidator(schema, max_issues, max_rule_issues)
+
+
+def make_history_id(url, content, args):
+    """ Identify a dataset across validation runs (see make_validator())
+    @returns: the stub, URL, or upload file name, or None if there's none
+    """
+    if args.get('stub'):
+        return 'stub:' + args.get('stub')
+    elif url:
+        return 'url:' + url
+    elif getattr(content, 'filename', None):
+        return 'file:' + content.filename
+    else:
+        return None
+
+
+class StreamingValidator:
+    """ Validate a dataset row by row, reporting each issue as it's found
+
+    Takes the place of libhxl's Schema.validate(), calling the same
+    schema methods in the same order, so the issues are the same.
+    With a cap on the total issues, validation stops (without reading
+    the rest of the dataset) as soon as the cap is reached. With a cap
+    on the issues for each rule, a rule stops testing values when it
+    reaches the cap, and validation stops when every rule has. Either
+    way, the report is marked as truncated. External issues (e.g. a
+    taxonomy that couldn't load) don't count towards the caps.
+
+    If the source is a RowLimitFilter (see limit_rows()), the report
+    has a "partial" property describing the rows validated.
+
+    The validator changes the schema, so each one needs a schema of
+    its own (as from schemas.get_schema()).
+
+    Usage:
+        validator = StreamingValidator(schemas.get_schema(), max_issues=100)
+        for line in validator.iter_ndjson(source):
+            ...
+
+    """
+
+    def __init__(self, schema, max_issues=None, max_rule_issues=None):
+        """
+        @param schema: the hxl.validation.Schema to use
+        @param max_issues: the maximum number of issues to report, or None for no cap
+        @param max_rule_issues: the maximum number of issues to report for each rule, or None for no cap
+        """
+        self.schema = schema
+        self.max_issues = max_issues
+        self.max_rule_issues = max_rule_issues
+        self.status = True
+        self.truncated = False
+        self.stats = {
+            'info': 0,
+            'warning': 0,
+            'error': 0,
+            'external': 0,
+            'total': 0,
+        }
+        self._issue_count = 0
+        self._rule_counts = {}
+        self._capped_rules = set()
+        self._pending = []
+        self._row_limit = None
+        schema.callback = self._add_issue
+
+    def iter_issues(self, source):
+        """ Validate a dataset, generating each issue as it's found
+        @param source: the hxl.model.Dataset to validate
+        @returns: a generator of hxl.validation.HXLValidationException objects
+        """
+        for (row, issues,) in self._run(source):
+            yield from issues
+
+    def report(self, source, include_dataset=False):
+        """ Validate a dataset and make a report in the same format as hxl.validate()
+        If there are caps on the issues, the report also has a "truncated" property.
+        @param source: the hxl.model.Dataset to validate
+        @param include_dataset: if True, add a "dataset" property with the headers, hashtags, and rows
+        @returns: a validation report, suitable for returning as JSON
+        """
+        issue_map = {}
+        external_issue_map = {}
+        rows = []
+        for (row, issues,) in self._run(source, read_all=include_dataset):
+            self._map_issues(issues, issue_map, external_issue_map)
+            if include_dataset and row is not None:
+                rows.append([util.no_none(value) for value in row.values])
+        report = self._make_report(issue_map, external_issue_map)
+        if include_dataset:
+            report['dataset'] = self._make_dataset_head(source) + rows
+        return report
+
+    def iter_json(self, source, extras={}, include_dataset=False):
+        """ Validate a dataset, generating the JSON text of its report in a single pass
+        The report is the same as report()'s. With include_dataset, each row
+        goes to the output as soon as it's validated, so the dataset is never
+        held in memory (unless a rule needs to pre-scan it). Once a cap on
+        the issues is reached, the rest of the rows are copied without
+        validation.
+        @param source: the hxl.model.Dataset to validate
+        @param extras: extra properties for the report (e.g. "data_url")
+        @param include_dataset: if True, start with a "dataset" property with the headers, hashtags, and rows
+        @returns: a generator of strings
+        """
+        issue_map = {}
+        external_issue_map = {}
+        if include_dataset:
+            yield '{"dataset": [\n'
+            yield ',\n'.join(json.dumps(values) for values in self._make_dataset_head(source))
+        for (row, issues,) in self._run(source, read_all=include_dataset):
+            self._map_issues(issues, issue_map, external_issue_map)
+            if include_dataset and row is not None:
+                yield ',\n' + json.dumps([util.no_none(value) for value in row.values])
+        report = self._make_report(issue_map, external_issue_map)
+        report.update(extras)
+        properties = ',\n'.join('{}: {}'.format(json.dumps(name), json.dumps(value)) for name, value in report.items())
+        if include_dataset:
+            yield '\n],\n' + properties + '}\n'
+        else:
+            yield '{' + properties + '}\n'
+
+    def iter_ndjson(self, source, extras={}):
+        """ Validate a dataset, generating newline-delimited JSON as the issues are found
+        Each issue is a line with the same properties as an issue in hxl.validate()'s
+        report (with a single location), and "type": "issue". The last line has
+        the report's other properties, and "type": "summary".
+        @param source: the hxl.model.Dataset to validate
+        @param extras: extra properties for the summary line (e.g. "data_url")
+        @returns: a generator of strings
+        """
+        for issue in self.iter_issues(source):
+            json_issue = hxl.validation.make_json_issue(
+                hxl.validation.make_rule_hash(issue.rule),
+                [issue],
+                is_external=issue.is_external
+            )
+            json_issue['type'] = 'issue'
+            yield json.dumps(json_issue) + '\n'
+        summary = {
+            'type': 'summary',
+            'validator': 'libhxl-python',
+            'timestamp': datetime.datetime.now().isoformat(),
+            'is_valid': self.status,
+            'stats': self.stats,
+            'truncated': self.truncated,
+        }
+        if self._row_limit is not None:
+            summary['partial'] = self._row_limit.describe()
+        summary.update(extras)
+        yield json.dumps(summary) + '\n'
+
+    def _run(self, source, read_all=False):
+        """ Validate a dataset, in the same order as libhxl's Schema.validate()
+        Generates a (row, issues) tuple after the dataset-level tests, after each row,
+        and after the end-of-dataset tests, where row is None except for the rows.
+        @param source: the hxl.model.Dataset to validate
+        @param read_all: if True, keep generating rows (without validating them) after reaching a cap
+        @returns: a generator of (hxl.model.Row, list) tuples
+        """
+        schema = self.schema
+
+        # a partial validation (see limit_rows()) gets marked in the report
+        if isinstance(source, RowLimitFilter):
+            self._row_limit = source
+
+        # rules that need a pre-scan need a dataset they can read twice
+        needs_scan = any(rule.needs_scan() for rule in schema.rules)
+        if needs_scan and not source.is_cached:
+            source = source.cache()
+
+        schema.start()
+
+        if needs_scan:
+            for row in source:
+                schema.scan_row(row)
+            schema.end_scan()
+
+        if not schema.validate_dataset(source):
+            self.status = False
+        yield (None, self._take_pending(),)
+
+        finished = self._is_finished()
+        if finished and not read_all:
+            return
         for row in source:
-            content.append([util.no_none(value) for value in row.values])
-        report['dataset'] = content
+            if finished:
+                yield (row, [],)
+                continue
+            if not self._validate_row(row):
+                self.status = False
+            yield (row, self._take_pending(),)
+            finished = self._is_finished()
+            if finished and not read_all:
+                # stop reading the dataset
+                return
 
-    return report
+        if not finished:
+            if not schema.end():
+                self.status = False
+            yield (None, self._take_pending(),)
+
+    def _validate_row(self, row):
+        """ Validate one row with every rule
+        @returns: True if the row is valid
+        """
+        return self.schema.validate_row(row)
+
+    def _map_issues(self, issues, issue_map, external_issue_map):
+        """ Group issues by rule, as hxl.validate() does """
+        for issue in issues:
+            rule_id = hxl.validation.make_rule_hash(issue.rule)
+            if issue.is_external:
+                external_issue_map.setdefault(rule_id, []).append(issue)
+            else:
+                issue_map.setdefault(rule_id, []).append(issue)
+
+    def _make_report(self, issue_map, external_issue_map):
+        """ Make a report from the grouped issues """
+        report = hxl.validation.make_json_report(self.status, issue_map, external_issue_map)
+        if self.max_issues is not None or self.max_rule_issues is not None:
+            report['truncated'] = self.truncated
+        if self._row_limit is not None:
+            report['partial'] = self._row_limit.describe()
+        return report
+
+    def _make_dataset_head(self, source):
+        """ Make the headers and hashtags rows for a report's "dataset" property """
+        return [
+            [util.no_none(column.header) for column in source.columns],
+            [util.no_none(column.display_tag) for column in source.columns],
+        ]
+
+    def _add_issue(self, issue):
+        """ Schema callback: keep an issue for reporting, unless it's over a cap """
+        if issue.is_external:
+            self.stats['external'] += 1
+            self.stats['total'] += 1
+            self._pending.append(issue)
+            return
+
+        rule_id = hxl.validation.make_rule_hash(issue.rule)
+        rule_count = self._rule_counts.get(rule_id, 0)
+        if (self.max_issues is not None and self._issue_count >= self.max_issues) or \
+           (self.max_rule_issues is not None and rule_count >= self.max_rule_issues):
+            self.truncated = True
+            return
+
+        self._issue_count += 1
+        self._rule_counts[rule_id] = rule_count + 1
+        self.stats[issue.rule.severity] += 1
+        self.stats['total'] += 1
+        self._pending.append(issue)
+
+        if self.max_rule_issues is not None and rule_count + 1 >= self.max_rule_issues:
+            # the rule is finished: stop testing values with it
+            self.truncated = True
+            issue.rule.tests = []
+            self._capped_rules.add(id(issue.rule))
+        if self.max_issues is not None and self._issue_count >= self.max_issues:
+            self.truncated = True
+
+    def _is_finished(self):
+        """ Test whether the caps make it pointless to read any more rows """
+        if self.max_issues is not None and self._issue_count >= self.max_issues:
+            return True
+        if self.max_rule_issues is not None and self.schema.rules:
+            return len(self._capped_rules) >= len(self.schema.rules)
+        return False
 
+    def _take_pending(self):
+        """ Take the issues found since the last call """
+        pending = self._pending
+        if pending:
+            self._pending = []
+        return pending
@@ -45,4 +45,11 @@ URL_MOCK_TARGET = 'hxl.input.open_url_or_file'
 URL_MOCK_OBJECT = unittest.mock.Mock()
 URL_MOCK_OBJECT.side_effect = mock_open_url
 
+# Target function to replace for mocking streamed URL access (when there's a row limit)
+STREAM_MOCK_TARGET = 'hxl_proxy.util.open_url_stream'
+
+# Mock object to replace hxl_proxy.util.open_url_stream
+STREAM_MOCK_OBJECT = unittest.mock.Mock()
+STREAM_MOCK_OBJECT.side_effect = mock_open_url
+
 # end
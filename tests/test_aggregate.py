@@ -0,0 +1,73 @@
+"""
+Unit tests for hxl_proxy.aggregate module
+
+License: Public Domain
+"""
+
+import hxl, unittest
+from unittest.mock import patch
+from hxl_proxy.aggregate import VectorCountFilter
+
+
+DATA = [
+    ['#org', '#sector', '#affected', '#date'],
+    ['Org C', 'WASH', '100', '2020-03-01'],
+    ['Org A', 'Health', '9', '2020-01-01'],
+    ['Org B', 'WASH', '20.5', '2020-02-01'],
+    ['Org A', 'Education', '100', ''],
+    ['Org D', 'Health', 'unknown', '2020-05-01'],
+    ['Org B', 'Protection', '0.5', '2019-12-01'],
+    ['Org A', 'Health', '1,000', '2021-01-01'],
+]
+
+AGGREGATORS = [
+    'count() as Count#meta+count',
+    'sum(#affected) as Sum#affected+sum',
+    'average(#affected) as Average#affected+avg',
+    'min(#date) as First#date+min',
+    'max(#affected) as Max#affected+max',
+    'concat(#sector) as Sectors#sector+list',
+]
+
+class TestVectorCountFilter(unittest.TestCase):
+
+    def assertSameRows(self, patterns, aggregators=AGGREGATORS, queries=[], **kwargs):
+        """Compare with libhxl's count filter"""
+        expected = hxl.data(DATA).count(patterns, aggregators, queries)
+        filter = VectorCountFilter(hxl.data(DATA), patterns, aggregators, queries, **kwargs)
+        self.assertEqual(expected.display_tags, filter.display_tags)
+        self.assertEqual(expected.values, filter.values)
+        return filter
+
+    def test_count(self):
+        self.assertSameRows('#org', None)
+        self.assertSameRows('#org,#sector', 'count()', queries='#sector=WASH')
+
+    def test_aggregators(self):
+        self.assertSameRows('#org')
+        self.assertSameRows('#sector')
+
+    def test_big_sums(self):
+        # int64 would wrap around after about 2,000 of these
+        data = [['#org', '#affected']] + [['Org A', str(2 ** 52 - 1)]] * 3000 + [['Org B', '1']]
+        aggregators = ['sum(#affected) as Sum#affected+sum']
+        expected = hxl.data(data).count('#org', aggregators)
+        self.assertEqual(expected.values, VectorCountFilter(hxl.data(data), '#org', aggregators).values)
+        self.assertEqual([3000 * (2 ** 52 - 1), 1], [row[1] for row in expected.values])
+        # (libhxl's running average isn't exact here, so check the average directly)
+        filter = VectorCountFilter(hxl.data(data), '#org', 'average(#affected) as Average#affected+avg')
+        self.assertEqual([float(2 ** 52 - 1), 1.0], [row[1] for row in filter.values])
+        # running sums that get near the limit move to Python ints
+        with patch('hxl_proxy.aggregate.MAX_INT_SUM', 100), patch('hxl_proxy.aggregate.BATCH_SIZE', 2):
+            data = [['#org', '#affected']] + [['Org A', '30'], ['Org B', '-1']] * 10
+            expected = hxl.data(data).count('#org', AGGREGATORS[:3])
+            self.assertEqual(expected.values, VectorCountFilter(hxl.data(data), '#org', AGGREGATORS[:3]).values)
+
+    def test_spill(self):
+        # at most one group in memory at a time
+        filter = self.assertSameRows('#org', max_groups=1)
+        self.assertTrue(len(filter._saved_rows.spill.paths) > 1)
+        # spilled rows can be replayed
+        self.assertEqual(4, len(filter.values))
+
+# end
@@ -0,0 +1,95 @@
+"""
+Unit tests for hxl_proxy.batch module
+
+License: Public Domain
+"""
+
+import flask, hxl, hxl_proxy, unittest, werkzeug
+from unittest.mock import Mock, patch
+from hxl_proxy import batch
+from . import URL_MOCK_TARGET, mock_open_url
+
+
+SCHEMA = [
+    ['#valid_tag', '#valid_value+list'],
+    ['#sector', 'WASH|Health'],
+]
+
+class TestIterBatch(unittest.TestCase):
+
+    URLS = [
+        'http://example.org/basic-dataset.csv',
+        'http://example.org/no-such-file.csv',
+        'http://example.org/basic-dataset.xlsx',
+    ]
+
+    def setUp(self):
+        self.options = hxl_proxy.util.make_input_options({})
+
+    @patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url))
+    def test_results(self):
+        schema = hxl.schema(SCHEMA)
+        results = list(batch.iter_batch(self.URLS, schema, self.options))
+        self.assertEqual([0, 1, 2], [result['index'] for result in results])
+        self.assertEqual(self.URLS, [result['url'] for result in results])
+        # the same report as validating the dataset alone
+        for i in (0, 2,):
+            expected = hxl.validate(hxl.data(self.URLS[i]), hxl.data(SCHEMA))
+            report = results[i]['report']
+            del expected['timestamp']
+            del report['timestamp']
+            self.assertEqual(expected, report)
+        # one failure doesn't stop the batch
+        self.assertEqual('FileNotFoundError', results[1]['error']['error'])
+        # the compiled schema isn't used directly
+        self.assertIsNone(schema.callback)
+
+    @patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url))
+    def test_not_shared(self):
+        # the datasets don't stay in the request's fetch memo
+        with hxl_proxy.app.test_request_context('/actions/validate-batch'):
+            list(batch.iter_batch(self.URLS, hxl.schema(SCHEMA), self.options))
+            self.assertEqual({}, flask.g.get('fetch_memo', {}))
+
+    @patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url))
+    def test_unordered(self):
+        results = list(batch.iter_batch(self.URLS, hxl.schema(SCHEMA), self.options, max_issues=1, ordered=False))
+        self.assertEqual([0, 1, 2], sorted(result['index'] for result in results))
+        reports = [result['report'] for result in results if 'report' in result]
+        self.assertEqual(2, len(reports))
+        for report in reports:
+            self.assertEqual(1, report['stats']['total'])
+            self.assertTrue(report['truncated'])
+
+
+class TestOrganizationUrls(unittest.TestCase):
+
+    def make_ckan(self, count, packages):
+        ckan = Mock()
+        ckan.action.package_search.return_value = {'count': count, 'results': packages}
+        return Mock(return_value=ckan)
+
+    def test_urls(self):
+        packages = [
+            {'resources': [
+                {'format': 'CSV', 'url': 'https://example.org/a.csv'},
+                {'format': 'PDF', 'url': 'https://example.org/a.pdf'},
+            ]},
+            {'resources': [
+                {'format': 'XLSX', 'url': 'https://example.org/b.xlsx'},
+            ]},
+        ]
+        with patch('ckanapi.RemoteCKAN', new=self.make_ckan(2, packages)) as make_ckan:
+            urls = batch.get_organization_urls('example-org', 10)
+            self.assertEqual(['https://example.org/a.csv', 'https://example.org/b.xlsx'], urls)
+            package_search = make_ckan.return_value.action.package_search
+            self.assertIn('organization:"example-org"', package_search.call_args[1]['fq'])
+            # the maximum applies
+            self.assertEqual(['https://example.org/a.csv'], batch.get_organization_urls('example-org', 1))
+
+    def test_bad_name(self):
+        with patch('ckanapi.RemoteCKAN') as make_ckan:
+            for organization in ('x', 'Example-Org', 'example" OR name:*', 'a' * 101,):
+                with self.assertRaises(werkzeug.exceptions.BadRequest):
+                    batch.get_organization_urls(organization, 10)
+            self.assertEqual(0, make_ckan.call_count)
@@ -0,0 +1,53 @@
+"""
+Unit tests for hxl_proxy.clean module
+
+License: Public Domain
+"""
+
+import hxl, unittest
+from hxl_proxy import clean
+from hxl_proxy.clean import MemoCleanDataFilter
+
+
+DATA = [
+    ['#org', '#sector', '#country', '#affected', '#date', '#geo+lat', '#geo+lon'],
+    ['Org A', 'WASH', '    Country   A', '200.0', 'June 1 2010', '45.5', '-75.5'],
+    ['Org B', 'Health', 'Country B', '50', '13/1/10', 'x', '75 W'],
+    ['Org C', 'Protection', 'Country A', '1.0E2', '11 May 2016', '45.5', '-75.5'],
+    ['org a', 'wash', '    Country   A', '1,000', 'June 1 2010', '', ''],
+    ['Org D', 'Health', 'Country B', 'lots', 'not a date', '45.5'],
+]
+
+ARGS = {
+    'whitespace': '#country',
+    'upper': '#sector',
+    'lower': '#org',
+    'date': '#date',
+    'number': '#affected',
+    'latlon': '#geo',
+}
+
+class TestMemoCleanDataFilter(unittest.TestCase):
+
+    def assertSameRows(self, **kwargs):
+        """Compare with libhxl's clean filter"""
+        expected = hxl.data(DATA).clean_data(**kwargs).values
+        self.assertEqual(expected, MemoCleanDataFilter(hxl.data(DATA), **kwargs).values)
+
+    def test_clean(self):
+        self.assertSameRows(**ARGS)
+        self.assertSameRows(purge=True, **ARGS)
+        self.assertSameRows(date_format='%d/%m/%Y', number_format='0.2f', **ARGS)
+
+    def test_queries(self):
+        self.assertSameRows(queries='#sector=Health', **ARGS)
+
+    def test_batches(self):
+        batch_size = clean.BATCH_SIZE
+        try:
+            clean.BATCH_SIZE = 2
+            self.assertSameRows(**ARGS)
+        finally:
+            clean.BATCH_SIZE = batch_size
+
+# end
@@ -9,11 +9,12 @@ License: Public Domain
 """
 
 # Mock URL access so that tests work offline
-from . import URL_MOCK_TARGET, URL_MOCK_OBJECT
-from unittest.mock import patch
+from . import URL_MOCK_TARGET, URL_MOCK_OBJECT, STREAM_MOCK_TARGET, STREAM_MOCK_OBJECT, mock_open_url
+from unittest.mock import Mock, patch
+from flask_caching.backends import SimpleCache
 from hxl_proxy.controllers import handle_default_exception
 
-import hxl_proxy, io, json, urllib
+import hxl, hxl_proxy, io, json, tracemalloc, urllib
 from . import base, resolve_path
 
 DATASET_URL = 'http://example.org/basic-dataset.csv'
@@ -181,6 +182,7 @@ class TestTaggerPage(AbstractControllerTest):
         assert b'value="country"' in response.data
 
     @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    @patch(STREAM_MOCK_TARGET, new=STREAM_MOCK_OBJECT)
     def test_tagger_output(self):
         """Test that the page accepts auto-tagged output."""
         response = self.get('/data/edit', {
@@ -208,6 +210,7 @@ class TestEditPage(AbstractControllerTest):
         assert response.location.endswith('/data/source')
 
     @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    @patch(STREAM_MOCK_TARGET, new=STREAM_MOCK_OBJECT)
     def test_redirect_no_tags(self):
         """If the dataset doesn't contain HXL tags, it should redirect to tagger."""
         response = self.get('/data/edit', {
@@ -217,6 +220,7 @@ class TestEditPage(AbstractControllerTest):
         assert 'untagged-dataset.csv' in response.location
 
     @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    @patch(STREAM_MOCK_TARGET, new=STREAM_MOCK_OBJECT)
     def test_url(self):
         response = self.get('/data/edit', {
             'url': DATASET_URL,
@@ -248,6 +252,7 @@ class TestDataPage(AbstractControllerTest):
         response = self.get('/data?url=/etc/passwd&force=on', status=403)
 
     @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    @patch(STREAM_MOCK_TARGET, new=STREAM_MOCK_OBJECT)
     def test_url(self):
         response = self.get('/data', {
             'url': DATASET_URL,
@@ -257,6 +262,63 @@ class TestDataPage(AbstractControllerTest):
         self.assertBasicDataset(response)
 
 
+class TestProfile(AbstractControllerTest):
+    """ Test /data/profile and &profile=on """
+
+    ARGS = {
+        'url': DATASET_URL,
+        'filter01': 'select',
+        'select-query01-01': '#sector=Education',
+        'filter02': 'sort',
+        'sort-tags02': '#org',
+    }
+
+    def get_profile(self, path, admin=False, status=200):
+        with self.client.session_transaction() as session:
+            session['is_admin'] = admin
+        self.response = self.client.get(path, query_string=self.ARGS)
+        self.assertEqual(status, self.response.status_code)
+        return self.response
+
+    def test_admin_only(self):
+        self.get_profile('/data/profile', status=403)
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_profile(self):
+        report = json.loads(self.get_profile('/data/profile', admin=True).data)
+        self.assertEqual(DATASET_URL, report['url'])
+        self.assertTrue('wall_ms' in report['fetch'])
+        self.assertEqual(['parse', 'select', 'sort'], [stage['name'] for stage in report['stages']])
+        self.assertEqual([None, 1, 2], [stage['index'] for stage in report['stages']])
+        rows_in = [stage['rows_in'] for stage in report['stages']]
+        rows_out = [stage['rows_out'] for stage in report['stages']]
+        self.assertEqual(rows_out[:-1], rows_in[1:])
+        self.assertEqual(rows_out[1], rows_out[2])
+        self.assertTrue(rows_out[0] > rows_out[1] > 0)
+        self.assertTrue(all(isinstance(stage['peak_memory_bytes'], int) for stage in report['stages']))
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_profile_already_tracing(self):
+        # don't reset or stop somebody else's memory tracing
+        tracemalloc.start()
+        try:
+            report = json.loads(self.get_profile('/data/profile', admin=True).data)
+            self.assertTrue(tracemalloc.is_tracing())
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(3, len(report['stages']))
+        self.assertIsNone(report['fetch']['peak_memory_bytes'])
+        self.assertEqual([None, None, None], [stage['peak_memory_bytes'] for stage in report['stages']])
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_profile_param(self):
+        self.ARGS = dict(self.ARGS, profile='on')
+        for path in ('/data', '/data/edit'):
+            report = json.loads(self.get_profile(path, admin=True).data)
+            self.assertEqual(3, len(report['stages']))
+        self.get_profile('/data', status=403)
+
+
 class TestValidationPage(AbstractControllerTest):
     """ Test /data/validate """
 
@@ -280,6 +342,74 @@ class TestValidationPage(AbstractControllerTest):
         })
         assert b'Validation succeeded' in response.data
 
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_max_issues(self):
+        response = self.get('/data/validate.json', {
+            'url': DATASET_URL,
+            'schema_url': 'http://example.org/good-schema.csv',
+            'max_issues': '1',
+        })
+        self.assertFalse(json.loads(response.get_data(True))['truncated'])
+        self.get('/data/validate.json', {'url': DATASET_URL, 'max_issues': 'x'}, status=400)
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_partial(self):
+        stream_mock = Mock(side_effect=mock_open_url)
+        with patch(STREAM_MOCK_TARGET, new=stream_mock):
+            report = json.loads(self.get('/data/validate.json', {'url': DATASET_URL, 'head': '1'}).get_data(True))
+        self.assertEqual('head', report['partial']['mode'])
+        # with a head, the source is streamed
+        self.assertEqual(1, stream_mock.call_count)
+        response = self.get('/data/validate', {'url': DATASET_URL, 'sample': '2'})
+        assert b'Partial validation' in response.data
+        self.get('/data/validate.json', {'url': DATASET_URL, 'sample': '2', 'head': '2'}, status=400)
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_cached_report(self):
+        """The dashboard views and the JSON share a cached report while the upstream validators don't change"""
+        mock = Mock(wraps=hxl_proxy.validate.validate_source)
+        validators = Mock(return_value=('"v1"', None))
+        hxl_proxy.app.config['VALIDATION_REPORT_TIMEOUT'] = 60
+        try:
+            # the tests normally use a null cache
+            with patch.dict(hxl_proxy.app.extensions['cache'], {hxl_proxy.cache: SimpleCache()}), \
+                 patch('hxl_proxy.validate.validate_source', new=mock), \
+                 patch('hxl_proxy.snapshot.get_validators', new=validators):
+                args = {'url': DATASET_URL, 'schema_url': 'http://example.org/good-schema.csv'}
+                self.get('/data/validate', args)
+                self.get('/data/validate', dict(args, severity='error'))
+                self.get('/data/validate', dict(args, details='xxx'))
+                self.assertTrue(json.loads(self.get('/data/validate.json', args).get_data(True))['is_valid'])
+                self.assertEqual(1, mock.call_count)
+                # the HEAD requests checked both URLs
+                self.assertEqual(
+                    {DATASET_URL, 'http://example.org/good-schema.csv'},
+                    set(call[0][0] for call in validators.call_args_list)
+                )
+                # an upstream change
+                validators.return_value = ('"v2"', None)
+                self.get('/data/validate', args)
+                self.assertEqual(2, mock.call_count)
+                # &force
+                self.get('/data/validate', dict(args, force='on'))
+                self.assertEqual(3, mock.call_count)
+                # a different recipe
+                self.get('/data/validate', dict(args, max_issues='5'))
+                self.assertEqual(4, mock.call_count)
+        finally:
+            del hxl_proxy.app.config['VALIDATION_REPORT_TIMEOUT']
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_ndjson(self):
+        response = self.get('/data/validate.ndjson', {
+            'url': DATASET_URL,
+        })
+        self.assertEqual('application/x-ndjson', response.mimetype)
+        summary = json.loads(response.get_data(True).splitlines()[-1])
+        self.assertEqual('summary', summary['type'])
+        self.assertTrue(summary['is_valid'])
+        self.assertEqual(DATASET_URL, summary['data_url'])
+
 
 class TestValidateAction(AbstractControllerTest):
 
@@ -294,6 +424,7 @@ class TestValidateAction(AbstractControllerTest):
         )
         result = json.loads(response.get_data(True))
         self.assertTrue(result['is_valid'])
+        self.assertEqual([['', ''], ['#adm1', '#affected'], ['Coast', '100'], ['Plains', '200']], result['dataset'])
 
     def test_post_invalid_content(self):
         """Should failed, because #affected is not a number"""
@@ -318,6 +449,110 @@ class TestValidateAction(AbstractControllerTest):
         result = json.loads(response.get_data(True))
         self.assertFalse(result['is_valid'])
 
+    def test_post_stream(self):
+        """Stream the issues, stopping at the first one"""
+        response = self.post(
+            '/actions/validate',
+            data = {
+                'content': (io.BytesIO(b"#adm1,#affected\r\nCoast,xxx\r\nPlains,yyy\r\n"), 'text.csv'),
+                'max_issues': '1',
+                'stream': 'on',
+            }
+        )
+        self.assertEqual('application/x-ndjson', response.mimetype)
+        lines = [json.loads(line) for line in response.get_data(True).splitlines()]
+        self.assertEqual(['issue', 'summary'], [line['type'] for line in lines])
+        self.assertEqual('xxx', lines[0]['locations'][0]['location_value'])
+        self.assertFalse(lines[1]['is_valid'])
+        self.assertTrue(lines[1]['truncated'])
+
+    def test_post_head(self):
+        """Validate only the first row"""
+        response = self.post(
+            '/actions/validate',
+            data = {
+                'content': (io.BytesIO(b"#adm1,#affected\r\nCoast,100\r\nPlains,xxx\r\n"), 'text.csv'),
+                'head': '1',
+            }
+        )
+        result = json.loads(response.get_data(True))
+        self.assertTrue(result['is_valid'])
+        self.assertEqual(1, result['partial']['rows_validated'])
+
+    def test_post_head_url(self):
+        """With a head, stream the source URL"""
+        stream_mock = Mock(side_effect=mock_open_url)
+        with patch(STREAM_MOCK_TARGET, new=stream_mock):
+            response = self.post('/actions/validate', data={'url': DATASET_URL, 'head': '2'})
+        result = json.loads(response.get_data(True))
+        self.assertEqual({'mode': 'head', 'size': 2, 'rows_validated': 2, 'rows_read': None}, result['partial'])
+        self.assertEqual(1, stream_mock.call_count)
+
+    def test_post_stream_dataset(self):
+        """Stream the report with the dataset"""
+        response = self.post(
+            '/actions/validate',
+            data = {
+                'content': (io.BytesIO(b"#adm1,#affected\r\nCoast,100\r\nPlains,xxx\r\n"), 'text.csv'),
+                'include_dataset': True,
+                'stream': 'on',
+            }
+        )
+        self.assertEqual('application/json', response.mimetype)
+        report = json.loads(response.get_data(True))
+        self.assertFalse(report['is_valid'])
+        self.assertEqual([['', ''], ['#adm1', '#affected'], ['Coast', '100'], ['Plains', 'xxx']], report['dataset'])
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_post_stream_error(self):
+        """Errors opening the source get an error response before any output"""
+        for include_dataset in (False, True,):
+            data = {'url': 'http://example.org/untagged-dataset.csv', 'stream': 'on'}
+            if include_dataset:
+                data['include_dataset'] = True
+            response = self.post('/actions/validate', data=data, status=403)
+            self.assertEqual('HXLTagsNotFoundException', json.loads(response.get_data(True))['error'])
+
+    def test_post_dataset_cached(self):
+        """Reports with the dataset are cached too, unless streamed"""
+        mock = Mock(wraps=hxl_proxy.validate.validate_source)
+        with patch.dict(hxl_proxy.app.extensions['cache'], {hxl_proxy.cache: SimpleCache()}), patch('hxl_proxy.validate.validate_source', new=mock):
+            for i in range(2):
+                response = self.post(
+                    '/actions/validate',
+                    data = {
+                        'content': (io.BytesIO(b"#adm1,#affected\r\nCoast,99\r\n"), 'text.csv'),
+                        'include_dataset': True,
+                    }
+                )
+                self.assertEqual(3, len(json.loads(response.get_data(True))['dataset']))
+            self.assertEqual(1, mock.call_count)
+
+    def test_post_cached(self):
+        """Repeat uploads of the same file should hit the cache, even with a different file name"""
+        mock = Mock(wraps=hxl_proxy.validate.validate_source)
+        # the tests normally use a null cache
+        with patch.dict(hxl_proxy.app.extensions['cache'], {hxl_proxy.cache: SimpleCache()}), patch('hxl_proxy.validate.validate_source', new=mock):
+            for filename in ('text.csv', 'copy.csv',):
+                response = self.post(
+                    '/actions/validate',
+                    data = {
+                        'content': (io.BytesIO(b"#adm1,#affected\r\nCoast,99\r\nPlains,xxx\r\n"), filename),
+                        'sheet': '0',
+                    }
+                )
+                self.assertFalse(json.loads(response.get_data(True))['is_valid'])
+            self.assertEqual(1, mock.call_count)
+            # different options mean a new validation
+            self.post(
+                '/actions/validate',
+                data = {
+                    'content': (io.BytesIO(b"#adm1,#affected\r\nCoast,99\r\nPlains,xxx\r\n"), 'text.csv'),
+                    'sheet': '1',
+                }
+            )
+            self.assertEqual(2, mock.call_count)
+
     def test_post_excel(self):
         """Open a dataset and schema from an Excel sheet"""
         with open(resolve_path('files/validation-data.xlsx'), 'rb') as data_input:
@@ -338,6 +573,50 @@ class TestValidateAction(AbstractControllerTest):
                 self.assertTrue(len(report['dataset']) > 2)
 
 
+
+class TestValidateBatchAction(AbstractControllerTest):
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_post_urls(self):
+        response = self.post(
+            '/actions/validate-batch',
+            data = {
+                'url': DATASET_URL,
+                'urls': 'http://example.org/basic-dataset.xlsx\n\n',
+                'schema_content': (io.BytesIO(b'#valid_tag,#valid_value+list\r\n#sector,WASH|Health\r\n'), 'schema.csv'),
+            }
+        )
+        result = json.loads(response.get_data(True))
+        self.assertEqual(
+            [DATASET_URL, 'http://example.org/basic-dataset.xlsx'],
+            [dataset['url'] for dataset in result['results']]
+        )
+        for dataset in result['results']:
+            self.assertFalse(dataset['report']['is_valid'])
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_post_stream(self):
+        response = self.post(
+            '/actions/validate-batch',
+            data = {
+                'url': [DATASET_URL, DATASET_URL],
+                'stream': 'on',
+            }
+        )
+        self.assertEqual('application/x-ndjson', response.mimetype)
+        results = [json.loads(line) for line in response.get_data(True).splitlines()]
+        self.assertEqual([0, 1], sorted(result['index'] for result in results))
+        self.assertTrue(results[0]['report']['is_valid'])
+
+    def test_post_limits(self):
+        self.post('/actions/validate-batch', data={}, status=400)
+        self.post('/actions/validate-batch', data={'hdx_organization': 'x" OR name:*'}, status=400)
+        hxl_proxy.app.config['BATCH_MAX_DATASETS'] = 1
+        try:
+            self.post('/actions/validate-batch', data={'url': [DATASET_URL, DATASET_URL]}, status=400)
+        finally:
+            del hxl_proxy.app.config['BATCH_MAX_DATASETS']
+
 class TestDataAdvanced(AbstractControllerTest):
 
     path = '/data/advanced'
@@ -500,6 +779,29 @@ class TestPcodes(AbstractControllerTest):
         #self.assertEqual('*', response.headers.get('access-control-allow-origin'))
 
 
+class TestStats(AbstractControllerTest):
+
+    path = '/api/stats'
+
+    URL = 'http://example.org/basic-dataset.csv'
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_stats(self):
+        response = self.get(self.path, {
+            'url': self.URL,
+            'filter01': 'select',
+            'select-query01-01': '#sector=WASH',
+            'force': 'on',
+        })
+        report = json.loads(response.get_data(True))
+        self.assertEqual(self.URL, report['url'])
+        self.assertEqual(1, report['row_count'])
+        self.assertEqual(['#org', '#sector', '#country'], [column['hashtag'] for column in report['columns']])
+        self.assertEqual('WASH', report['columns'][1]['top'][0]['value'])
+
+    def test_no_url(self):
+        response = self.get(self.path, {}, status=500)
+
 class TestHash(AbstractControllerTest):
 
     path = '/api/hash'
@@ -0,0 +1,50 @@
+"""
+Unit tests for hxl_proxy.dedup module
+
+License: Public Domain
+"""
+
+import hxl, unittest
+from hxl_proxy.dedup import DigestDeduplicationFilter
+
+
+DATA = [
+    ['#org', '#sector', '#affected'],
+    ['Org A', 'WASH', '100'],
+    ['Org A', 'WASH', '100.0'],
+    ['  org a', 'Health', '9'],
+    ['Org B', 'WASH', '20'],
+    ['Org A', 'Health', '1e2'],
+    ['Org B', 'Protection', '20'],
+]
+
+class TestDigestDeduplicationFilter(unittest.TestCase):
+
+    def assertSameRows(self, patterns=None, queries=[], **kwargs):
+        """Compare with libhxl's dedup filter"""
+        expected = hxl.data(DATA).dedup(patterns, queries).values
+        filter = DigestDeduplicationFilter(hxl.data(DATA), patterns, queries, **kwargs)
+        self.assertEqual(expected, filter.values)
+        return filter
+
+    def test_all_columns(self):
+        self.assertSameRows()
+
+    def test_patterns(self):
+        self.assertSameRows('#org')
+        self.assertSameRows('#org,#affected')
+        self.assertSameRows('#affected', queries='#sector=WASH')
+        # no matching columns means the whole row
+        self.assertSameRows('#adm1')
+
+    def test_spill(self):
+        filter = self.assertSameRows('#org,#sector', max_digests=1)
+        self.assertIsNotNone(filter.seen_map.db)
+
+    def test_replay(self):
+        # replayable when the source is cached
+        filter = DigestDeduplicationFilter(hxl.data(DATA).cache(), '#org')
+        self.assertEqual(filter.values, filter.values)
+        self.assertEqual(2, len(filter.values))
+
+# end
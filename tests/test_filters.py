@@ -10,6 +10,8 @@ import unittest
 import sys
 import operator
 
+import hxl_proxy
+
 from hxl.model import TagPattern
 from hxl.input import ArrayInput, HXLReader
 from hxl_proxy.filters import *
@@ -18,8 +20,8 @@ from hxl_proxy.recipes import Recipe
 #
 # Mock URL access so that tests work offline
 #
-from . import URL_MOCK_TARGET, URL_MOCK_OBJECT
-from unittest.mock import patch
+from . import URL_MOCK_TARGET, URL_MOCK_OBJECT, STREAM_MOCK_TARGET, mock_open_url
+from unittest.mock import Mock, patch
 
 
 DATA = [
@@ -47,11 +49,118 @@ class TestSetupFilters(unittest.TestCase):
         source = setup_filters(recipe)
 
         # check the whole pipeline
-        self.assertEqual('SortFilter', source.__class__.__name__, "sort filter is fourth")
+        self.assertEqual('ExternalSortFilter', source.__class__.__name__, "sort filter is fourth")
         self.assertEqual('RowFilter', source.source.__class__.__name__, "select filter is third")
-        self.assertEqual('CountFilter', source.source.source.__class__.__name__, "count filter is second")
+        self.assertEqual('VectorCountFilter', source.source.source.__class__.__name__, "count filter is second")
         self.assertEqual('HXLReader', source.source.source.source.__class__.__name__, "reader is first")
 
+    def test_tagged_no_buffer(self):
+        """A tagged source shouldn't keep its raw rows for rewinding."""
+        inputs = []
+        init = hxl_proxy.inputs.RewindableInput.__init__
+        def track(self, input):
+            init(self, input)
+            inputs.append(self)
+        with patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url)), \
+             patch.object(hxl_proxy.inputs.RewindableInput, '__init__', new=track):
+            source = setup_filters(Recipe(request_args={'url': 'http://example.org/basic-dataset.csv'}))
+            self.assertEqual(3, len(source.values))
+        self.assertEqual(1, len(inputs))
+        self.assertIsNone(inputs[0]._buffer)
+
+    def test_untagged_single_download(self):
+        """An untagged source should be downloaded only once for the tagger."""
+        mock = Mock(side_effect=mock_open_url)
+        args = {
+            'url': 'http://example.org/untagged-dataset.csv',
+            'tagger-01-header': 'organisation',
+            'tagger-01-tag': 'org',
+            'tagger-02-header': 'sector',
+            'tagger-02-tag': 'sector',
+            'tagger-03-header': 'country',
+            'tagger-03-tag': 'country'
+        }
+        with patch(URL_MOCK_TARGET, new=mock):
+            source = setup_filters(Recipe(request_args=args))
+            self.assertEqual(['#org', '#sector', '#country'], source.display_tags)
+            self.assertEqual(['Org A', 'Org B', 'Org C'], [row[0] for row in source.values])
+        self.assertEqual(1, mock.call_count)
+
+    def test_row_limit_streams(self):
+        """With a row limit and only streaming filters, the source should be streamed."""
+        args = {
+            'url': 'http://example.org/basic-dataset.csv',
+            'filter01': 'select',
+            'select-query01-01': '#sector=WASH',
+        }
+        url_mock = Mock(side_effect=mock_open_url)
+        stream_mock = Mock(side_effect=mock_open_url)
+        with patch(URL_MOCK_TARGET, new=url_mock), patch(STREAM_MOCK_TARGET, new=stream_mock):
+            source = setup_filters(Recipe(request_args=args), row_limit=25)
+            self.assertEqual(['Org A'], [row.get('#org') for row in source])
+            setup_filters(Recipe(request_args=args)).columns
+        self.assertEqual(1, stream_mock.call_count)
+        self.assertEqual(1, url_mock.call_count)
+
+    def test_sort_row_limit(self):
+        """Sort keeps only the top rows when the caller says it will read only those, not for max-rows alone."""
+        args = {
+            'url': 'http://example.org/basic-dataset.csv',
+            'filter01': 'sort',
+            'sort-tags01': '#org',
+            'max-rows': '1',
+        }
+        with patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url)):
+            self.assertEqual(3, len(setup_filters(Recipe(request_args=args)).values))
+            self.assertEqual(2, len(setup_filters(Recipe(request_args=args), row_limit=1).values))
+
+    def test_is_streaming_recipe(self):
+        self.assertTrue(is_streaming_recipe({'filter01': 'select', 'select-query01-01': '#sector=WASH'}))
+        self.assertTrue(is_streaming_recipe({'filter01': 'clean', 'clean-whitespace-tags01': 'org'}))
+        self.assertFalse(is_streaming_recipe({'filter01': 'select', 'filter02': 'sort'}))
+        self.assertFalse(is_streaming_recipe({'filter01': 'count'}))
+        self.assertFalse(is_streaming_recipe({'filter01': 'clean', 'clean-date-tags01': 'date'}))
+        self.assertFalse(is_streaming_recipe({'filter01': 'select', 'select-query01-01': '#affected is max'}))
+        self.assertFalse(is_streaming_recipe({'filter01': 'dedup', 'dedup-where01': '#affected is not min'}))
+        self.assertFalse(is_streaming_recipe({'recipe': '[{"filter": "sort"}]'}))
+
+    def test_find_row_local_run(self):
+        args = {
+            'filter01': 'clean',
+            'filter02': 'rename',
+            'filter04': 'select',
+            'filter05': 'sort',
+            'filter06': 'replace',
+            'filter07': 'select',
+            'select-query07-01': '#affected is min',
+        }
+        self.assertEqual([1, 2, 4], find_row_local_run(args, 1))
+        self.assertEqual([], find_row_local_run(args, 5))
+        self.assertEqual([6], find_row_local_run(args, 6))
+        self.assertEqual([], find_row_local_run({'filter01': 'clean', 'clean-date-tags01': 'date'}, 1))
+
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_parallel_workers(self):
+        args = {
+            'url': 'http://example.org/basic-dataset.csv',
+            'filter01': 'clean',
+            'clean-toupper-tags01': 'org',
+            'filter02': 'select',
+            'select-query02-01': '#sector=WASH',
+            'filter03': 'sort',
+            'sort-tags03': 'org',
+        }
+        expected = setup_filters(Recipe(request_args=args)).values
+        hxl_proxy.app.config['PARALLEL_WORKERS'] = 2
+        try:
+            source = setup_filters(Recipe(request_args=args))
+        finally:
+            hxl_proxy.app.config['PARALLEL_WORKERS'] = 0
+        self.assertEqual('ExternalSortFilter', source.__class__.__name__)
+        self.assertEqual('ParallelChunkFilter', source.source.__class__.__name__)
+        self.assertEqual([1, 2], source.source.indices)
+        self.assertEqual(expected, source.values)
+
     def test_null_recipe(self):
         self.assertIsNone(setup_filters(None), "ok to pass None to setup_filters")
 
@@ -80,6 +189,24 @@ class TestPipelineFunctions(unittest.TestCase):
         self.assertEqual(args['add-value05'], str(filter.specs[0][1]))
         self.assertTrue(filter.before)
 
+    @patch(URL_MOCK_TARGET, new=URL_MOCK_OBJECT)
+    def test_add_append_filter(self):
+        args = {
+            'append-dataset04-01': 'http://example.org/basic-dataset.csv',
+            'append-dataset04-02': 'http://example.org/input-info-hxl.csv',
+            'append-exclude-columns04': 'on'
+        }
+        filter = add_append_filter(self.source, args, 4)
+        self.assertEqual('AppendFilter', filter.__class__.__name__)
+        self.assertEqual(self.source, filter.source)
+        self.assertEqual(2, len(filter.append_sources))
+        values = filter.values
+        # original rows first, then each appended dataset in order
+        self.assertEqual(['Org A', 'Org B', 'Org C'], [row[0] for row in values[:3]])
+        self.assertEqual(['Org A', 'Org B', 'Org C'], [row[0] for row in values[3:6]])
+        self.assertEqual(['Colombia', 'Guinea', 'Myanmar'], [row[2] for row in values[3:6]])
+        self.assertEqual(['Panamá', 'Colombia'], [row[2] for row in values[6:8]])
+
     def test_add_clean_filter(self):
         args = {
             'clean-whitespace-tags07': 'country,adm1',
@@ -94,7 +221,7 @@ class TestPipelineFunctions(unittest.TestCase):
             ['org c', 'PROTECTION', 'Country A', '100', '2016-05-11']
         ]
         filter = add_clean_filter(self.source, args, 7)
-        self.assertEqual('CleanDataFilter', filter.__class__.__name__)
+        self.assertEqual('MemoCleanDataFilter', filter.__class__.__name__)
         self.assertEqual(self.source, filter.source.source, "source ok")
         self.assertEqual(['#country', '#adm1'], [str(p) for p in filter.whitespace], "whitespace ok")
         self.assertEqual(['#sector'], [str(p) for p in filter.upper], "upper ok")
@@ -112,7 +239,7 @@ class TestPipelineFunctions(unittest.TestCase):
             'count-column03-01': 'targeted+total',
         }
         filter = add_count_filter(self.source, args, 3)
-        self.assertEqual('CountFilter', filter.__class__.__name__, "count filter from args")
+        self.assertEqual('VectorCountFilter', filter.__class__.__name__, "count filter from args")
         self.assertEqual(self.source, filter.source, "source ok")
         self.assertEqual(['#country', '#adm1', '#adm2+ocha'], [str(p) for p in filter.patterns], "tags ok")
         self.assertEqual('sum', filter.aggregators[0].type)
@@ -208,7 +335,7 @@ class TestPipelineFunctions(unittest.TestCase):
             'jsonpath-patterns03': 'sector'
         }
         filter = add_jsonpath_filter(self.source, args, 3)
-        self.assertEqual('JSONPathFilter', filter.__class__.__name__)
+        self.assertEqual('CachedJSONPathFilter', filter.__class__.__name__)
         self.assertEqual('#sector', filter.patterns[0].tag)
 
     def test_add_row_filter(self):
@@ -244,7 +371,7 @@ class TestPipelineFunctions(unittest.TestCase):
             'sort-reverse13': 'on'
         }
         filter = add_sort_filter(self.source, args, 13)
-        self.assertEqual('SortFilter', filter.__class__.__name__, "sort filter from args")
+        self.assertEqual('ExternalSortFilter', filter.__class__.__name__, "sort filter from args")
         self.assertEqual(
             ['#country', '#adm1', '#org+ngo'],
             [str(p) for p in filter.sort_tags],
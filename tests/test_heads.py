@@ -0,0 +1,132 @@
+"""
+Unit tests for hxl_proxy.heads module
+
+License: Public Domain
+"""
+
+import hxl, hxl_proxy, io, itertools, json, re, unittest
+from unittest.mock import Mock, patch
+from flask_caching.backends import SimpleCache
+from hxl_proxy import heads
+from . import STREAM_MOCK_TARGET, URL_MOCK_TARGET, mock_open_url, resolve_path
+
+
+DATA_URL = 'http://example.org/basic-dataset.csv'
+
+with open(resolve_path('files/basic-dataset.csv'), 'rb') as input:
+    DATA = input.read()
+
+ROWS = [line.split(',') for line in DATA.decode('utf-8').splitlines()]
+
+
+class MockResponse:
+    """requests.Response for DATA, with optional Range support"""
+
+    def __init__(self, headers, ranges=True):
+        self.headers = {'content-type': 'text/csv'}
+        self.status_code = 200
+        self.content = DATA
+        result = re.match(r'^bytes=0-(\d+)$', (headers or {}).get('Range', ''))
+        if ranges and result:
+            self.status_code = 206
+            self.content = DATA[:int(result.group(1)) + 1]
+            self.headers['content-range'] = 'bytes 0-{}/{}'.format(len(self.content) - 1, len(DATA))
+        self.headers['content-length'] = str(len(self.content))
+
+    def iter_content(self, size):
+        for start in range(0, len(self.content), size):
+            yield self.content[start:start+size]
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def mock_get(ranges=True):
+    return Mock(side_effect=lambda url, headers=None, **kwargs: MockResponse(headers, ranges))
+
+
+class TestFetchHead(unittest.TestCase):
+
+    def setUp(self):
+        self.options = hxl_proxy.util.make_input_options({})
+
+    def test_range(self):
+        with patch('requests.get', new=mock_get()) as get:
+            head = heads.fetch_head(DATA_URL, self.options, max_bytes=70)
+            self.assertEqual('bytes=0-69', get.call_args[1]['headers']['Range'])
+        # the first 70 bytes end in the middle of the fourth row
+        self.assertEqual(ROWS[:2], head['rows'])
+        self.assertFalse(head['complete'])
+
+    def test_whole_file(self):
+        with patch('requests.get', new=mock_get()):
+            head = heads.fetch_head(DATA_URL, self.options, max_bytes=1024)
+        self.assertEqual(ROWS, head['rows'])
+        self.assertTrue(head['complete'])
+
+    def test_no_range_support(self):
+        with patch('requests.get', new=mock_get(ranges=False)):
+            head = heads.fetch_head(DATA_URL, self.options, max_rows=3, max_bytes=70)
+        self.assertEqual(ROWS[:3], head['rows'])
+        self.assertFalse(head['complete'])
+
+
+class TestOpenHead(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = patch.dict(hxl_proxy.app.extensions['cache'], {hxl_proxy.cache: SimpleCache()})
+        self.cache.start()
+        hxl_proxy.app.config['RAW_HEAD_TIMEOUT'] = 60
+        hxl_proxy.app.config['RAW_HEAD_ROWS'] = 2
+        self.options = hxl_proxy.util.make_input_options({})
+
+    def tearDown(self):
+        del hxl_proxy.app.config['RAW_HEAD_TIMEOUT']
+        del hxl_proxy.app.config['RAW_HEAD_ROWS']
+        self.cache.stop()
+
+    @patch(STREAM_MOCK_TARGET, new=Mock(side_effect=mock_open_url))
+    def test_shared(self):
+        with patch('requests.get', new=mock_get()) as get, hxl_proxy.app.test_request_context('/'):
+            for i in range(2):
+                self.assertEqual(ROWS[:2], list(itertools.islice(heads.open_head(DATA_URL, self.options), 2)))
+            self.assertEqual(1, get.call_count)
+            # reading past the head gives the rest of the source
+            self.assertEqual(ROWS, list(heads.open_head(DATA_URL, self.options)))
+            self.assertEqual(2, get.call_count)
+            # different options, different head
+            heads.open_head(DATA_URL, hxl_proxy.util.make_input_options({'encoding': 'latin1'}))
+            self.assertEqual(3, get.call_count)
+
+    def test_source_changed(self):
+        """Don't join the cached head to a different version of the source"""
+        changed = Mock(side_effect=lambda url, *args, **kwargs: (io.BytesIO(b'Changed,Header,Row\n' + DATA), 'text/csv', 'csv', None, None, None,))
+        with patch('requests.get', new=mock_get()), hxl_proxy.app.test_request_context('/'):
+            key = heads.make_head_key(DATA_URL, self.options)
+            self.assertEqual(ROWS[:2], list(itertools.islice(heads.open_head(DATA_URL, self.options), 2)))
+            self.assertIsNotNone(hxl_proxy.cache.get(key))
+            with patch(URL_MOCK_TARGET, new=changed), self.assertRaises(hxl.input.HXLIOException):
+                list(heads.open_head(DATA_URL, self.options))
+            # the stale head is gone
+            self.assertIsNone(hxl_proxy.cache.get(key))
+
+    def test_disabled(self):
+        hxl_proxy.app.config['RAW_HEAD_TIMEOUT'] = 0
+        with patch('hxl_proxy.heads.fetch_head') as fetch_head, \
+             patch('hxl_proxy.util.hxl_make_input', new=Mock(return_value='input')):
+            self.assertEqual('input', heads.open_head(DATA_URL, self.options))
+            self.assertEqual(0, fetch_head.call_count)
+
+    def test_preview_page(self):
+        """/api/data-preview reads the cached head"""
+        # the preview reads one row past the ones it shows
+        hxl_proxy.app.config['RAW_HEAD_ROWS'] = 3
+        client = hxl_proxy.app.test_client()
+        with patch('requests.get', new=mock_get()) as get:
+            for i in range(2):
+                response = client.get('/api/data-preview.json', query_string={'url': DATA_URL, 'rows': '2'})
+                self.assertEqual(ROWS[:2], json.loads(response.get_data(True)))
+            self.assertEqual(1, get.call_count)
@@ -0,0 +1,110 @@
+"""
+Unit tests for hxl_proxy.incremental module
+
+License: Public Domain
+"""
+
+import hxl, hxl_proxy, unittest
+from unittest.mock import patch
+from flask_caching.backends import SimpleCache
+from hxl_proxy import incremental, validate
+
+
+DATA = [
+    ['#org', '#affected', '#sector'],
+    ['Org A', '100', 'WASH'],
+    ['Org B', 'xxx', 'Health'],
+    ['Org C', 'yyy', 'Dance'],
+    ['Org D', '200', 'Music'],
+    ['Org E', 'zzz', 'Shoes'],
+]
+
+SCHEMA = [
+    ['#valid_tag', '#valid_datatype', '#valid_value+list', '#valid_unique', '#valid_severity'],
+    ['#affected', 'number', '', '', 'error'],
+    ['#sector', '', 'WASH|Health', '', 'warning'],
+    ['#org', '', '', 'true', 'error'],
+]
+
+class TestIncrementalValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = patch.dict(hxl_proxy.app.extensions['cache'], {hxl_proxy.cache: SimpleCache()})
+        self.cache.start()
+        hxl_proxy.app.config['INCREMENTAL_VALIDATION_MAX_ROWS'] = 100
+
+    def tearDown(self):
+        hxl_proxy.app.config['INCREMENTAL_VALIDATION_MAX_ROWS'] = 0
+        self.cache.stop()
+
+    def run_validation(self, data, schema=SCHEMA, history_id='url:http://example.org/data.csv'):
+        validator = validate.make_validator(hxl.schema(schema), history_id=history_id)
+        self.assertIsInstance(validator, incremental.IncrementalValidator)
+        report = validator.report(hxl.data(data))
+        del report['timestamp']
+        return (validator, report,)
+
+    def full_report(self, data, schema=SCHEMA):
+        report = hxl.validate(hxl.data(data), hxl.data(schema))
+        del report['timestamp']
+        return report
+
+    def test_same_report(self):
+        (validator, report,) = self.run_validation(DATA)
+        self.assertEqual(self.full_report(DATA), report)
+        self.assertEqual((5, 0,), (validator.rows_checked, validator.rows_reused,))
+        (validator, report,) = self.run_validation(DATA)
+        self.assertEqual(self.full_report(DATA), report)
+        self.assertEqual((0, 5,), (validator.rows_checked, validator.rows_reused,))
+
+    def test_changed_rows(self):
+        self.run_validation(DATA)
+        # fix one row, break another, add a duplicate org, and reorder
+        data = [DATA[0], DATA[5], ['Org B', '50', 'Health'], DATA[3], DATA[1], ['Org A', 'x', 'WASH'], DATA[4]]
+        (validator, report,) = self.run_validation(data)
+        self.assertEqual(self.full_report(data), report)
+        self.assertEqual((2, 4,), (validator.rows_checked, validator.rows_reused,))
+
+    def test_different_schema(self):
+        self.run_validation(DATA)
+        schema = SCHEMA[:3]
+        (validator, report,) = self.run_validation(DATA, schema=schema)
+        self.assertEqual(self.full_report(DATA, schema), report)
+        self.assertEqual(0, validator.rows_reused)
+
+    def test_different_columns(self):
+        self.run_validation(DATA)
+        data = [['#org', '#affected', '#sector+cluster']] + DATA[1:]
+        (validator, report,) = self.run_validation(data)
+        self.assertEqual(self.full_report(data), report)
+        self.assertEqual(0, validator.rows_reused)
+
+    def test_too_many_rows(self):
+        hxl_proxy.app.config['INCREMENTAL_VALIDATION_MAX_ROWS'] = 3
+        self.run_validation(DATA)
+        (validator, report,) = self.run_validation(DATA)
+        self.assertEqual(0, validator.rows_reused)
+
+    def test_disabled(self):
+        hxl_proxy.app.config['INCREMENTAL_VALIDATION_MAX_ROWS'] = 0
+        self.assertNotIsInstance(validate.make_validator(hxl.schema(SCHEMA), history_id='x'), incremental.IncrementalValidator)
+        # caps turn it off, too
+        hxl_proxy.app.config['INCREMENTAL_VALIDATION_MAX_ROWS'] = 100
+        self.assertNotIsInstance(validate.make_validator(hxl.schema(SCHEMA), max_issues=10, history_id='x'), incremental.IncrementalValidator)
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_stable(self):
+        self.assertEqual(
+            incremental.make_schema_fingerprint(hxl.schema(SCHEMA)),
+            incremental.make_schema_fingerprint(hxl.schema(SCHEMA))
+        )
+        self.assertNotEqual(
+            incremental.make_schema_fingerprint(hxl.schema(SCHEMA)),
+            incremental.make_schema_fingerprint(hxl.schema(SCHEMA[:3]))
+        )
+
+    def test_row_local(self):
+        rules = hxl.schema(SCHEMA).rules
+        self.assertEqual([True, True, False], [incremental.is_row_local_rule(rule) for rule in rules])
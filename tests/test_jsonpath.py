@@ -0,0 +1,40 @@
+"""
+Unit tests for hxl_proxy.jsonpath module
+
+License: Public Domain
+"""
+
+import hxl, unittest
+from hxl_proxy import jsonpath
+from hxl_proxy.jsonpath import CachedJSONPathFilter
+
+
+DATA = [
+    ['#org', '#x_json', '#sector'],
+    ['Org A', '{"name": "Alpha", "tags": ["a", "b"]}', 'WASH'],
+    ['Org B', '{"name": "Beta", "tags": []}', 'Health'],
+    ['Org A', '{"name": "Alpha", "tags": ["a", "b"]}', 'Health'],
+    ['Org C', 'not json', 'WASH'],
+    ['Org D', '{"tags": ["c"]}', 'WASH'],
+]
+
+class TestCachedJSONPathFilter(unittest.TestCase):
+
+    def assertSameRows(self, path, **kwargs):
+        """Compare with libhxl's jsonpath filter"""
+        expected = hxl.data(DATA).jsonpath(path, **kwargs).values
+        self.assertEqual(expected, CachedJSONPathFilter(hxl.data(DATA), path, **kwargs).values)
+
+    def test_extract(self):
+        self.assertSameRows('$.name', patterns='#x_json')
+        self.assertSameRows('$.tags[*]', patterns='#x_json')
+        self.assertSameRows('$.tags[*]', patterns='#x_json', use_json=False)
+        self.assertSameRows('$.name', patterns='#x_json', queries='#sector=WASH')
+
+    def test_parse_once(self):
+        jsonpath.parse_path.cache_clear()
+        CachedJSONPathFilter(hxl.data(DATA), '$.name')
+        CachedJSONPathFilter(hxl.data(DATA), '$.name')
+        self.assertEqual(1, jsonpath.parse_path.cache_info().hits)
+
+# end
@@ -0,0 +1,81 @@
+"""
+Unit tests for hxl_proxy.offload module
+
+License: Public Domain
+"""
+
+import flask, hxl, hxl_proxy, os, time, unittest, werkzeug
+from hxl_proxy import offload
+
+
+def report_context(suffix):
+    """Worker function for the tests (must be importable)"""
+    return (os.getpid(), flask.request.args.get('url'), flask.g.output_format + suffix,)
+
+
+def raise_authorization():
+    """Worker function for the tests: raise an exception that can't be unpickled"""
+    raise hxl.input.HXLAuthorizationException('Access not authorized', url=flask.request.args.get('url'))
+
+
+def sleep_for(seconds):
+    """Worker function for the tests: take a while"""
+    time.sleep(seconds)
+
+
+class TestClassify(unittest.TestCase):
+
+    def test_heavy(self):
+        self.assertTrue(offload.is_heavy_recipe({'url': 'http://example.org/data.xlsx'}))
+        self.assertTrue(offload.is_heavy_recipe({'url': 'http://example.org/data.XLS?dl=1', 'max-rows': '10'}))
+        self.assertTrue(offload.is_heavy_recipe({'url': 'http://example.org/data.csv', 'filter01': 'select', 'filter02': 'sort'}))
+        self.assertTrue(offload.is_heavy_recipe({'url': 'http://example.org/data.csv', 'filter01': 'clean'}))
+        self.assertTrue(offload.is_heavy_recipe({'url': 'http://example.org/data.csv', 'recipe': '[]'}))
+
+    def test_light(self):
+        self.assertFalse(offload.is_heavy_recipe({'url': 'http://example.org/data.csv'}))
+        self.assertFalse(offload.is_heavy_recipe({'url': 'http://example.org/data.csv', 'filter01': 'select'}))
+        # streaming, and only a few rows needed
+        self.assertFalse(offload.is_heavy_recipe({'url': 'http://example.org/data.csv', 'filter01': 'clean', 'max-rows': '10'}))
+
+    def test_disabled(self):
+        hxl_proxy.app.config['OFFLOAD_WORKERS'] = 0
+        self.assertFalse(offload.should_offload({'url': 'http://example.org/data.xlsx'}))
+
+
+class TestRunInRequestContext(unittest.TestCase):
+
+    def setUp(self):
+        hxl_proxy.app.config['OFFLOAD_WORKERS'] = 1
+
+    def tearDown(self):
+        hxl_proxy.app.config['OFFLOAD_WORKERS'] = 0
+
+    def test_request_context(self):
+        self.assertTrue(offload.should_offload({'url': 'http://example.org/data.xlsx'}))
+        with hxl_proxy.app.test_request_context('/data.csv', query_string={'url': 'http://example.org/data.xlsx'}):
+            flask.g.output_format = 'csv'
+            pid, url, output_format = offload.run_in_request_context(report_context, '!')
+        self.assertNotEqual(os.getpid(), pid)
+        self.assertEqual('http://example.org/data.xlsx', url)
+        self.assertEqual('csv!', output_format)
+
+    def test_exception(self):
+        with hxl_proxy.app.test_request_context('/data.csv', query_string={'url': 'http://example.org/private/data.xlsx'}):
+            flask.g.output_format = 'csv'
+            with self.assertRaises(hxl.input.HXLAuthorizationException) as context:
+                offload.run_in_request_context(raise_authorization)
+            self.assertEqual('http://example.org/private/data.xlsx', context.exception.url)
+            # the pool still works
+            self.assertEqual('csv!', offload.run_in_request_context(report_context, '!')[2])
+
+    def test_timeout(self):
+        hxl_proxy.app.config['OFFLOAD_TIMEOUT'] = 0.2
+        try:
+            with hxl_proxy.app.test_request_context('/data.csv'):
+                with self.assertRaises(werkzeug.exceptions.GatewayTimeout):
+                    offload.run_in_request_context(sleep_for, 1)
+        finally:
+            del hxl_proxy.app.config['OFFLOAD_TIMEOUT']
+
+# end
@@ -0,0 +1,80 @@
+"""
+Unit tests for hxl_proxy.parallel module
+
+License: Public Domain
+"""
+
+import hxl, unittest
+from hxl_proxy import parallel
+from hxl_proxy.parallel import ParallelChunkFilter
+
+
+DATA = [
+    ['#org', '#sector', '#country'],
+    ['Org A', 'WASH', '    Country   A'],
+    ['Org B', 'Health', 'Country B'],
+    ['org a', 'wash', 'Country A'],
+    ['Org C', 'Protection', 'Country  B'],
+    ['Org D', 'WASH', 'Country C'],
+]
+
+ARGS = {
+    'filter01': 'clean',
+    'clean-whitespace-tags01': 'country',
+    'clean-toupper-tags01': 'sector',
+    'filter02': 'select',
+    'select-query02-01': '#sector=WASH',
+    'filter03': 'rename',
+    'rename-oldtag03': 'country',
+    'rename-newtag03': 'country+name',
+    'rename-header03': 'Country name',
+}
+
+EXPECTED = [
+    ['Org A', 'WASH', 'Country A'],
+    ['org a', 'WASH', 'Country A'],
+    ['Org D', 'WASH', 'Country C'],
+]
+
+class TestParallelChunkFilter(unittest.TestCase):
+
+    def test_in_process(self):
+        # smaller than a chunk
+        source = ParallelChunkFilter(hxl.data(DATA), ARGS, [1, 2, 3], workers=2)
+        self.assertEqual(['#org', '#sector', '#country+name'], source.display_tags)
+        self.assertEqual(EXPECTED, source.values)
+
+    def test_workers(self):
+        # cached, so that it can be read twice
+        source = ParallelChunkFilter(hxl.data(DATA).cache(), ARGS, [1, 2, 3], workers=2, chunk_size=2)
+        self.assertEqual(['#org', '#sector', '#country+name'], source.display_tags)
+        self.assertEqual(EXPECTED, source.values)
+        self.assertEqual([0, 1, 2], [row.row_number for row in source])
+
+    def test_empty(self):
+        source = ParallelChunkFilter(hxl.data(DATA[:1]), ARGS, [1, 2, 3], workers=2, chunk_size=2)
+        self.assertEqual([], source.values)
+
+
+def raise_authorization():
+    raise hxl.input.HXLAuthorizationException('Access not authorized', url='http://example.org/private/data.csv')
+
+
+class TestCallInWorker(unittest.TestCase):
+
+    def test_result(self):
+        self.assertEqual(3, parallel.get_result(parallel.call_in_worker(sum, [1, 2])))
+
+    def test_unpicklable_exception(self):
+        result = parallel.call_in_worker(raise_authorization)
+        # a plain tuple, not the exception
+        self.assertIsInstance(result[1], tuple)
+        with self.assertRaises(hxl.input.HXLAuthorizationException) as context:
+            parallel.get_result(result)
+        self.assertEqual('http://example.org/private/data.csv', context.exception.url)
+
+    def test_picklable_exception(self):
+        with self.assertRaises(ValueError):
+            parallel.get_result(parallel.call_in_worker(int, 'x'))
+
+# end
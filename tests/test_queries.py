@@ -0,0 +1,78 @@
+"""
+Unit tests for hxl_proxy.queries module
+
+License: Public Domain
+"""
+
+import hxl, unittest
+from hxl_proxy import queries
+from hxl_proxy.queries import CompiledRowQuery
+
+
+DATA = [
+    ['#org', '#sector', '#affected', '#date', '#adm1', '#adm1'],
+    ['Org A', 'WASH', '100', '2020-01-01', 'Coast', ''],
+    ['Org B', 'Health', '9', '1 March 2020', '', 'Coast'],
+    ['Org C', 'WASH', '1,000', '2020-02-01', 'North', 'Coast'],
+    ['Org A', 'Education', 'x', '', 'North', ''],
+    ['Org B', 'wash', '20', '2019-12-01', 'Coast', 'North'],
+]
+
+QUERIES = [
+    '#sector=WASH',
+    '#sector~^w',
+    '#affected>10',
+    '#affected<=100',
+    '#date<2020-02',
+    '#adm1=Coast',
+    '#adm1!=Coast',
+    '#affected is number',
+    '#date is empty',
+    '#affected is max',
+    '#affected={{#affected}}',
+]
+
+class TestCompiledRowQuery(unittest.TestCase):
+
+    def test_parse_list(self):
+        self.assertEqual([], queries.parse_list(None))
+        compiled = queries.parse_list('#sector=WASH')
+        self.assertEqual(1, len(compiled))
+        self.assertTrue(isinstance(compiled[0], CompiledRowQuery))
+        # each call gets fresh query objects
+        self.assertIsNot(compiled[0], queries.parse_list('#sector=WASH')[0])
+        # parsed queries pass through
+        query = hxl.model.RowQuery.parse('#org=Org A')
+        self.assertIs(query, queries.parse_list([query])[0])
+
+    def test_same_rows(self):
+        """Select the same rows as libhxl's RowQuery"""
+        for query in QUERIES:
+            expected = hxl.data(DATA).cache().with_rows(query).values
+            self.assertEqual(
+                expected,
+                hxl.data(DATA).cache().with_rows(queries.parse_list(query)).values,
+                query
+            )
+            expected = hxl.data(DATA).cache().without_rows(query).values
+            self.assertEqual(
+                expected,
+                hxl.data(DATA).cache().without_rows(queries.parse_list(query)).values,
+                query
+            )
+
+    def test_rebind_columns(self):
+        query = queries.parse_list('#sector=WASH')[0]
+        row = hxl.model.Row(hxl.data(DATA).columns, DATA[1])
+        self.assertTrue(query.match_row(row))
+        columns = [hxl.model.Column.parse('#sector'), hxl.model.Column.parse('#org')]
+        self.assertTrue(query.match_row(hxl.model.Row(columns, ['WASH', 'Org A'])))
+        self.assertFalse(query.match_row(hxl.model.Row(columns, ['Org A', 'WASH'])))
+
+    def test_aggregate_needed(self):
+        query = queries.parse_list('#affected is min')[0]
+        row = hxl.model.Row(hxl.data(DATA).columns, DATA[1])
+        with self.assertRaises(hxl.HXLException):
+            query.match_row(row)
+
+# end
@@ -0,0 +1,91 @@
+"""
+Unit tests for hxl_proxy.schemas module
+
+License: Public Domain
+"""
+
+import hxl, hxl_proxy, io, unittest
+from unittest.mock import Mock, patch
+from hxl_proxy import schemas
+from . import URL_MOCK_TARGET, mock_open_url
+
+
+VALIDATOR_TARGET = 'hxl_proxy.snapshot.get_validators'
+
+SCHEMA = b'#valid_tag,#valid_value+list\n#sector,WASH|Health\n'
+
+class TestGetSchema(unittest.TestCase):
+
+    URL = 'http://example.org/good-schema.csv'
+
+    DATA_URL = 'http://example.org/basic-dataset.csv'
+
+    def setUp(self):
+        schemas.store.clear()
+        hxl_proxy.app.config['SCHEMA_CACHE_SIZE'] = 10
+        self.options = hxl_proxy.util.make_input_options({})
+
+    def tearDown(self):
+        hxl_proxy.app.config['SCHEMA_CACHE_SIZE'] = 0
+
+    def get_schema(self, validators, **kwargs):
+        with patch(VALIDATOR_TARGET, new=Mock(return_value=validators)):
+            return schemas.get_schema(input_options=self.options, **kwargs)
+
+    @patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url))
+    def test_url(self):
+        with patch('hxl_proxy.schemas.compile_schema', new=Mock(side_effect=schemas.compile_schema)) as compile:
+            first = self.get_schema(('"v1"', None), url=self.URL)
+            second = self.get_schema(('"v1"', None), url=self.URL)
+            self.assertEqual(1, compile.call_count)
+            # each request gets its own copy
+            self.assertIsNot(first, second)
+            # the schema changed
+            self.get_schema(('"v2"', None), url=self.URL)
+            self.assertEqual(2, compile.call_count)
+            # no validators, so no caching
+            self.get_schema(None, url=self.URL)
+            self.get_schema(None, url=self.URL)
+            self.assertEqual(4, compile.call_count)
+
+    @patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url))
+    def test_same_report(self):
+        def validate(schema):
+            report = hxl.validate(hxl.data(self.DATA_URL), schema)
+            del report['timestamp']
+            return report
+        expected = validate(hxl.data(io.BytesIO(SCHEMA)))
+        self.assertFalse(expected['is_valid'])
+        for i in range(2):
+            schema = self.get_schema(None, content=io.BytesIO(SCHEMA), content_hash='abc')
+            self.assertEqual(expected, validate(schema))
+
+    def test_content(self):
+        with patch('hxl_proxy.schemas.compile_schema', new=Mock(side_effect=schemas.compile_schema)) as compile:
+            for i in range(2):
+                schema = self.get_schema(None, content=io.BytesIO(SCHEMA), content_hash='abc')
+                self.assertEqual(1, len(schema.rules))
+            self.assertEqual(1, compile.call_count)
+            # no hash, so no caching
+            self.get_schema(None, content=io.BytesIO(SCHEMA))
+            self.assertEqual(2, compile.call_count)
+
+    def test_default(self):
+        with patch('hxl_proxy.schemas.compile_schema', new=Mock(side_effect=schemas.compile_schema)) as compile:
+            self.assertEqual(len(hxl.schema().rules), len(self.get_schema(None).rules))
+            self.get_schema(None)
+            self.assertEqual(1, compile.call_count)
+
+    def test_disabled(self):
+        hxl_proxy.app.config['SCHEMA_CACHE_SIZE'] = 0
+        with patch('hxl_proxy.schemas.compile_schema', new=Mock(side_effect=schemas.compile_schema)) as compile:
+            self.get_schema(None)
+            self.get_schema(None)
+            self.assertEqual(2, compile.call_count)
+
+    def test_lru(self):
+        hxl_proxy.app.config['SCHEMA_CACHE_SIZE'] = 2
+        for hash in ('a', 'b', 'c',):
+            self.get_schema(None, content=io.BytesIO(SCHEMA), content_hash=hash)
+        self.assertEqual(2, len(schemas.store.schemas))
+        self.assertIsNone(schemas.store.get(('content', 'a', hxl_proxy.util._make_options_key(self.options, True),), 60))
@@ -0,0 +1,157 @@
+"""
+Unit tests for hxl_proxy.snapshot module
+
+License: Public Domain
+"""
+
+import hxl, hxl_proxy, unittest
+from unittest.mock import Mock, patch
+from hxl_proxy import profiling, queries, snapshot
+from hxl_proxy.filters import setup_filters
+from hxl_proxy.recipes import Recipe
+from hxl_proxy.snapshot import Snapshot, SnapshotRowFilter
+from . import URL_MOCK_TARGET, mock_open_url
+
+
+DATA = [
+    ['#org', '#sector', '#sector', '#affected', '#date'],
+    ['Org A', 'WASH', 'Health', '200.0', '2020-01-01'],
+    ['Org B', 'Health', '', '50', '2021-06-30'],
+    ['org a', ' wash', 'Protection', '1.0E2', '2019-12-31'],
+    ['Org C', 'Education', 'WASH', 'lots', 'not a date'],
+    ['Org D'],
+]
+
+VALIDATOR_TARGET = 'hxl_proxy.snapshot.get_validators'
+
+class TestSnapshotRowFilter(unittest.TestCase):
+
+    def assertSameRows(self, specs, reverse=False):
+        """Compare with libhxl's select filter"""
+        if reverse:
+            expected = hxl.data(DATA).without_rows(specs).values
+        else:
+            expected = hxl.data(DATA).with_rows(specs).values
+        source = hxl.data(DATA)
+        dataset = Snapshot(source.columns, [tuple(row.values) for row in source]).dataset()
+        filter = SnapshotRowFilter(dataset, queries.parse_list(specs), reverse)
+        self.assertEqual(expected, filter.values)
+
+    def test_select(self):
+        self.assertSameRows('#sector=wash')
+        self.assertSameRows('#org=org a')
+        self.assertSameRows('#affected>75')
+        self.assertSameRows('#date<2021-01-01')
+        self.assertSameRows('#sector~^e')
+        self.assertSameRows(['#sector=WASH', '#org=Org B'])
+        self.assertSameRows([])
+
+    def test_reverse(self):
+        self.assertSameRows('#sector=wash', reverse=True)
+        self.assertSameRows(['#affected<75', '#org=Org C'], reverse=True)
+
+    def test_aggregate(self):
+        # falls back to testing row by row
+        self.assertSameRows('#affected is max')
+
+
+class TestOpenSnapshot(unittest.TestCase):
+
+    URL = 'http://example.org/basic-dataset.csv'
+
+    def setUp(self):
+        snapshot.store.clear()
+        self.options = hxl_proxy.util.make_input_options({})
+
+    def open(self, validators, make_source):
+        with patch(VALIDATOR_TARGET, new=Mock(return_value=validators)):
+            return snapshot.open_snapshot(self.URL, self.options, make_source)
+
+    @patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url))
+    def test_reuse(self):
+        hxl_proxy.app.config['SNAPSHOT_MAX_ROWS'] = 100
+        make_source = Mock(side_effect=lambda: hxl.data(self.URL))
+        expected = hxl.data(self.URL).values
+        self.assertEqual(expected, self.open(('"v1"', None), make_source).values)
+        self.assertEqual(expected, self.open(('"v1"', None), make_source).values)
+        self.assertEqual(1, make_source.call_count)
+        # the source changed
+        self.assertEqual(expected, self.open(('"v2"', None), make_source).values)
+        self.assertEqual(2, make_source.call_count)
+        # no validators, no snapshot
+        self.assertIsNone(self.open(None, make_source))
+
+    @patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url))
+    def test_too_big(self):
+        hxl_proxy.app.config['SNAPSHOT_MAX_ROWS'] = 2
+        make_source = Mock(side_effect=lambda: hxl.data(self.URL))
+        self.assertEqual(3, len(self.open(('"v1"', None), make_source).values))
+        self.open(('"v1"', None), make_source)
+        self.assertEqual(2, make_source.call_count)
+
+    def tearDown(self):
+        hxl_proxy.app.config['SNAPSHOT_MAX_ROWS'] = 0
+
+
+class TestSnapshotRecipes(unittest.TestCase):
+
+    def setUp(self):
+        snapshot.store.clear()
+        hxl_proxy.app.config['SNAPSHOT_MAX_ROWS'] = 100
+
+    def tearDown(self):
+        hxl_proxy.app.config['SNAPSHOT_MAX_ROWS'] = 0
+
+    def test_is_snapshot_recipe(self):
+        url = 'http://example.org/basic-dataset.csv'
+        self.assertTrue(snapshot.is_snapshot_recipe({'url': url, 'filter01': 'select', 'filter02': 'sort', 'filter_count': 2}))
+        self.assertFalse(snapshot.is_snapshot_recipe({'url': url, 'filter01': 'select', 'filter02': 'clean'}))
+        self.assertFalse(snapshot.is_snapshot_recipe({'url': url, 'tagger-01-header': 'org'}))
+        hxl_proxy.app.config['SNAPSHOT_MAX_ROWS'] = 0
+        self.assertFalse(snapshot.is_snapshot_recipe({'url': url, 'filter01': 'select'}))
+
+    def test_setup_filters(self):
+        args = {
+            'url': 'http://example.org/basic-dataset.csv',
+            'filter01': 'select',
+            'select-query01-01': '#sector=Education',
+            'select-reverse01': 'on',
+            'filter02': 'sort',
+            'sort-tags02': 'country',
+        }
+        hxl_proxy.app.config['SNAPSHOT_MAX_ROWS'] = 0
+        with patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url)):
+            expected = setup_filters(Recipe(request_args=args)).values
+        hxl_proxy.app.config['SNAPSHOT_MAX_ROWS'] = 100
+        mock = Mock(side_effect=mock_open_url)
+        with patch(URL_MOCK_TARGET, new=mock), patch(VALIDATOR_TARGET, new=Mock(return_value=('"v1"', None))):
+            for i in range(3):
+                source = setup_filters(Recipe(request_args=args))
+                self.assertEqual('SnapshotRowFilter', source.source.__class__.__name__)
+                self.assertEqual(expected, source.values)
+        self.assertEqual(1, mock.call_count)
+
+    def test_force(self):
+        """&force makes a new snapshot"""
+        args = {'url': 'http://example.org/basic-dataset.csv', 'filter01': 'select', 'select-query01-01': '#sector=WASH'}
+        mock = Mock(side_effect=mock_open_url)
+        with patch(URL_MOCK_TARGET, new=mock), patch(VALIDATOR_TARGET, new=Mock(return_value=('"v1"', None))):
+            setup_filters(Recipe(request_args=args)).values
+            with hxl_proxy.app.test_request_context('/data', query_string={'force': 'on'}):
+                setup_filters(Recipe(request_args=args)).values
+            self.assertEqual(2, mock.call_count)
+            # and the new one is used afterwards
+            setup_filters(Recipe(request_args=args)).values
+            self.assertEqual(2, mock.call_count)
+
+    def test_profiled(self):
+        """Select still uses the snapshot's indexes while profiling"""
+        args = {'url': 'http://example.org/basic-dataset.csv', 'filter01': 'select', 'select-query01-01': '#sector=WASH'}
+        with patch(URL_MOCK_TARGET, new=Mock(side_effect=mock_open_url)), patch(VALIDATOR_TARGET, new=Mock(return_value=('"v1"', None))):
+            profiler = profiling.PipelineProfiler()
+            with profiler:
+                values = setup_filters(Recipe(request_args=args), profiler=profiler).values
+        self.assertEqual(1, len(values))
+        self.assertEqual(['SnapshotDataset', 'SnapshotRowFilter'], [stage.class_name for stage in profiler.stages])
+
+# end
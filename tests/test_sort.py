@@ -0,0 +1,54 @@
+"""
+Unit tests for hxl_proxy.sort module
+
+License: Public Domain
+"""
+
+import hxl, unittest
+from hxl_proxy.sort import ExternalSortFilter
+
+
+DATA = [
+    ['#org', '#sector', '#affected'],
+    ['Org C', 'WASH', '100'],
+    ['Org A', 'Health', '9'],
+    ['Org B', 'WASH', '20'],
+    ['Org A', 'Education', '100'],
+    ['Org D', 'Health', 'unknown'],
+    ['Org B', 'Protection', '20'],
+]
+
+class TestExternalSortFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.source = hxl.data(DATA)
+
+    def assertSameOrder(self, tags, reverse=False, **kwargs):
+        """Compare with libhxl's in-memory sort"""
+        expected = [row.values for row in hxl.filters.SortFilter(hxl.data(DATA), tags, reverse)]
+        filter = ExternalSortFilter(hxl.data(DATA), tags, reverse, **kwargs)
+        self.assertEqual(expected, [row.values for row in filter])
+        return filter
+
+    def test_in_memory(self):
+        self.assertSameOrder('#affected')
+        self.assertSameOrder('#affected', reverse=True)
+        self.assertSameOrder('#sector,#org')
+        self.assertSameOrder([])
+
+    def test_spill(self):
+        # a tiny memory budget forces one run per row
+        filter = self.assertSameOrder('#affected', memory_limit=1)
+        self.assertEqual(6, filter._saved_rows.spill.record_count)
+        self.assertEqual(6, len(filter._saved_rows.spill.paths))
+        # spilled rows can be replayed
+        self.assertEqual(6, len(filter.values))
+        self.assertSameOrder('#affected', reverse=True, memory_limit=1)
+
+    def test_top_rows(self):
+        filter = ExternalSortFilter(self.source, '#affected', limit=3)
+        self.assertEqual(['Org A', 'Org B', 'Org B'], [row.get('#org') for row in filter])
+        filter = ExternalSortFilter(hxl.data(DATA), '#affected', reverse=True, limit=3)
+        self.assertEqual(['Org D', 'Org C', 'Org A'], [row.get('#org') for row in filter])
+
+# end
@@ -0,0 +1,74 @@
+"""
+Unit tests for hxl_proxy.stats module
+
+License: Public Domain
+"""
+
+import hxl, unittest
+from hxl_proxy.stats import HyperLogLog, SpaceSaving, profile_columns
+
+
+class TestSketches(unittest.TestCase):
+
+    def test_hyperloglog(self):
+        for n in (0, 10, 1000, 50000):
+            hll = HyperLogLog()
+            for i in range(n):
+                hll.add(str(i))
+                hll.add(str(i)) # duplicates don't count
+            self.assertAlmostEqual(n, hll.estimate(), delta=max(n * 0.05, 1))
+
+    def test_space_saving(self):
+        sketch = SpaceSaving(5)
+        for i in range(1000):
+            sketch.add('common')
+            sketch.add(str(i))
+            if i % 2:
+                sketch.add('less common')
+        top = sketch.top(2)
+        self.assertEqual(['common', 'less common'], [value for value, count, error in top])
+        for value, count, error in top:
+            self.assertTrue(count - error <= {'common': 1000, 'less common': 500}[value] <= count)
+
+    def test_space_saving_many_values(self):
+        # every new value after the first 1000 replaces a counter
+        sketch = SpaceSaving(1000)
+        for i in range(100000):
+            sketch.add(str(i))
+            if i % 10 == 0:
+                sketch.add('frequent')
+        self.assertEqual(1000, len(sketch.counts))
+        self.assertEqual(min(sketch.counts.values()), sketch.min_count)
+        self.assertEqual(sum(len(bucket) for bucket in sketch.buckets.values()), len(sketch.counts))
+        ((value, count, error,),) = sketch.top(1)
+        self.assertEqual('frequent', value)
+        self.assertTrue(count - error <= 10000 <= count)
+
+
+class TestProfileColumns(unittest.TestCase):
+
+    DATA = [
+        ['#org', '#affected', '#adm1'],
+        ['Org A', '100', 'Coast'],
+        ['Org B', '2.5e2', ''],
+        ['Org A', 'lots', '  Coast '],
+        ['Org C', '-50'],
+    ]
+
+    def test_profile(self):
+        report = profile_columns(hxl.data(self.DATA), top_k=1)
+        self.assertEqual(4, report['row_count'])
+        (org, affected, adm1,) = report['columns']
+
+        self.assertEqual('#org', org['hashtag'])
+        self.assertEqual(3, org['distinct_approx'])
+        self.assertEqual([{'value': 'Org A', 'count': 2, 'error': 0}], org['top'])
+        self.assertIsNone(org['numbers'])
+
+        self.assertEqual({'count': 3, 'min': -50, 'max': 250, 'mean': 100}, affected['numbers'])
+
+        self.assertEqual(2, adm1['empty_count'])
+        self.assertEqual(0.5, adm1['empty_ratio'])
+        self.assertEqual('Coast', adm1['top'][0]['value'])
+
+# end
@@ -0,0 +1,50 @@
+"""
+Unit tests for hxl_proxy.uploads module
+
+License: Public Domain
+"""
+
+import flask, hashlib, hxl_proxy, io, unittest
+from unittest.mock import Mock, patch
+from hxl_proxy import uploads, util
+
+
+class TestHashingSpooledFile(unittest.TestCase):
+
+    DATA = b'#org,#sector\nOrg A,WASH\n' * 100
+
+    def test_hash(self):
+        output = uploads.HashingSpooledFile(max_size=1024)
+        for start in range(0, len(self.DATA), 100):
+            output.write(self.DATA[start:start+100])
+        # spooled to disk
+        self.assertTrue(output._rolled)
+        output.seek(0)
+        self.assertEqual(self.DATA, output.read())
+        self.assertEqual(hashlib.md5(self.DATA).hexdigest(), output.content_hash)
+        # the same hash as reading the file again
+        self.assertEqual(util.make_file_hash(output), output.content_hash)
+
+    def test_overwrite(self):
+        output = uploads.HashingSpooledFile()
+        output.write(self.DATA)
+        output.seek(0)
+        output.write(b'#adm1')
+        self.assertIsNone(output.content_hash)
+
+
+class TestUploadRequest(unittest.TestCase):
+
+    def test_upload_hash(self):
+        data = b'#adm1,#affected\r\nCoast,100\r\n'
+        with hxl_proxy.app.test_request_context('/', method='POST', data={'content': (io.BytesIO(data), 'test.csv')}):
+            upload = flask.request.files['content']
+            with patch('hxl_proxy.util.make_file_hash', new=Mock(side_effect=util.make_file_hash)) as make_hash:
+                self.assertEqual(hashlib.md5(data).hexdigest(), uploads.get_upload_hash(upload))
+                # didn't need to read the upload again
+                self.assertEqual(0, make_hash.call_count)
+            self.assertEqual(data, upload.read())
+
+    def test_other_streams(self):
+        data = b'#adm1\r\nCoast\r\n'
+        self.assertEqual(hashlib.md5(data).hexdigest(), uploads.get_upload_hash(io.BytesIO(data)))
@@ -6,9 +6,13 @@ December 2015
 License: Public Domain
 """
 
-import unittest
+import concurrent.futures, hxl, io, time, unittest
 from collections import OrderedDict
+from unittest.mock import Mock, patch
 import hxl_proxy
+from hxl_proxy.recipes import Recipe
+from hxl_proxy.filters import setup_filters
+from . import URL_MOCK_TARGET, mock_open_url
 
 class TestUtil(unittest.TestCase):
 
@@ -69,6 +73,117 @@ class TestUtil(unittest.TestCase):
         hxl_proxy.app.config['ALLOWED_DOMAINS_LIST'] = ['example.org']
         self.assertFalse(hxl_proxy.util.is_allowed_domain('http://foo.org'))
 
+    def test_fetch_memo(self):
+        """Each URL should be fetched only once in a request."""
+        url = 'http://example.org/basic-dataset.csv'
+        options = hxl_proxy.util.make_input_options({})
+        mock = Mock(side_effect=mock_open_url)
+        with patch(URL_MOCK_TARGET, new=mock):
+            with hxl_proxy.app.test_request_context('/data'):
+                source1 = hxl_proxy.util.hxl_data(url, options)
+                source2 = hxl_proxy.util.hxl_data(url, options)
+                self.assertEqual(source1.values, source2.values)
+                self.assertEqual(['#org', '#sector', '#country'], source2.display_tags)
+                list(hxl_proxy.util.hxl_make_input(url, options))
+            self.assertEqual(1, mock.call_count)
+            # a new request fetches again
+            with hxl_proxy.app.test_request_context('/data'):
+                hxl_proxy.util.hxl_data(url, options).values
+            self.assertEqual(2, mock.call_count)
+            # no memo outside a request
+            hxl_proxy.util.hxl_data(url, options).values
+            hxl_proxy.util.hxl_data(url, options).values
+            self.assertEqual(4, mock.call_count)
+
+    def test_fetch_memo_recipe(self):
+        """A recipe that merges a dataset with itself should fetch it only once."""
+        args = {
+            'url': 'http://example.org/basic-dataset.csv',
+            'filter01': 'merge',
+            'merge-url01': 'http://example.org/basic-dataset.csv',
+            'merge-keys01': '#org',
+            'merge-tags01': '#sector',
+        }
+        mock = Mock(side_effect=mock_open_url)
+        with patch(URL_MOCK_TARGET, new=mock):
+            expected = setup_filters(Recipe(request_args=args)).values
+            self.assertEqual(2, mock.call_count)
+            with hxl_proxy.app.test_request_context('/data'):
+                self.assertEqual(expected, setup_filters(Recipe(request_args=args)).values)
+            self.assertEqual(3, mock.call_count)
+
+    def test_shared_dataset_columns(self):
+        """Views in different threads open the shared source only once"""
+        def make_source():
+            time.sleep(0.05)
+            return hxl.data([['#org'], ['Org A']])
+        make_source = Mock(side_effect=make_source)
+        shared = hxl_proxy.inputs.SharedDataset(make_source)
+        views = [shared.view() for i in range(4)]
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            tags = list(executor.map(lambda view: view.display_tags, views))
+        self.assertEqual([['#org']] * 4, tags)
+        self.assertEqual(1, make_source.call_count)
+
+    def test_shared_dataset_rows(self):
+        """Views share up to max_rows parsed rows, as copies"""
+        data = [['#org'], ['Org A'], ['Org B'], ['Org C']]
+        for max_rows, parse_count in ((10, 1,), (2, 3,), (0, 2,),):
+            make_source = Mock(side_effect=lambda: hxl.data(data))
+            shared = hxl_proxy.inputs.SharedDataset(make_source, max_rows=max_rows)
+            views = [shared.view(), shared.view()]
+            rows = list(views[0])
+            # changing a row in one view doesn't change it in the other
+            rows[0].values[0] = 'Changed'
+            other_rows = list(views[1])
+            self.assertEqual([['Org A'], ['Org B'], ['Org C']], [row.values for row in other_rows])
+            self.assertEqual([0, 1, 2], [row.row_number for row in other_rows])
+            self.assertEqual(parse_count, make_source.call_count)
+
+    def test_hxl_data_list_timeout(self):
+        """The timeout is for the whole list, not for each source"""
+        def open_slowly(raw_source, input_options):
+            time.sleep(0.2)
+            return hxl.data(raw_source)
+        data = [['#org'], ['Org A']]
+        with patch.dict(hxl_proxy.app.config, {'FETCH_MAX_WORKERS': 1}), patch('hxl_proxy.util._open_hxl_data', new=open_slowly):
+            self.assertEqual(2, len(hxl_proxy.util.hxl_data_list([data] * 2, hxl.input.InputOptions(timeout=1))))
+            start = time.monotonic()
+            with self.assertRaises(TimeoutError):
+                hxl_proxy.util.hxl_data_list([data] * 6, hxl.input.InputOptions(timeout=0.3))
+            self.assertLess(time.monotonic() - start, 0.6)
+
+    def test_rewindable_input(self):
+        rows = [['Organisation'], ['#org'], ['Org A'], ['Org B']]
+        input = hxl_proxy.inputs.RewindableInput(hxl.input.ArrayInput(rows))
+        iterator = iter(input)
+        self.assertEqual(rows[:2], [next(iterator), next(iterator)])
+        input.rewind()
+        self.assertEqual(rows, list(input))
+        # after a commit, nothing is kept or replayed
+        input = hxl_proxy.inputs.RewindableInput(hxl.input.ArrayInput(rows))
+        iterator = iter(input)
+        next(iterator)
+        input.commit()
+        self.assertEqual(rows[1:], list(iterator))
+        self.assertIsNone(input._buffer)
+        with self.assertRaises(hxl.HXLException):
+            input.rewind()
+
+    def test_make_input_from_opened(self):
+        """Responses that aren't data are rejected, as libhxl does for URLs"""
+        url = 'http://example.org/report.pdf'
+        opened = (io.BytesIO(b'%PDF-1.4\n'), 'application/pdf', 'pdf', None, None, None,)
+        with self.assertRaises(hxl.input.HXLIOException) as context:
+            hxl_proxy.util.make_input_from_opened(url, opened, None)
+        self.assertEqual(url, context.exception.url)
+        # CSV is still fine
+        url = 'http://example.org/data.csv'
+        opened = (io.BytesIO(b'#org\nOrg A\n'), 'text/csv', 'csv', None, None, None,)
+        input = hxl_proxy.util.make_input_from_opened(url, opened, None)
+        self.assertEqual(url, input.url_or_filename)
+        self.assertEqual([['#org'], ['Org A']], list(input))
+
     # TODO severity_class
 
     # TODO re_search
@@ -0,0 +1,171 @@
+"""
+Unit tests for hxl_proxy.validate module
+
+License: Public Domain
+"""
+
+import hxl, json, unittest, werkzeug
+from hxl_proxy import validate
+from hxl_proxy.validate import StreamingValidator
+
+
+DATA = [
+    ['#org', '#affected', '#sector'],
+    ['Org A', '100', 'WASH'],
+    ['Org B', 'xxx', 'Health'],
+    ['Org C', 'yyy', 'Dance'],
+    ['Org D', '200', 'Music'],
+    ['Org E', 'zzz', 'Shoes'],
+]
+
+SCHEMA = [
+    ['#valid_tag', '#valid_datatype', '#valid_value+list', '#valid_severity'],
+    ['#affected', 'number', '', 'error'],
+    ['#sector', '', 'WASH|Health', 'warning'],
+]
+
+class CountingDataset(hxl.model.Dataset):
+    """Dataset that counts the rows read"""
+
+    def __init__(self, data):
+        super().__init__()
+        self.source = hxl.data(data).cache()
+        self.rows_read = 0
+
+    @property
+    def columns(self):
+        return self.source.columns
+
+    def __iter__(self):
+        for row in self.source:
+            self.rows_read += 1
+            yield row
+
+
+class TestStreamingValidator(unittest.TestCase):
+
+    def make_validator(self, **kwargs):
+        return StreamingValidator(hxl.schema(SCHEMA), **kwargs)
+
+    def test_same_report(self):
+        expected = hxl.validate(hxl.data(DATA), hxl.data(SCHEMA))
+        report = validate.validate_source(hxl.data(DATA), hxl.schema(SCHEMA))
+        del expected['timestamp']
+        del report['timestamp']
+        self.assertEqual(expected, report)
+
+    def test_max_issues(self):
+        source = CountingDataset(DATA)
+        report = self.make_validator(max_issues=2).report(source)
+        self.assertFalse(report['is_valid'])
+        self.assertTrue(report['truncated'])
+        self.assertEqual(2, report['stats']['total'])
+        # stopped reading after the second issue (in the third row)
+        self.assertEqual(3, source.rows_read)
+
+    def test_max_rule_issues(self):
+        source = CountingDataset(DATA)
+        report = self.make_validator(max_rule_issues=1).report(source)
+        self.assertTrue(report['truncated'])
+        self.assertEqual(1, report['stats']['error'])
+        self.assertEqual(1, report['stats']['warning'])
+        # every rule reached its cap by the third row
+        self.assertEqual(3, source.rows_read)
+
+    def test_not_truncated(self):
+        report = self.make_validator(max_issues=100).report(hxl.data(DATA))
+        self.assertFalse(report['truncated'])
+        self.assertEqual(6, report['stats']['total'])
+
+    def test_include_dataset(self):
+        expected = hxl.validate(hxl.data(DATA), hxl.data(SCHEMA))
+        expected['dataset'] = [['', '', '']] + DATA
+        source = CountingDataset(DATA)
+        report = json.loads(''.join(self.make_validator().iter_json(source, include_dataset=True)))
+        del expected['timestamp']
+        del report['timestamp']
+        self.assertEqual(expected, report)
+        # validated and copied in a single pass
+        self.assertEqual(len(DATA) - 1, source.rows_read)
+        # the same report without streaming
+        report = self.make_validator().report(hxl.data(DATA), include_dataset=True)
+        del report['timestamp']
+        self.assertEqual(expected, report)
+
+    def test_include_dataset_truncated(self):
+        # all the rows, even after reaching the cap
+        report = json.loads(''.join(self.make_validator(max_issues=1).iter_json(hxl.data(DATA), include_dataset=True)))
+        self.assertTrue(report['truncated'])
+        self.assertEqual(1, report['stats']['total'])
+        self.assertEqual(len(DATA) + 1, len(report['dataset']))
+
+    def test_ndjson(self):
+        lines = [json.loads(line) for line in self.make_validator().iter_ndjson(hxl.data(DATA), {'data_url': 'x'})]
+        issues = lines[:-1]
+        summary = lines[-1]
+        self.assertEqual(6, len(issues))
+        self.assertEqual(['issue'], list(set(issue['type'] for issue in issues)))
+        self.assertEqual(2, issues[0]['locations'][0]['row'] + 1)
+        self.assertEqual('summary', summary['type'])
+        self.assertFalse(summary['is_valid'])
+        self.assertEqual(3, summary['stats']['error'])
+        self.assertEqual('x', summary['data_url'])
+
+
+class TestRowLimits(unittest.TestCase):
+
+    def test_head(self):
+        source = CountingDataset(DATA)
+        report = StreamingValidator(hxl.schema(SCHEMA)).report(validate.limit_rows(source, head=2))
+        # stopped reading after the row past the head
+        self.assertEqual(3, source.rows_read)
+        self.assertEqual(1, report['stats']['total'])
+        self.assertEqual({'mode': 'head', 'size': 2, 'rows_validated': 2, 'rows_read': None}, report['partial'])
+        # exactly the size of the head
+        report = StreamingValidator(hxl.schema(SCHEMA)).report(validate.limit_rows(hxl.data(DATA), head=5))
+        self.assertEqual({'mode': 'head', 'size': 5, 'rows_validated': 5, 'rows_read': 5}, report['partial'])
+        # smaller than the head
+        report = StreamingValidator(hxl.schema(SCHEMA)).report(validate.limit_rows(hxl.data(DATA), head=10))
+        self.assertEqual({'mode': 'head', 'size': 10, 'rows_validated': 5, 'rows_read': 5}, report['partial'])
+
+    def test_sample(self):
+        def sample_rows():
+            return [row.row_number for row in validate.limit_rows(hxl.data(DATA), sample=3)]
+        row_numbers = sample_rows()
+        self.assertEqual(3, len(row_numbers))
+        # the original order, and the same sample every time
+        self.assertEqual(sorted(row_numbers), row_numbers)
+        self.assertEqual(row_numbers, sample_rows())
+        # the same issues as validating those rows alone
+        expected = hxl.validate(hxl.data([DATA[0]] + [DATA[i + 1] for i in row_numbers]), hxl.data(SCHEMA))
+        report = validate.validate_source(validate.limit_rows(hxl.data(DATA), sample=3), hxl.schema(SCHEMA))
+        self.assertEqual(expected['stats'], report['stats'])
+        self.assertEqual({'mode': 'sample', 'size': 3, 'rows_validated': 3, 'rows_read': 5}, report['partial'])
+
+    def test_ndjson(self):
+        lines = list(StreamingValidator(hxl.schema(SCHEMA)).iter_ndjson(validate.limit_rows(hxl.data(DATA), head=1)))
+        self.assertEqual('head', json.loads(lines[-1])['partial']['mode'])
+
+    def test_no_limits(self):
+        source = hxl.data(DATA)
+        self.assertIs(source, validate.limit_rows(source))
+        self.assertNotIn('partial', validate.validate_source(source, hxl.schema(SCHEMA)))
+
+    def test_get_row_limits(self):
+        self.assertEqual((None, None,), validate.get_row_limits({}))
+        self.assertEqual((10, None,), validate.get_row_limits({'sample': '10'}))
+        for args in ({'sample': '0'}, {'head': 'x'}, {'sample': '10', 'head': '10'},):
+            with self.assertRaises(werkzeug.exceptions.BadRequest):
+                validate.get_row_limits(args)
+
+
+class TestGetIssueLimits(unittest.TestCase):
+
+    def test_limits(self):
+        self.assertEqual((None, None,), validate.get_issue_limits({}))
+        self.assertEqual((10, 2,), validate.get_issue_limits({'max_issues': '10', 'max_rule_issues': '2'}))
+
+    def test_bad_limits(self):
+        for value in ('0', '-1', 'x',):
+            with self.assertRaises(werkzeug.exceptions.BadRequest):
+                validate.get_issue_limits({'max_issues': value})